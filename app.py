@@ -3,6 +3,9 @@ from routes.RInicio import bp as Inicio
 from routes.Principal import bp as Principal
 from routes.VariablesDeInicio import bp as VariablesDeInicio
 from routes.DatosDeCampo import bp as DatosDeCampo
+from routes.Jobs import bp as Jobs
+from routes.Metrics import bp as Metrics
+from utils import metrics
 
 app = Flask(__name__)
 
@@ -10,6 +13,10 @@ app.register_blueprint(Inicio)
 app.register_blueprint(Principal)
 app.register_blueprint(VariablesDeInicio)
 app.register_blueprint(DatosDeCampo)
+app.register_blueprint(Jobs)
+app.register_blueprint(Metrics)
+
+metrics.init_app(app)
 
 if __name__ == "__main__":
     app.run(debug=True, port=7100)
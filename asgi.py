@@ -0,0 +1,232 @@
+"""
+ASGI entry point, next to the WSGI app of app.py:
+
+    uvicorn asgi:app --workers 2
+    gunicorn -c gunicorn.conf.py -k uvicorn_worker.UvicornWorker asgi:app
+
+POST /Calculate, POST /GetAdvice and GET /GetAdviceStream run the async
+pipelines (utils.pipeline_async): while they wait on Gemini, the searches or
+a map capture they hold no thread, so one worker serves dozens of analyses at
+once. Every other request, and the job mode of those routes (`mode=job`),
+goes to the Flask app, run in a thread pool.
+
+Responses have the status codes of the Flask routes: 500 when the pipeline
+raised, 200 otherwise (a missing setup is a status 1 message).
+"""
+
+from io import BytesIO
+from typing import AsyncIterator, List, Optional, Tuple
+from urllib.parse import parse_qs
+import asyncio
+import json
+import time
+
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from app import app as flask_app
+from utils import tools, cache, fields, metrics, pipeline_async
+from utils.ai import context
+
+NO_MAIN_VARIABLES = "No main variables found. Please configure initial data first."
+
+_flask = WsgiToAsgi(flask_app)
+
+
+def _environ(scope: dict, body: bytes) -> dict:
+    """WSGI environ of an ASGI HTTP request, built like WsgiToAsgi builds it."""
+    instance = WsgiToAsgiInstance(flask_app)
+    # build_environ() reads the headers from the instance's scope
+    instance.scope = scope
+    return instance.build_environ(scope, BytesIO(body))
+
+
+def _load_inputs(environ: dict) -> Tuple[Optional[dict], dict, List[str]]:
+    """
+    Main variables and field data of the request's field, loaded like
+    routes/Principal.py does, plus the Set-Cookie headers of its session.
+    """
+    with flask_app.request_context(environ):
+        with metrics.span("principal.load_inputs"):
+            key = fields.field_key()
+            main_data = cache.get_main_variables(key)
+            field_data = cache.get_field_data(key) or {}
+        # Runs the session's after-request hooks (flush and cookie)
+        response = flask_app.process_response(flask_app.response_class())
+    return main_data, field_data, response.headers.getlist("Set-Cookie")
+
+
+def _job_mode(scope: dict, body: bytes) -> bool:
+    """Same opt-in as routes/Principal.py: `mode=job` in the query or JSON body."""
+    query = parse_qs(scope.get("query_string", b"").decode("latin1"))
+    if query.get("mode", [None])[0] == "job":
+        return True
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        return False
+    return isinstance(data, dict) and data.get("mode") == "job"
+
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            return body
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def _replay(body: bytes):
+    """`receive` for the Flask app after the body was read here."""
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    return receive
+
+
+def _headers(content_type: str, cookies: List[str], *extra: Tuple[str, str]) -> list:
+    headers = [("content-type", content_type), *extra]
+    headers += [("set-cookie", cookie) for cookie in cookies]
+    return [(name.encode("latin1"), value.encode("latin1")) for name, value in headers]
+
+
+async def _send_json(send, data: dict, cookies: List[str], status: int = 200):
+    body = json.dumps(data, default=str).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": _headers(
+                "application/json", cookies, ("content-length", str(len(body)))
+            ),
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _run(pipeline_fn, environ: dict, send):
+    cookies: List[str] = []
+    status = 200
+    try:
+        main_data, field_data, cookies = await asyncio.to_thread(_load_inputs, environ)
+        if not main_data:
+            result = tools.msg(1, NO_MAIN_VARIABLES)
+        else:
+            result = await pipeline_fn(main_data, field_data)
+    except Exception as e:
+        result = tools.msg_err(e)
+        status = 500
+    await _send_json(send, result, cookies, status)
+
+
+async def calculate(environ: dict, send):
+    await _run(pipeline_async.calculate, environ, send)
+
+
+async def get_advice(environ: dict, send):
+    await _run(pipeline_async.get_advice, environ, send)
+
+
+async def _single(event: str, data: dict) -> AsyncIterator[Tuple[str, dict]]:
+    yield event, data
+
+
+async def get_advice_stream(environ: dict, send):
+    cookies: List[str] = []
+    try:
+        main_data, field_data, cookies = await asyncio.to_thread(_load_inputs, environ)
+        if not main_data:
+            events = _single("done", tools.msg(1, NO_MAIN_VARIABLES))
+        else:
+            events = pipeline_async.stream_advice(main_data, field_data)
+    except Exception as e:
+        events = _single("done", tools.msg_err(e))
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": _headers(
+                "text/event-stream",
+                cookies,
+                ("cache-control", "no-cache"),
+                ("x-accel-buffering", "no"),
+            ),
+        }
+    )
+    async def send_event(event: str, data: dict):
+        await send(
+            {
+                "type": "http.response.body",
+                "body": tools.sse(event, data).encode(),
+                "more_body": True,
+            }
+        )
+
+    try:
+        async for event, data in events:
+            await send_event(event, data)
+    except Exception as e:
+        await send_event("done", tools.msg_err(e))
+    await send({"type": "http.response.body", "body": b""})
+
+
+# (method, path) -> (metrics endpoint name, handler)
+ROUTES = {
+    ("POST", "/Calculate"): ("Principal.Calculate", calculate),
+    ("POST", "/GetAdvice"): ("Principal.GetAdvice", get_advice),
+    ("GET", "/GetAdviceStream"): ("Principal.GetAdviceStream", get_advice_stream),
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Off the event loop: the first load downloads the tokenizer model
+            context.preload_tokenizer()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+
+    route = ROUTES.get((scope.get("method"), scope.get("path")))
+    if scope["type"] != "http" or route is None:
+        return await _flask(scope, receive, send)
+
+    body = await _read_body(receive)
+    if _job_mode(scope, body):
+        return await _flask(scope, _replay(body), send)
+
+    endpoint, handler = route
+    started = time.perf_counter()
+    metrics.HTTP_IN_FLIGHT.inc()
+    # The status the handler sent; 500 if it failed before answering
+    status = 500
+
+    async def send_and_record(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        await send(message)
+
+    try:
+        await handler(_environ(scope, body), send_and_record)
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec()
+        metrics.observe_request(
+            endpoint, scope["method"], status, time.perf_counter() - started
+        )
@@ -0,0 +1,427 @@
+"""
+Offline benchmark of the /Calculate and /GetAdvice pipeline.
+
+Runs the Flask app in-process against local stand-ins (bench/standins.py):
+mongomock for MongoDB, fake Gemini and DDGS clients with configurable
+latency, and a local HTTP fixture of the CropSmart page for the browser
+capture (or a stub capture when Chromium is not installed).
+
+Each scenario runs the full user flow (save main variables, save field
+data, /Calculate, /GetAdvice) for a set of fields and reports per-endpoint
+and per-stage latency, throughput and memory:
+
+    serial_cold       one flow at a time, empty caches and database
+    serial_warm       the same flows again
+    concurrent_cold   --concurrency flows at a time, empty caches and database
+    concurrent_warm   the same flows again
+    asgi_cold         --asgi-concurrency flows at a time through asgi.py (async
+                      /Calculate and /GetAdvice on one event loop), cold
+    asgi_warm         the same flows again
+
+Usage (from the repository root):
+
+    pip install -r bench/requirements.txt
+    python -m bench.run                          # writes bench/results/<time>.json
+    python -m bench.run --fields 50 --concurrency 8 --model-latency 1.0
+    python -m bench.run --think-time 1.5        # give the prefetch on save a head start
+    python -m bench.run --compare bench/results/a.json bench/results/b.json
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from bench import standins
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CROPS = ("tomate", "maiz", "lechuga")
+
+# Base locations; fields are spread a few hundred meters around them
+LOCATIONS = ((18.7357, -70.1627), (19.4517, -70.6970), (18.4861, -69.9312))
+
+
+class Timings:
+    """Thread-safe latency samples by name."""
+
+    def __init__(self):
+        self._samples: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(name, []).append(seconds)
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - started)
+
+        return timed
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+        return {name: _stats(values) for name, values in sorted(samples.items())}
+
+
+def _stats(values: List[float]) -> dict:
+    def percentile(p: float) -> float:
+        return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+    return {
+        "count": len(values),
+        "mean_ms": round(statistics.fmean(values) * 1000, 2),
+        "p50_ms": round(percentile(0.5) * 1000, 2),
+        "p95_ms": round(percentile(0.95) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+def _fields(count: int, seed: int) -> List[dict]:
+    rng = random.Random(seed)
+    fields = []
+    for i in range(count):
+        lat, lng = LOCATIONS[i % len(LOCATIONS)]
+        fields.append(
+            {
+                "main": {
+                    "width": rng.choice((20, 50, 100)),
+                    "length": rng.choice((20, 40, 80)),
+                    "plant_type": rng.choice(CROPS),
+                    "lat": round(lat + rng.uniform(-0.003, 0.003), 6),
+                    "lng": round(lng + rng.uniform(-0.003, 0.003), 6),
+                },
+                "field": {
+                    "water_ph": round(rng.uniform(5.5, 7.5), 2),
+                    "water_conductivity": round(rng.uniform(0.2, 2.0), 2),
+                    "soil_salinity": round(rng.uniform(0.5, 4.0), 2),
+                    "soil_moisture": round(rng.uniform(15, 40), 1),
+                },
+            }
+        )
+    return fields
+
+
+def _rss_mb() -> float:
+    """Peak resident set size of this process."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.timings = Timings()
+        self.workdir = tempfile.mkdtemp(prefix="bench-")
+        self.map_mode = args.map
+
+        standins.LATENCY.update(
+            model=args.model_latency,
+            upload=args.upload_latency,
+            search=args.search_latency,
+            tile=args.tile_latency,
+        )
+        self.mongo = standins.install()
+        os.environ["CROPSMART_URL"] = standins.start_cropsmart_fixture()
+        logging.disable(logging.WARNING)
+
+        # Images are written relative to the working directory
+        sys.path.insert(0, REPO)
+        os.chdir(self.workdir)
+
+        from app import app
+        from utils import pipeline, cache, tools
+        from utils.ai import main, search_cache
+
+        self.app = app
+        self.pipeline = pipeline
+        self.cache = cache
+        self.tools = tools
+        self.main = main
+        self.search_cache = search_cache
+        self.fake = standins.patch()
+
+        if self.map_mode == "browser" and not self._browser_available():
+            self.map_mode = "stub"
+        if self.map_mode == "stub":
+            pipeline.save_page_screenshot = standins.stub_screenshot
+            from utils.ai import aio
+
+            aio.save_page_screenshot = standins.stub_screenshot_async
+
+        self._instrument()
+
+    def _browser_available(self) -> bool:
+        from utils.ai.tools import get_browser_pool
+
+        try:
+            get_browser_pool().submit(
+                lambda page: page.goto(os.environ["CROPSMART_URL"]), {}
+            ).result(timeout=60)
+            return True
+        except Exception as e:
+            print(f"Chromium not available ({e.__class__.__name__}); using stub captures")
+            return False
+
+    def _instrument(self):
+        p, t = self.pipeline, self.timings
+        p.find_map = t.wrap("stage.map_lookup", p.find_map)
+        p.get_map = t.wrap("stage.map_capture", p.get_map)
+        p.save_page_screenshot = t.wrap("stage.screenshot", p.save_page_screenshot)
+        p.search_many = t.wrap("stage.search", p.search_many)
+        p.analyze = t.wrap("stage.analysis", p.analyze)
+        p.prompt = t.wrap("stage.model", p.prompt)
+        self.main.upload_file = t.wrap("stage.upload", self.main.upload_file)
+        self.cache.put_calculation = t.wrap("stage.store", self.cache.put_calculation)
+
+    def reset(self):
+        """Empty database, caches and images (a cold start)."""
+        db = self.mongo[os.environ["MONGO_DB"]]
+        for name in db.list_collection_names():
+            db[name].delete_many({})
+        self.cache.inputs_cache.clear()
+        self.cache.results_cache.clear()
+        self.search_cache._memory.clear()
+        self.main._uploads.clear()
+        shutil.rmtree(os.path.join(self.workdir, "static"), ignore_errors=True)
+
+    def flow(self, field: dict) -> int:
+        """One user: save inputs, calculate, get advice. Returns the error count."""
+        client = self.app.test_client()
+        errors = 0
+        steps = (
+            ("endpoint.save_main_variables", "/SaveMainVariables", field["main"]),
+            ("endpoint.save_field_data", "/SaveFieldData", field["field"]),
+            ("endpoint.calculate", "/Calculate", {}),
+            ("endpoint.get_advice", "/GetAdvice", {}),
+        )
+        for name, route, body in steps:
+            if route == "/Calculate":
+                time.sleep(self.args.think_time)
+            started = time.perf_counter()
+            response = client.post(route, json=body)
+            self.timings.add(name, time.perf_counter() - started)
+            data = response.get_json(silent=True) or {}
+            if response.status_code != 200 or data.get("status") != 0:
+                errors += 1
+        return errors
+
+    async def async_flow(self, client, field: dict) -> int:
+        """flow() against asgi.py through an ASGI client."""
+        errors = 0
+        steps = (
+            ("endpoint.save_main_variables", "/SaveMainVariables", field["main"]),
+            ("endpoint.save_field_data", "/SaveFieldData", field["field"]),
+            ("endpoint.calculate", "/Calculate", {}),
+            ("endpoint.get_advice", "/GetAdvice", {}),
+        )
+        for name, route, body in steps:
+            if route == "/Calculate":
+                await asyncio.sleep(self.args.think_time)
+            started = time.perf_counter()
+            response = await client.post(route, json=body)
+            self.timings.add(name, time.perf_counter() - started)
+            data = response.json() if response.status_code == 200 else {}
+            if data.get("status") != 0:
+                errors += 1
+        return errors
+
+    async def async_flows(self, fields: List[dict], concurrency: int) -> int:
+        import httpx
+        from asgi import app as asgi_app
+
+        limit = asyncio.Semaphore(concurrency)
+
+        async def run(field: dict) -> int:
+            async with limit:
+                # One client (cookie jar) per user; the session cookie is only
+                # sent over plain http to localhost
+                async with httpx.AsyncClient(
+                    transport=httpx.ASGITransport(app=asgi_app), base_url="http://localhost"
+                ) as client:
+                    return await self.async_flow(client, field)
+
+        return sum(await asyncio.gather(*(run(field) for field in fields)))
+
+    def scenario(
+        self, name: str, fields: List[dict], concurrency: int, cold: bool, asgi: bool = False
+    ) -> dict:
+        if cold:
+            self.reset()
+        self.timings.reset()
+        model_calls = self.fake.models.calls
+        uploads = self.fake.files.uploads
+        searches = standins.FakeDDGS.queries
+
+        if self.args.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            if asgi:
+                errors = asyncio.run(self.async_flows(fields, concurrency))
+            elif concurrency <= 1:
+                errors = sum(self.flow(field) for field in fields)
+            else:
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    errors = sum(executor.map(self.flow, fields))
+        elapsed = time.perf_counter() - started
+        traced_peak = None
+        if self.args.trace_memory:
+            traced_peak = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            tracemalloc.stop()
+        self.tools.log_sink.flush()
+
+        summary = self.timings.summary()
+        result = {
+            "fields": len(fields),
+            "concurrency": concurrency,
+            "cold": cold,
+            "asgi": asgi,
+            "seconds": round(elapsed, 3),
+            "flows_per_second": round(len(fields) / elapsed, 2),
+            "requests_per_second": round(4 * len(fields) / elapsed, 2),
+            "errors": errors,
+            "calls": {
+                "model": self.fake.models.calls - model_calls,
+                "upload": self.fake.files.uploads - uploads,
+                "search": standins.FakeDDGS.queries - searches,
+            },
+            "memory": {"peak_rss_mb": _rss_mb(), "traced_peak_mb": traced_peak},
+            "endpoints": {k.split(".", 1)[1]: v for k, v in summary.items() if k.startswith("endpoint.")},
+            "stages": {k.split(".", 1)[1]: v for k, v in summary.items() if k.startswith("stage.")},
+        }
+        print(
+            f"{name:16s} {result['seconds']:8.2f}s  {result['flows_per_second']:7.2f} flows/s  "
+            f"calculate p50 {result['endpoints'].get('calculate', {}).get('p50_ms', 0):8.1f} ms  "
+            f"errors {errors}"
+        )
+        return result
+
+    def run(self) -> dict:
+        fields = _fields(self.args.fields, self.args.seed)
+        concurrency = self.args.concurrency
+        scenarios = {
+            "serial_cold": self.scenario("serial_cold", fields, 1, cold=True),
+            "serial_warm": self.scenario("serial_warm", fields, 1, cold=False),
+            "concurrent_cold": self.scenario("concurrent_cold", fields, concurrency, cold=True),
+            "concurrent_warm": self.scenario("concurrent_warm", fields, concurrency, cold=False),
+            "asgi_cold": self.scenario(
+                "asgi_cold", fields, self.args.asgi_concurrency, cold=True, asgi=True
+            ),
+            "asgi_warm": self.scenario(
+                "asgi_warm", fields, self.args.asgi_concurrency, cold=False, asgi=True
+            ),
+        }
+        shutil.rmtree(self.workdir, ignore_errors=True)
+        return {"meta": self._meta(), "scenarios": scenarios}
+
+    def _meta(self) -> dict:
+        try:
+            commit = subprocess.run(
+                ["git", "-C", REPO, "rev-parse", "--short", "HEAD"],
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except Exception:
+            commit = None
+        return {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "map_mode": self.map_mode,
+            "args": vars(self.args),
+        }
+
+
+def compare(base_path: str, new_path: str):
+    """Print throughput and p50 latency changes between two result files."""
+    with open(base_path) as f:
+        base = json.load(f)["scenarios"]
+    with open(new_path) as f:
+        new = json.load(f)["scenarios"]
+
+    def change(old, value) -> str:
+        if not old:
+            return "   n/a"
+        return f"{(value - old) / old * 100:+6.1f}%"
+
+    for name in base:
+        if name not in new:
+            continue
+        b, n = base[name], new[name]
+        print(
+            f"{name:16s} flows/s {b['flows_per_second']:8.2f} -> {n['flows_per_second']:8.2f} "
+            f"({change(b['flows_per_second'], n['flows_per_second'])})"
+        )
+        for group in ("endpoints", "stages"):
+            for key in sorted(set(b[group]) & set(n[group])):
+                old, value = b[group][key]["p50_ms"], n[group][key]["p50_ms"]
+                print(f"    {key:22s} p50 {old:9.1f} -> {value:9.1f} ms ({change(old, value)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark.")
+    parser.add_argument("--fields", type=int, default=20, help="Fields (user flows) per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--asgi-concurrency", type=int, default=32,
+                        help="Concurrent flows of the asgi_* scenarios")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--map", choices=("browser", "stub"), default="browser",
+                        help="Capture the local CropSmart fixture with Chromium, or stub it")
+    parser.add_argument("--model-latency", type=float, default=0.3)
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument("--search-latency", type=float, default=0.1)
+    parser.add_argument("--tile-latency", type=float, default=0.02)
+    parser.add_argument("--think-time", type=float, default=0,
+                        help="Pause between saving the inputs and /Calculate (page navigation)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also report tracemalloc peaks (slows the run down)")
+    parser.add_argument("--out", help="Result file (default bench/results/<time>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"),
+                        help="Compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    out = args.out or os.path.join(
+        REPO, "bench", "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    )
+    out = os.path.abspath(out)
+    results = Bench(args).run()
+
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Local stand-ins for the external services used by the pipeline.
+
+install() must run before the app is imported: it points the app at an
+in-memory MongoDB (mongomock) and sets the environment the modules read at
+import time. patch() then replaces the Gemini client, DDGS and the geospatial
+map lookup once the modules are loaded. Every stand-in sleeps for a
+configurable latency so the benchmark exercises the same waiting as
+production.
+"""
+
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import asyncio
+import itertools
+import json
+import math
+import os
+import threading
+import time
+
+# Latencies in seconds (see run.py arguments)
+LATENCY = {
+    "model": 0.3,
+    "upload": 0.05,
+    "search": 0.1,
+    "tile": 0.02,
+}
+
+
+def install():
+    """Environment and in-memory MongoDB; call before importing the app."""
+    import mongomock
+    import pymongo
+
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    os.environ.setdefault("MONGO_URI", "mongodb://bench")
+    os.environ.setdefault("MONGO_DB", "bench")
+    os.environ.setdefault("SECRET_KEY", "bench")
+    # The stand-ins have no quota; set these to measure the rate limiter
+    os.environ.setdefault("GEMINI_RATE_PER_MINUTE", "0")
+    os.environ.setdefault("SEARCH_RATE_PER_MINUTE", "0")
+
+    client = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: client
+    _patch_mongomock()
+    return client
+
+
+def _patch_mongomock():
+    """bulk_write of mongomock 4.x does not accept current pymongo operations."""
+    import mongomock.collection
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        for request in requests:
+            self.update_one(request._filter, request._doc, upsert=request._upsert)
+
+    mongomock.collection.Collection.bulk_write = bulk_write
+
+
+# Gemini ---------------------------------------------------------------------
+
+
+class _Response:
+    def __init__(self, text: str):
+        self.text = text
+        self.candidates = []
+
+
+class _Models:
+    def __init__(self):
+        self.calls = 0
+
+    def _answer(self, config) -> str:
+        self.calls += 1
+        system = getattr(config, "system_instruction", "") or ""
+        if "valid JSON" in system:
+            return json.dumps(
+                {
+                    "temperatura_suelo": "75",
+                    "demanda_producto": "High",
+                    "probabilidad_lluvia": "30",
+                    "efectividad_cultivo": "82",
+                }
+            )
+        return (
+            "Keep the soil moisture steady with drip irrigation and add organic "
+            "matter to improve structure. Test the pH every month and correct it "
+            "with lime if it drops below the optimal range."
+        )
+
+    def generate_content(self, model, contents, config=None):
+        time.sleep(LATENCY["model"])
+        return _Response(self._answer(config))
+
+    def generate_content_stream(self, model, contents, config=None):
+        text = self._answer(config)
+        words = text.split(" ")
+        for i in range(0, len(words), 8):
+            time.sleep(LATENCY["model"] / max(1, len(words) // 8))
+            yield _Response(" ".join(words[i : i + 8]) + " ")
+
+
+class _Files:
+    def __init__(self):
+        self._files = {}
+        self._ids = itertools.count(1)
+        self.uploads = 0
+
+    def upload(self, file):
+        time.sleep(LATENCY["upload"])
+        return self._new_file()
+
+    def _new_file(self):
+        from google.genai import types
+
+        self.uploads += 1
+        name = f"files/bench-{next(self._ids)}"
+        uploaded = types.File(
+            name=name,
+            uri=f"https://bench.invalid/{name}",
+            mime_type="image/webp",
+            state=types.FileState.ACTIVE,
+            expiration_time=datetime.now(timezone.utc) + timedelta(hours=48),
+        )
+        self._files[name] = uploaded
+        return uploaded
+
+    def get(self, name):
+        if name not in self._files:
+            raise KeyError(name)
+        return self._files[name]
+
+
+class _AsyncModels:
+    def __init__(self, models: _Models):
+        self._models = models
+
+    async def generate_content(self, model, contents, config=None):
+        await asyncio.sleep(LATENCY["model"])
+        return _Response(self._models._answer(config))
+
+    async def generate_content_stream(self, model, contents, config=None):
+        words = self._models._answer(config).split(" ")
+
+        async def chunks():
+            for i in range(0, len(words), 8):
+                await asyncio.sleep(LATENCY["model"] / max(1, len(words) // 8))
+                yield _Response(" ".join(words[i : i + 8]) + " ")
+
+        return chunks()
+
+
+class _AsyncFiles:
+    def __init__(self, files: _Files):
+        self._files = files
+
+    async def upload(self, file):
+        await asyncio.sleep(LATENCY["upload"])
+        return self._files._new_file()
+
+
+class _Aio:
+    def __init__(self, models: _Models, files: _Files):
+        self.models = _AsyncModels(models)
+        self.files = _AsyncFiles(files)
+
+
+class FakeGenaiClient:
+    """The subset of google.genai.Client used by utils.ai.main and utils.ai.aio."""
+
+    def __init__(self):
+        self.models = _Models()
+        self.files = _Files()
+        self.aio = _Aio(self.models, self.files)
+
+
+# DDGS -----------------------------------------------------------------------
+
+
+class FakeDDGS:
+    queries = 0
+    _lock = threading.Lock()
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+
+    def text(self, query, max_results=5):
+        time.sleep(LATENCY["search"])
+        with FakeDDGS._lock:
+            FakeDDGS.queries += 1
+        return [
+            {
+                "title": f"Result {i} for {query[:40]}",
+                "href": f"https://example.invalid/{i}",
+                "body": "Local stand-in search result. " * 4,
+            }
+            for i in range(max_results)
+        ]
+
+
+# Geospatial lookup ----------------------------------------------------------
+
+
+def _haversine_m(lat1, lng1, lat2, lng2) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+
+def find_capture(lat, lng, zoom, radius_m=None, max_age_days=None):
+    """utils.maps.find_capture without $nearSphere (unsupported by mongomock)."""
+    from utils import maps
+
+    radius_m = maps.MAP_REUSE_RADIUS_METERS if radius_m is None else radius_m
+    max_age_days = maps.MAP_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    cutoff = datetime.now() - timedelta(days=max_age_days)
+    best = None
+    for doc in maps.maps_col.find({"zoom": zoom, "captured_at": {"$gte": cutoff}}, {"_id": 0}):
+        c_lng, c_lat = doc["location"]["coordinates"]
+        distance = _haversine_m(lat, lng, c_lat, c_lng)
+        if distance <= radius_m and os.path.exists(doc["path"]):
+            if best is None or distance < best[0]:
+                best = (distance, doc)
+    return best[1] if best else None
+
+
+def patch():
+    """Replace Gemini, DDGS and the geo lookup in the loaded modules."""
+    from utils import maps
+    from utils.ai import main
+
+    main.client = FakeGenaiClient()
+    main.DDGS = FakeDDGS
+    maps.find_capture = find_capture
+    return main.client
+
+
+# CropSmart fixture ----------------------------------------------------------
+
+_PAGE = """<!doctype html>
+<html><head><title>CropSmart fixture</title>
+<style>body{margin:0} canvas{display:block}</style></head>
+<body><canvas id="map" width="1280" height="800"></canvas>
+<script>
+const ctx = document.getElementById('map').getContext('2d');
+const view = (location.hash.split('=')[1] || '7.4/0/0').split('/');
+for (let y = 0; y < 4; y++) {
+  for (let x = 0; x < 5; x++) {
+    const img = new Image();
+    img.onload = () => ctx.drawImage(img, x * 256, y * 200, 256, 200);
+    img.src = `/tiles/${view[0]}/${x}/${y}.png?c=${view[1]},${view[2]}`;
+  }
+}
+</script></body></html>"""
+
+
+def _tile(x: int, y: int) -> bytes:
+    from PIL import Image
+
+    image = Image.new("RGB", (256, 256), (40 + 30 * x, 110 + 20 * y, 50))
+    out = BytesIO()
+    image.save(out, "PNG")
+    return out.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/tiles/"):
+            time.sleep(LATENCY["tile"])
+            parts = self.path.split("?")[0].split("/")
+            body = _tile(int(parts[3]), int(parts[4].split(".")[0]))
+            content_type = "image/png"
+        else:
+            body = _PAGE.encode()
+            content_type = "text/html"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_cropsmart_fixture() -> str:
+    """Serve the fixture page on a free local port; returns its URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/CropSmart"
+
+
+def stub_screenshot(url, out_path, latency=True, **kwargs) -> str:
+    """save_page_screenshot replacement when no browser is available."""
+    from PIL import Image
+
+    if latency:
+        time.sleep(LATENCY["tile"] * 20)
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    Image.new("RGB", (1280, 800), (60, 130, 60)).save(out_path)
+    return os.path.abspath(out_path)
+
+
+async def stub_screenshot_async(url, out_path, **kwargs) -> str:
+    """utils.ai.aio.save_page_screenshot replacement (see stub_screenshot)."""
+    await asyncio.sleep(LATENCY["tile"] * 20)
+    return await asyncio.to_thread(stub_screenshot, url, out_path, latency=False)
@@ -0,0 +1,57 @@
+"""
+Gunicorn settings read automatically from the working directory.
+
+Workers write their Prometheus samples to PROMETHEUS_MULTIPROC_DIR so that
+/metrics reports all of them (see utils/metrics.py). The directory is
+emptied when the master starts; samples of exited workers are merged and
+their live gauges dropped.
+
+GUNICORN_PRELOAD=true imports the app once in the master and forks the
+workers from it, so they start without importing anything and share the
+loaded modules. The heavy client libraries (PRELOAD_MODULES) are imported
+in the master as well; the clients themselves (MongoDB, Gemini, browsers)
+are still created lazily in each worker, after the fork.
+
+Every worker starts loading the prompt tokenizer (utils.ai.context) on a
+background thread as soon as it is forked, so no request waits for it.
+"""
+
+import importlib
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+_metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus-multiproc"
+)
+shutil.rmtree(_metrics_dir, ignore_errors=True)
+os.makedirs(_metrics_dir, exist_ok=True)
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() in ("1", "true", "yes")
+
+# Shared with utils.ai.tools, whose map captures give up well before it
+timeout = int(os.getenv("WORKER_TIMEOUT_SECONDS", "120"))
+
+# Imported by the master in preload mode (no connections are opened)
+PRELOAD_MODULES = ("google.genai", "ddgs", "playwright.sync_api")
+
+
+def on_starting(server):
+    if not preload_app:
+        return
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            server.log.warning("Could not preload %s: %s", name, e)
+
+
+def post_fork(server, worker):
+    from utils.ai import context
+
+    context.preload_tokenizer()
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,5 +1,5 @@
 from flask import Blueprint, render_template, request
-from utils import tools
+from utils import tools, cache, fields
 from utils.conexion import field_data_col
 from datetime import datetime
 
@@ -10,7 +10,7 @@ bp = Blueprint("DatosDeCampo", __name__)
 def field_data():
     try:
         # Load existing data from database
-        data = field_data_col.find_one({}, {"_id": 0})
+        data = cache.get_field_data(fields.field_key())
         
         if data and "updated_at" in data:
             del data["updated_at"]
@@ -26,7 +26,10 @@ def save_field_data():
     try:
         data: dict = request.get_json()
 
+        key = fields.field_key()
+
         doc = {
+            **key,
             "water_ph": float(data.get("water_ph", 0))
             if data.get("water_ph")
             else None,
@@ -42,7 +45,10 @@ def save_field_data():
             "updated_at": datetime.now(),
         }
 
-        field_data_col.update_one({}, {"$set": doc}, upsert=True)
+        field_data_col.update_one(key, {"$set": doc}, upsert=True)
+        cache.invalidate_inputs(key)
+        # No prefetch: the warmed-up stages do not use the field data, and a
+        # new schedule would cancel the one started by /SaveMainVariables
 
         return tools.msg(0, "Field data saved successfully")
     except Exception as e:
@@ -52,7 +58,7 @@ def save_field_data():
 @bp.route("/GetFieldData", methods=["GET"])
 def get_field_data():
     try:
-        data = field_data_col.find_one({}, {"_id": 0})
+        data = cache.get_field_data(fields.field_key())
 
         if data:
             # Remove updated_at from response for cleaner data
@@ -0,0 +1,64 @@
+from flask import Blueprint, Response
+from utils import tools, fields
+from utils.jobs import get_job
+from os import getenv
+import time
+
+bp = Blueprint("Jobs", __name__)
+
+JOB_POLL_INTERVAL = float(getenv("JOB_POLL_INTERVAL", "0.5"))
+# Keep streams shorter than the gunicorn worker timeout; clients fall back to polling
+JOB_STREAM_TIMEOUT = float(getenv("JOB_STREAM_TIMEOUT", "100"))
+
+
+@bp.route("/GetJob/<job_id>", methods=["GET"])
+def GetJob(job_id: str):
+    try:
+        job = get_job(job_id, fields.current_owner())
+        if not job:
+            return tools.msg(1, "Job not found"), 404
+        return tools.msg(0, "Job retrieved successfully", job=job)
+    except Exception as e:
+        return tools.msg_err(e)
+
+
+@bp.route("/JobStream/<job_id>", methods=["GET"])
+def JobStream(job_id: str):
+    # Read before streaming: the generator runs outside the request context
+    owner = fields.current_owner()
+    if not get_job(job_id, owner):
+        return tools.msg(1, "Job not found"), 404
+
+    def generate():
+        deadline = time.monotonic() + JOB_STREAM_TIMEOUT
+        last = None
+        while time.monotonic() < deadline:
+            job = get_job(job_id, owner)
+            if not job:
+                yield tools.sse("done", tools.msg(1, "Job not found"))
+                return
+
+            if job["status"] in ("done", "error"):
+                yield tools.sse("done", job["result"] or tools.msg(1, "Job failed"))
+                return
+
+            current = (job["status"], job["stage"], job["progress"])
+            if current != last:
+                last = current
+                yield tools.sse(
+                    "progress",
+                    {
+                        "status": job["status"],
+                        "stage": job["stage"],
+                        "progress": job["progress"],
+                    },
+                )
+            time.sleep(JOB_POLL_INTERVAL)
+
+        yield tools.sse("timeout", {"job_id": job_id})
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,20 @@
+from flask import Blueprint, Response, request
+from utils import metrics
+from os import getenv
+import hmac
+
+bp = Blueprint("Metrics", __name__)
+
+# Optional bearer token required to scrape /metrics
+METRICS_TOKEN = getenv("METRICS_TOKEN")
+
+
+@bp.route("/metrics", methods=["GET"])
+def Metrics():
+    if METRICS_TOKEN:
+        expected = f"Bearer {METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+            return Response("Unauthorized\n", status=401, mimetype="text/plain")
+
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
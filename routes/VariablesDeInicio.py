@@ -1,5 +1,5 @@
 from flask import Blueprint, render_template, request
-from utils import tools
+from utils import tools, cache, fields, prefetch
 from utils.conexion import main_variables_col
 from datetime import datetime
 
@@ -10,15 +10,20 @@ bp = Blueprint("VariablesDeInicio", __name__)
 def initial_variables():
     try:
         # Load existing data from database
-        data = main_variables_col.find_one({}, {"_id": 0})
+        key = fields.field_key()
+        data = cache.get_main_variables(key)
         
         if data and "updated_at" in data:
             del data["updated_at"]
         
-        return render_template("VariablesDeInicio.html", main_data=data or {})
+        return render_template(
+            "VariablesDeInicio.html", main_data=data or {}, field_id=key["field_id"]
+        )
     except Exception as e:
         print(f"Error loading main variables: {e}")
-        return render_template("VariablesDeInicio.html", main_data={})
+        return render_template(
+            "VariablesDeInicio.html", main_data={}, field_id=fields.DEFAULT_FIELD_ID
+        )
 
 
 @bp.route("/SaveMainVariables", methods=["POST"])
@@ -32,8 +37,11 @@ def save_main_variables():
             if field not in data:
                 return tools.msg(1, f"Missing required field: {field}")
 
+        key = fields.field_key()
+
         # Prepare document to save
         doc = {
+            **key,
             "width": float(data["width"]),
             "length": float(data["length"]),
             "plant_type": data["plant_type"],
@@ -42,12 +50,13 @@ def save_main_variables():
             "updated_at": datetime.now(),
         }
 
-        # Update or insert (only one document should exist)
-        main_variables_col.update_one(
-            {},  # Empty filter matches the first/only document
-            {"$set": doc},
-            upsert=True,
-        )
+        # Update or insert the current field of this owner
+        main_variables_col.update_one(key, {"$set": doc}, upsert=True)
+        cache.invalidate_inputs(key)
+        fields.select_field(key["field_id"])
+
+        # Start the map and searches while the user moves on to /Principal
+        prefetch.schedule(key, doc)
 
         return tools.msg(0, "Main variables saved successfully")
     except Exception as e:
@@ -57,8 +66,8 @@ def save_main_variables():
 @bp.route("/GetMainVariables", methods=["GET"])
 def get_main_variables():
     try:
-        # Get the single document from the collection
-        data = main_variables_col.find_one({}, {"_id": 0})
+        # Get the current field's document
+        data = cache.get_main_variables(fields.field_key())
 
         if data:
             # Remove updated_at from response for cleaner data
@@ -69,3 +78,28 @@ def get_main_variables():
             return tools.msg(0, "No data found", data=None)
     except Exception as e:
         return tools.msg_err(e)
+
+
+@bp.route("/GetFields", methods=["GET"])
+def get_fields():
+    try:
+        page = tools.t_int(request.args.get("page", 1))
+        page_size = tools.t_int(request.args.get("page_size", 20))
+        result = fields.list_fields(fields.current_owner(), page, page_size or 20)
+        return tools.msg(0, "Fields retrieved successfully", **result)
+    except Exception as e:
+        return tools.msg_err(e)
+
+
+@bp.route("/SelectField", methods=["POST"])
+def select_field():
+    try:
+        data: dict = request.get_json()
+        field_id = str(data.get("field_id") or "").strip()
+        if not field_id:
+            return tools.msg(1, "Missing required field: field_id")
+
+        fields.select_field(field_id)
+        return tools.msg(0, "Field selected successfully", field_id=field_id)
+    except Exception as e:
+        return tools.msg_err(e)
@@ -17,11 +17,103 @@ const tools = {
                     }
                 },
                 error: (xhr, status, error) => {
+                    // Failed requests answer with a status 1 message
+                    if (xhr.responseJSON && xhr.responseJSON.status === 1) {
+                        resolve(xhr.responseJSON);
+                    } else {
+                        reject(error);
+                    }
+                }
+            });
+        });
+    },
+    PostJob: async (route, data, onProgress = () => {}, onQueued = () => {}) => {
+        // Queue the request as a background job and wait for its result,
+        // polling its status, or streaming progress over SSE when the server
+        // offers a stream (threaded/async deployments)
+        const queued = await tools.PostBack(route, { ...data, mode: 'job' });
+        if (queued.status === 1 || !queued.job_id) {
+            return queued;
+        }
+        onQueued(queued);
+
+        const poll = () => new Promise((resolve, reject) => {
+            const timer = setInterval(async () => {
+                let resp;
+                try {
+                    resp = await tools.GetJob(queued.status_url);
+                } catch (error) {
+                    clearInterval(timer);
                     reject(error);
+                    return;
+                }
+                if (resp.status === 1) {
+                    clearInterval(timer);
+                    resolve(resp);
+                    return;
+                }
+                onProgress(resp.job);
+                if (resp.job.status === 'done' || resp.job.status === 'error') {
+                    clearInterval(timer);
+                    resolve(resp.job.result);
+                }
+            }, 1000);
+        });
+
+        if (!queued.stream_url || !window.EventSource) {
+            return poll();
+        }
+
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(queued.stream_url);
+            source.addEventListener('progress', e => onProgress(JSON.parse(e.data)));
+            source.addEventListener('done', e => {
+                source.close();
+                resolve(JSON.parse(e.data));
+            });
+            const fallback = () => {
+                source.close();
+                poll().then(resolve, reject);
+            };
+            source.addEventListener('timeout', fallback);
+            source.onerror = fallback;
+        });
+    },
+    Stream: (url, onChunk = () => {}) => {
+        // Read an SSE response of "chunk" events ending with a "done" event;
+        // rejects if the connection fails first
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(url);
+            source.addEventListener('chunk', e => onChunk(JSON.parse(e.data).text));
+            source.addEventListener('done', e => {
+                source.close();
+                resolve(JSON.parse(e.data));
+            });
+            source.onerror = () => {
+                source.close();
+                reject(new Error('Stream interrupted'));
+            };
+        });
+    },
+    Get: async (url) => {
+        return new Promise((resolve, reject) => {
+            $.ajax({
+                type: "GET",
+                url: url,
+                dataType: "json",
+                success: resolve,
+                error: (xhr, status, error) => {
+                    // Failed requests (e.g. unknown jobs, 404) answer with a status 1 message
+                    if (xhr.responseJSON && xhr.responseJSON.status === 1) {
+                        resolve(xhr.responseJSON);
+                    } else {
+                        reject(error);
+                    }
                 }
             });
         });
     },
+    GetJob: async (url) => tools.Get(url),
     Enter: (queryselector, callback) => {
         $(queryselector).keyup(e => {
             if (e.key === 'Enter') {
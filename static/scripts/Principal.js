@@ -1,4 +1,5 @@
 async function Calculate() {
+    // Served by the async path; the page shows the local estimate until then
     const resp = await tools.PostBack('/Calculate', {});
     if (resp.status === 1) {
         notification.error(resp.msg);
@@ -75,7 +76,7 @@ async function GetAdvice() {
     `);
 
     try {
-        const resp = await tools.PostBack('/GetAdvice', {});
+        const resp = await StreamAdvice();
 
         if (resp.status === 1) {
             $('#adviceContent').html(`
@@ -103,6 +104,37 @@ async function GetAdvice() {
     }
 }
 
+async function StreamAdvice() {
+    // Show the advice as it is written, falling back to a background job
+    const getJob = () => tools.PostJob('/GetAdvice', {}, job => {
+        if (job.stage) {
+            $('#adviceContent p').text(`Analyzing your crop data... (${job.progress}%)`);
+        }
+    });
+
+    if (!window.EventSource) {
+        return getJob();
+    }
+
+    let text = '';
+    try {
+        return await tools.Stream('/GetAdviceStream', chunk => {
+            if (!text) {
+                $('#adviceContent').html(`
+                    <div class="text-start w-100">
+                        <p class="mb-0" style="line-height: 1.6;"></p>
+                    </div>
+                `);
+            }
+            text += chunk;
+            $('#adviceContent p').text(text);
+        });
+    } catch (error) {
+        console.error('Advice stream interrupted, using a background job:', error);
+        return getJob();
+    }
+}
+
 async function SetTodayDate() {
     const today = new Date();
 
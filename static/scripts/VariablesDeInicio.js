@@ -1,5 +1,52 @@
 // Data is already loaded from backend and populated in HTML
 // No need to fetch again on page load
 $(() => {
-    console.log('VariablesDeInicio page loaded');
+    LoadFields();
+
+    $('#ddl_field').on('change', async function () {
+        await SelectField($(this).val());
+    });
+
+    $('#btn-new-field').on('click', async () => {
+        const name = (prompt('Name of the new field') || '').trim();
+        if (name) {
+            await SelectField(name);
+        }
+    });
 });
+
+async function LoadFields() {
+    const ddl = $('#ddl_field');
+    const current = ddl.attr('data-current');
+    try {
+        const resp = await tools.Get('/GetFields?page_size=100');
+        if (resp.status !== 0) {
+            return;
+        }
+        ddl.empty();
+        const ids = resp.fields.map(f => f.field_id);
+        // The selected field may not be saved yet
+        if (!ids.includes(current)) {
+            ids.unshift(current);
+        }
+        ids.forEach(id => {
+            ddl.append($('<option>', { value: id, text: id, selected: id === current }));
+        });
+    } catch (error) {
+        console.error('Error loading fields:', error);
+    }
+}
+
+async function SelectField(fieldId) {
+    try {
+        const resp = await tools.PostBack('/SelectField', { field_id: fieldId });
+        if (resp.status === 0) {
+            window.location.reload();
+        } else {
+            notification.error(resp.msg || 'Error selecting field');
+        }
+    } catch (error) {
+        console.error('Error selecting field:', error);
+        notification.error('Error selecting field');
+    }
+}
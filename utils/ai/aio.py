@@ -0,0 +1,196 @@
+"""
+Async counterparts of utils.ai.main and utils.ai.tools for the ASGI app (see
+asgi.py and utils.pipeline_async). Awaiting them holds no thread:
+
+    prompt / prompt_stream   Gemini's async client (client.aio)
+    search_many              asyncio fan-out over the shared search pool
+                             (ddgs has no async API)
+
+Calls go through the same governors (utils.ai.governor) as the sync ones.
+    save_page_screenshot     awaits the capture on the shared BrowserPool
+
+Upload reuse, the search cache and their MongoDB documents are the ones of
+utils.ai.main; those short lookups run in worker threads.
+"""
+
+from typing import AsyncIterator, Dict, List, Optional
+import asyncio
+import logging
+import time
+
+from utils import metrics
+from utils.ai import main, search_cache, tools, governor
+
+logger = logging.getLogger(__name__)
+
+
+async def _client():
+    """main.get_client() off the event loop (the first call imports google.genai)."""
+    if main.client is None:
+        return await asyncio.to_thread(main.get_client)
+    return main.client
+
+
+async def upload_file(file_path: str):
+    """main.upload_file() with an async upload."""
+    sha256, uploaded_file = await asyncio.to_thread(main.reusable_upload, file_path)
+    if uploaded_file is not None:
+        return uploaded_file
+
+    client = await _client()
+    with metrics.span("gemini.upload"):
+        uploaded_file = await governor.gemini.call_async(
+            client.aio.files.upload, file=file_path
+        )
+    await asyncio.to_thread(main.remember_upload, sha256, uploaded_file)
+    logger.info(f"Uploaded file: {file_path}")
+    return uploaded_file
+
+
+async def _build_request(
+    prompt_param: str,
+    files: Optional[List[str]] = None,
+    system_prompt: Optional[str] = None,
+):
+    """main._build_request() without tools."""
+    content_parts = []
+    for file_path in files or []:
+        try:
+            content_parts.append(await upload_file(file_path))
+        except Exception as e:
+            logger.error(f"Failed to upload {file_path}: {e}")
+    content_parts.append(prompt_param)
+    return content_parts, main.generation_config(None, system_prompt)
+
+
+async def prompt(
+    prompt_param: str,
+    files: Optional[List[str]] = None,
+    system_prompt: Optional[str] = None,
+) -> str:
+    """
+    main.prompt() without tools (the pipelines do not use them).
+
+    Returns:
+        The generated response from Gemini
+    """
+    client = await _client()
+    content_parts, config = await _build_request(prompt_param, files, system_prompt)
+    try:
+        with metrics.span("gemini.generate"):
+            response = await governor.gemini.call_async(
+                client.aio.models.generate_content,
+                model=main.GEMINI_MODEL,
+                contents=content_parts,
+                config=config,
+            )
+        return response.text if response.text else "Could not generate a response"
+    except Exception as e:
+        logger.error(f"Error generating content: {e}")
+        raise
+
+
+async def prompt_stream(
+    prompt_param: str,
+    files: Optional[List[str]] = None,
+    system_prompt: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """main.prompt_stream(): yields text chunks as they arrive."""
+    client = await _client()
+    content_parts, config = await _build_request(prompt_param, files, system_prompt)
+    started = time.perf_counter()
+    first = True
+    try:
+        async with governor.gemini.guard_async():
+            stream = await client.aio.models.generate_content_stream(
+                model=main.GEMINI_MODEL, contents=content_parts, config=config
+            )
+            async for chunk in stream:
+                if first:
+                    metrics.observe(
+                        "gemini.stream_first_chunk", time.perf_counter() - started
+                    )
+                    first = False
+                if chunk.text:
+                    yield chunk.text
+        metrics.observe("gemini.stream", time.perf_counter() - started)
+    except Exception as e:
+        logger.error(f"Error streaming content: {e}")
+        raise
+
+
+async def search_many(
+    queries: Dict[str, str],
+    max_results: int = 5,
+    per_query_timeout: int = 10,
+    deadline: float = 15,
+    classes: Optional[Dict[str, str]] = None,
+) -> Dict[str, List[Dict[str, str]]]:
+    """main.search_many() for the event loop (same arguments and results)."""
+    classes = classes or {}
+    cached, pending = await asyncio.to_thread(main.cached_searches, queries, classes)
+    results = main.SearchResults(cached)
+    if not pending:
+        logger.info(f"search_many: {len(queries)} queries served from cache")
+        return results
+
+    started = time.monotonic()
+    deadline_at = started + deadline
+    loop = asyncio.get_running_loop()
+    tasks = {
+        name: loop.run_in_executor(
+            main.search_executor,
+            main.search_task,
+            query,
+            max_results,
+            per_query_timeout,
+            deadline_at,
+        )
+        for name, query in pending.items()
+    }
+    with metrics.span("search.batch"):
+        await asyncio.wait(tasks.values(), timeout=deadline)
+
+    fresh = []
+    for name, task in tasks.items():
+        if not task.done():
+            # Its HTTP timeout ends at the deadline, so the thread is freed shortly
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            logger.warning(f"Search '{name}' exceeded the {deadline}s deadline")
+            results.errors[name] = f"no answer within {deadline}s"
+            continue
+        try:
+            results[name] = task.result()
+        except Exception as e:
+            logger.error(f"Error searching internet ({name}): {e}")
+            results.errors[name] = str(e) or type(e).__name__
+            continue
+        if name in classes:
+            fresh.append((classes[name], pending[name], results[name]))
+
+    if fresh:
+        await asyncio.to_thread(_store_searches, fresh)
+
+    logger.info(
+        f"search_many: {len(pending)}/{len(queries)} queries in "
+        f"{time.monotonic() - started:.2f}s"
+    )
+    return results
+
+
+def _store_searches(entries: List[tuple]):
+    for query_class, query, results in entries:
+        search_cache.put(query_class, query, results)
+
+
+async def save_page_screenshot(url: str, out_path: str = "screenshot.png", **options) -> str:
+    """tools.save_page_screenshot() awaiting the pooled capture."""
+    timeout_ms = options.get("timeout_ms", tools.SCREENSHOT_TIMEOUT_MS)
+    try:
+        with metrics.span("browser.capture"):
+            future = tools.submit_page_screenshot(url, out_path, **options)
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), timeout=tools.capture_deadline(timeout_ms)
+            )
+    except Exception as e:
+        raise tools.capture_error(e) from e
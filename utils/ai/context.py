@@ -0,0 +1,236 @@
+"""
+Compact, token-budgeted context for the model prompts.
+
+Search results used to be inlined as indented JSON, URLs included, so the
+prompt grew with whatever DuckDuckGo returned. search_context() renders them
+as one "- title: snippet" line per result instead:
+
+    - URLs and repeated whitespace are dropped, snippets are cut at
+      PROMPT_SNIPPET_CHARS
+    - duplicates and near duplicates (also across searches) are dropped
+    - lines are ranked by the query terms they mention and whether they carry
+      figures, and the searches take turns adding their best remaining line
+      until PROMPT_CONTEXT_TOKENS is spent
+
+finish() tidies a (prompt, system prompt) pair and records its size in the
+prompt_tokens{prompt=...} histogram (utils.metrics).
+
+Tokens are counted with the SDK's local tokenizer for GEMINI_MODEL (it needs
+sentencepiece and protobuf, see requirements.txt), otherwise estimated at 4
+characters per token. The count_tokens API is not used: it would add a round
+trip to every prompt. The tokenizer model is downloaded and loaded on a
+background thread started by preload_tokenizer() when a worker starts
+(gunicorn.conf.py, asgi.py), never in a request or on the event loop; prompts
+built before it is ready use the estimate.
+
+Configuration:
+    PROMPT_CONTEXT_TOKENS    Token budget of the search results (default 600)
+    PROMPT_SNIPPET_CHARS     Longest snippet kept (default 280)
+    PROMPT_TOKEN_COUNTER     "sdk" (default) or "estimate"
+"""
+
+from os import getenv
+from typing import List, Optional, Sequence, Set, Tuple
+import logging
+import math
+import re
+import threading
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+PROMPT_CONTEXT_TOKENS = int(getenv("PROMPT_CONTEXT_TOKENS", "600"))
+PROMPT_SNIPPET_CHARS = int(getenv("PROMPT_SNIPPET_CHARS", "280"))
+PROMPT_TOKEN_COUNTER = getenv("PROMPT_TOKEN_COUNTER", "sdk").lower()
+
+SEARCH_UNAVAILABLE = "Search unavailable. Estimate it from the location, plant type and season."
+NO_RESULTS = "No results found."
+OVER_BUDGET = "Results left out (prompt budget)."
+
+# Lines sharing this much of their words with a kept line are dropped
+_NEAR_DUPLICATE = 0.8
+_URL = re.compile(r"(https?://|www\.)\S+")
+_SPACE = re.compile(r"\s+")
+_WORD = re.compile(r"\w+")
+# Query words that say nothing about the topic
+_STOPWORDS = {
+    "the", "and", "for", "following", "location", "latitude", "longitude", "crop", "in",
+}
+
+# None until loaded, False if unavailable (the estimate is used)
+_tokenizer = None
+_tokenizer_thread: Optional[threading.Thread] = None
+_tokenizer_lock = threading.Lock()
+
+
+def _load_tokenizer():
+    global _tokenizer
+    try:
+        from google.genai.local_tokenizer import LocalTokenizer
+        from utils.ai.main import GEMINI_MODEL
+
+        _tokenizer = LocalTokenizer(model_name=GEMINI_MODEL)
+        logger.info(f"Local tokenizer for {GEMINI_MODEL} loaded")
+    except Exception as e:
+        _tokenizer = False
+        logger.warning(f"Local tokenizer unavailable ({e}), estimating prompt tokens")
+
+
+def preload_tokenizer():
+    """Start loading the local tokenizer on a background thread (once per process)."""
+    global _tokenizer, _tokenizer_thread
+    if PROMPT_TOKEN_COUNTER != "sdk":
+        _tokenizer = False
+        return
+    with _tokenizer_lock:
+        if _tokenizer_thread is None:
+            _tokenizer_thread = threading.Thread(
+                target=_load_tokenizer, name="tokenizer-load", daemon=True
+            )
+            _tokenizer_thread.start()
+
+
+def count_tokens(text: str) -> int:
+    """Text tokens of `text` for GEMINI_MODEL (see module docstring)."""
+    global _tokenizer
+    if not text:
+        return 0
+    tokenizer = _tokenizer
+    if tokenizer is None:
+        # Not preloaded in this process: load it for the next prompts
+        preload_tokenizer()
+    elif tokenizer:
+        try:
+            return tokenizer.count_tokens(text).total_tokens
+        except Exception as e:
+            _tokenizer = False
+            logger.warning(f"Token count failed ({e}), estimating prompt tokens")
+    return math.ceil(len(text) / 4)
+
+
+def _clean(text: Optional[str]) -> str:
+    return _SPACE.sub(" ", _URL.sub("", text or "")).strip()
+
+
+def _truncate(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    cut = text[:limit].rsplit(" ", 1)[0]
+    return cut.rstrip(" ,;:.") + "…"
+
+
+def _words(text: str) -> Set[str]:
+    return set(_WORD.findall(text.lower()))
+
+
+def _is_near_duplicate(words: Set[str], kept: List[Set[str]]) -> bool:
+    for other in kept:
+        union = len(words | other)
+        if union and len(words & other) / union >= _NEAR_DUPLICATE:
+            return True
+    return False
+
+
+def search_lines(results: Sequence[dict], query: str = "") -> List[str]:
+    """
+    Ranked, cleaned "title: snippet" lines of one search (no duplicates).
+
+    Args:
+        results: search_many() results of the query ({title, url, snippet})
+        query: The query text, whose words rank the lines
+
+    Returns:
+        Lines, most relevant first
+    """
+    terms = {w for w in _words(query) if len(w) > 2 and w not in _STOPWORDS}
+    scored = []
+    seen: List[Set[str]] = []
+    for position, result in enumerate(results):
+        title = _clean(result.get("title"))
+        snippet = _truncate(_clean(result.get("snippet")), PROMPT_SNIPPET_CHARS)
+        line = f"{title}: {snippet}" if title and snippet else title or snippet
+        words = _words(line)
+        if not words or _is_near_duplicate(words, seen):
+            continue
+        seen.append(words)
+        score = len(terms & words) / len(terms) if terms else 0
+        if any(c.isdigit() for c in snippet):
+            # Figures (temperatures, percentages, prices) are what the model needs
+            score += 0.5
+        scored.append((-score, position, line))
+    return [line for _, _, line in sorted(scored)]
+
+
+def search_context(
+    searches: Sequence[Tuple[str, Optional[Sequence[dict]], str]],
+    budget: int = PROMPT_CONTEXT_TOKENS,
+) -> str:
+    """
+    Search results as prompt text within a token budget.
+
+    Args:
+        searches: (title, results or None if the search failed, query text)
+        budget: Tokens the result lines may use in total
+
+    Returns:
+        One block per search:
+
+            Soil temperature:
+            - <title>: <snippet>
+    """
+    candidates = [search_lines(results or [], query) for _, results, query in searches]
+    chosen: List[List[str]] = [[] for _ in searches]
+    kept: List[Set[str]] = []
+    used = 0
+
+    # Round robin, best line of each search first, so every search gets a say
+    for rank in range(max((len(lines) for lines in candidates), default=0)):
+        for i, lines in enumerate(candidates):
+            if rank >= len(lines):
+                continue
+            words = _words(lines[rank])
+            # A search always keeps its best line, even if another one says the same
+            if chosen[i] and _is_near_duplicate(words, kept):
+                continue
+            cost = count_tokens(lines[rank]) + 1
+            if used + cost > budget:
+                continue
+            kept.append(words)
+            chosen[i].append(lines[rank])
+            used += cost
+
+    blocks = []
+    for (title, results, _), lines in zip(searches, chosen):
+        if results is None:
+            body = SEARCH_UNAVAILABLE
+        elif not results:
+            body = NO_RESULTS
+        elif not lines:
+            body = OVER_BUDGET
+        else:
+            body = "\n".join(f"- {line}" for line in lines)
+        blocks.append(f"{title}:\n{body}")
+    return "\n\n".join(blocks)
+
+
+def _dedent(text: str) -> str:
+    return "\n".join(line.strip() for line in text.strip().splitlines())
+
+
+def finish(name: str, prompt_param: str, system_prompt: str) -> Tuple[str, str]:
+    """
+    Strip the templates' indentation and record the prompt size.
+
+    Args:
+        name: Prompt name for the prompt_tokens metric (e.g. "analysis")
+
+    Returns:
+        (prompt, system prompt)
+    """
+    prompt_param = _dedent(prompt_param)
+    system_prompt = _dedent(system_prompt)
+    tokens = count_tokens(prompt_param) + count_tokens(system_prompt)
+    metrics.prompt_tokens(name, tokens)
+    logger.info(f"{name} prompt: {tokens} tokens")
+    return prompt_param, system_prompt
@@ -0,0 +1,420 @@
+"""
+Rate limiting, retries and circuit breaking for the external providers.
+
+Every Gemini request and DuckDuckGo query goes through the provider's
+Governor:
+
+    response = governor.gemini.call(client.models.generate_content, ...)
+    response = await governor.gemini.call_async(client.aio.models.generate_content, ...)
+    with governor.gemini.guard():       # no retries, e.g. a stream
+        ...
+
+A call
+    1. fails fast with CircuitOpen while the provider's breaker is open: after
+       <PROVIDER>_BREAKER_FAILURES consecutive failures it stays open for
+       <PROVIDER>_BREAKER_COOLDOWN_SECONDS, then lets one trial call through
+       (success closes it, failure opens it again)
+    2. takes a token from the provider's bucket, waiting for it if needed, or
+       raises Throttled when the wait would exceed GOVERNOR_MAX_WAIT_SECONDS
+       (DeadlineExceeded when it would end after the caller's deadline).
+       The bucket is shared by all workers (one document per provider in
+       rate_limits_col; a process limits itself if MongoDB is unreachable)
+    3. is retried with jittered exponential backoff on retryable errors
+       (429/5xx, timeouts, connection errors, search rate limits) while the
+       retry fits in <PROVIDER>_RETRY_BUDGET_SECONDS
+
+Other errors (e.g. a 400 for a bad request) are raised at once and do not
+count against the breaker. Outcomes are exported as dependency_calls_total,
+dependency_throttled_total and circuit_breaker_trips_total (utils.metrics).
+
+Configuration (<PROVIDER> is GEMINI or SEARCH):
+    <PROVIDER>_RATE_PER_MINUTE         Sustained requests per minute, all
+                                       workers (0 disables the bucket)
+    <PROVIDER>_BURST                   Requests allowed at once above the rate
+    <PROVIDER>_RETRIES                 Retries after the first attempt
+    <PROVIDER>_RETRY_BUDGET_SECONDS    No retry starts after this long
+    <PROVIDER>_BREAKER_FAILURES        Consecutive failures that open the breaker
+    <PROVIDER>_BREAKER_COOLDOWN_SECONDS
+    GOVERNOR_MAX_WAIT_SECONDS          Longest wait for a token (default 10)
+    GOVERNOR_BACKOFF_BASE_SECONDS      First backoff (default 0.5, doubles)
+    GOVERNOR_BACKOFF_MAX_SECONDS       Backoff cap (default 8)
+"""
+
+from contextlib import asynccontextmanager, contextmanager
+from os import getenv
+from typing import Any, Callable, Optional
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from utils import metrics
+from utils.conexion import rate_limits_col
+
+logger = logging.getLogger(__name__)
+
+GOVERNOR_MAX_WAIT_SECONDS = float(getenv("GOVERNOR_MAX_WAIT_SECONDS", "10"))
+GOVERNOR_BACKOFF_BASE_SECONDS = float(getenv("GOVERNOR_BACKOFF_BASE_SECONDS", "0.5"))
+GOVERNOR_BACKOFF_MAX_SECONDS = float(getenv("GOVERNOR_BACKOFF_MAX_SECONDS", "8"))
+
+# HTTP status codes worth retrying
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+# Exception classes (matched by name, so neither httpx nor ddgs is imported
+# here) raised for timeouts, dropped connections and search rate limits
+RETRYABLE_ERRORS = {"TimeoutException", "TransportError", "RatelimitException"}
+
+# Compare-and-set attempts on the shared bucket before limiting locally
+_CAS_ATTEMPTS = 8
+
+
+class ProviderUnavailable(RuntimeError):
+    """A call refused by the governor without reaching the provider."""
+
+
+class CircuitOpen(ProviderUnavailable):
+    pass
+
+
+class Throttled(ProviderUnavailable):
+    pass
+
+
+class DeadlineExceeded(ProviderUnavailable):
+    pass
+
+
+def retryable(error: BaseException) -> bool:
+    """True for errors a later attempt may not get (see RETRYABLE_*)."""
+    if isinstance(error, ProviderUnavailable):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(code, int) and code in RETRYABLE_CODES:
+        return True
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+def _setting(provider: str, name: str, default: str) -> float:
+    return float(getenv(f"{provider.upper()}_{name}", default))
+
+
+class Governor:
+    """Token bucket, retries and circuit breaker of one provider."""
+
+    def __init__(
+        self,
+        name: str,
+        rate_per_minute: float,
+        burst: int,
+        retries: int,
+        retry_budget: float,
+        breaker_failures: int,
+        breaker_cooldown: float,
+    ):
+        self.name = name
+        # Token bucket as GCRA: `tat` is when the bucket will be full again;
+        # each call moves it `interval` ahead, and a call may start once it is
+        # at most `burst` intervals ahead of now
+        self.interval = 60 / rate_per_minute if rate_per_minute > 0 else 0
+        self.burst = max(1, burst)
+        self.retries = retries
+        self.retry_budget = retry_budget
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+
+        self._lock = threading.Lock()
+        self._local_tat = 0.0
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "Governor":
+        return cls(
+            name,
+            rate_per_minute=_setting(name, "RATE_PER_MINUTE", defaults["rate_per_minute"]),
+            burst=int(_setting(name, "BURST", defaults["burst"])),
+            retries=int(_setting(name, "RETRIES", defaults["retries"])),
+            retry_budget=_setting(name, "RETRY_BUDGET_SECONDS", defaults["retry_budget"]),
+            breaker_failures=int(_setting(name, "BREAKER_FAILURES", defaults["breaker_failures"])),
+            breaker_cooldown=_setting(
+                name, "BREAKER_COOLDOWN_SECONDS", defaults["breaker_cooldown"]
+            ),
+        )
+
+    # Circuit breaker
+
+    def _admit(self):
+        """Raise CircuitOpen unless a call may go to the provider now."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.breaker_cooldown or self._trial_running:
+                metrics.dependency_call(self.name, "short_circuited")
+                raise CircuitOpen(
+                    f"{self.name} is unavailable (circuit open after "
+                    f"{self._failures} consecutive failures)"
+                )
+            # Half open: this call is the trial
+            self._trial_running = True
+
+    def _succeeded(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"{self.name}: circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def _failed(self):
+        with self._lock:
+            self._failures += 1
+            trial = self._trial_running
+            self._trial_running = False
+            if trial or (self._opened_at is None and self._failures >= self.breaker_failures):
+                self._opened_at = time.monotonic()
+                metrics.breaker_tripped(self.name)
+                logger.warning(
+                    f"{self.name}: circuit opened for {self.breaker_cooldown:.0f}s "
+                    f"after {self._failures} consecutive failures"
+                )
+
+    def _released(self):
+        """A call ended without telling anything about the provider."""
+        with self._lock:
+            self._trial_running = False
+
+    # Token bucket
+
+    def _reserve(self, deadline: Optional[float] = None) -> float:
+        """Take a token; return how long to wait before using it."""
+        if not self.interval:
+            return 0.0
+        try:
+            wait = self._reserve_shared(deadline)
+        except PyMongoError as e:
+            logger.warning(f"{self.name}: shared rate limit unavailable ({e}), limiting locally")
+            wait = None
+        if wait is None:
+            wait = self._reserve_local(deadline)
+        if wait > 0:
+            metrics.throttled(self.name, "delayed", wait)
+        return wait
+
+    def _next_tat(self, tat: float, now: float, deadline: Optional[float] = None) -> tuple:
+        """
+        (new tat, wait) for a call at `now`. Raise Throttled if the wait is too
+        long, DeadlineExceeded if it ends after `deadline` (time.monotonic());
+        the token is not taken then.
+        """
+        new_tat = max(tat, now) + self.interval
+        wait = new_tat - now - self.burst * self.interval
+        if wait > GOVERNOR_MAX_WAIT_SECONDS:
+            metrics.throttled(self.name, "rejected")
+            raise Throttled(
+                f"{self.name} rate limit: next request in {wait:.1f}s "
+                f"(limit {60 / self.interval:g}/min)"
+            )
+        if deadline is not None and wait > 0 and time.monotonic() + wait >= deadline:
+            metrics.throttled(self.name, "deadline")
+            raise DeadlineExceeded(
+                f"{self.name} rate limit: next request in {wait:.1f}s, after the deadline"
+            )
+        return new_tat, max(0.0, wait)
+
+    def _reserve_shared(self, deadline: Optional[float] = None) -> Optional[float]:
+        for _ in range(_CAS_ATTEMPTS):
+            now = time.time()
+            doc = rate_limits_col.find_one({"_id": self.name})
+            if doc is None:
+                new_tat, wait = self._next_tat(now, now, deadline)
+                try:
+                    rate_limits_col.insert_one({"_id": self.name, "tat": new_tat})
+                except DuplicateKeyError:
+                    continue
+                return wait
+
+            new_tat, wait = self._next_tat(doc["tat"], now, deadline)
+            updated = rate_limits_col.update_one(
+                {"_id": self.name, "tat": doc["tat"]}, {"$set": {"tat": new_tat}}
+            )
+            if updated.modified_count:
+                return wait
+        # Heavy contention on the document
+        return None
+
+    def _reserve_local(self, deadline: Optional[float] = None) -> float:
+        with self._lock:
+            self._local_tat, wait = self._next_tat(self._local_tat, time.time(), deadline)
+        return wait
+
+    # Calls
+
+    def _backoff(
+        self,
+        attempt: int,
+        started: float,
+        error: BaseException,
+        deadline: Optional[float] = None,
+    ) -> Optional[float]:
+        """Seconds to sleep before retry `attempt`, or None to give up."""
+        if attempt > self.retries or not retryable(error):
+            return None
+        # Full jitter: callers failing together do not retry together
+        delay = random.uniform(
+            0, min(GOVERNOR_BACKOFF_MAX_SECONDS, GOVERNOR_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+        )
+        now = time.monotonic()
+        if now - started + delay > self.retry_budget:
+            return None
+        if deadline is not None and now + delay >= deadline:
+            return None
+        metrics.dependency_call(self.name, "retried")
+        logger.warning(
+            f"{self.name}: attempt {attempt} failed ({error}), retrying in {delay:.2f}s"
+        )
+        return delay
+
+    def _outcome(self, error: Optional[BaseException]):
+        if error is None:
+            metrics.dependency_call(self.name, "ok")
+            self._succeeded()
+        elif retryable(error):
+            metrics.dependency_call(self.name, "error")
+            self._failed()
+        else:
+            # The provider answered (e.g. 400): it is up
+            metrics.dependency_call(self.name, "client_error")
+            self._succeeded()
+
+    def _acquire(self, deadline: Optional[float] = None):
+        self._admit()
+        try:
+            wait = self._reserve(deadline)
+        except BaseException:
+            self._released()
+            raise
+        if wait:
+            time.sleep(wait)
+
+    @contextmanager
+    def guard(self):
+        """Breaker and bucket, without retries, around a block (e.g. a stream)."""
+        self._acquire()
+        try:
+            yield
+        except Exception as e:
+            self._outcome(e)
+            raise
+        except BaseException:
+            # Closed early or cancelled: says nothing about the provider
+            self._released()
+            raise
+        self._outcome(None)
+
+    def call(
+        self, fn: Callable[..., Any], *args, deadline: Optional[float] = None, **kwargs
+    ) -> Any:
+        """
+        fn(*args, **kwargs) under the breaker, the bucket and retries.
+
+        `deadline` (time.monotonic()) stops the retries, and raises
+        DeadlineExceeded if it has passed before an attempt starts or would
+        pass while waiting for a token.
+        """
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceeded(f"{self.name}: deadline passed before attempt {attempt}")
+            self._acquire(deadline)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self._outcome(e)
+                delay = self._backoff(attempt, started, e, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self._released()
+                raise
+            self._outcome(None)
+            return result
+
+    async def _acquire_async(self, deadline: Optional[float] = None):
+        self._admit()
+        try:
+            wait = await asyncio.to_thread(self._reserve, deadline)
+        except BaseException:
+            self._released()
+            raise
+        if wait:
+            await asyncio.sleep(wait)
+
+    @asynccontextmanager
+    async def guard_async(self):
+        """guard() for the event loop."""
+        await self._acquire_async()
+        try:
+            yield
+        except Exception as e:
+            self._outcome(e)
+            raise
+        except BaseException:
+            self._released()
+            raise
+        self._outcome(None)
+
+    async def call_async(
+        self, fn: Callable[..., Any], *args, deadline: Optional[float] = None, **kwargs
+    ) -> Any:
+        """call() for a coroutine function (same `deadline`)."""
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceeded(f"{self.name}: deadline passed before attempt {attempt}")
+            await self._acquire_async(deadline)
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                self._outcome(e)
+                delay = self._backoff(attempt, started, e, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled: says nothing about the provider
+                self._released()
+                raise
+            self._outcome(None)
+            return result
+
+
+gemini = Governor.from_env(
+    "gemini",
+    rate_per_minute="60",
+    burst="10",
+    retries="3",
+    retry_budget="30",
+    breaker_failures="5",
+    breaker_cooldown="30",
+)
+search = Governor.from_env(
+    "search",
+    rate_per_minute="30",
+    burst="6",
+    retries="2",
+    retry_budget="8",
+    breaker_failures="5",
+    breaker_cooldown="60",
+)
@@ -1,12 +1,18 @@
 from os import getenv
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional, Set, Tuple
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+import hashlib
 import logging
+import threading
+import time
 
-from ddgs import DDGS
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
+
+from utils import metrics
+from utils.conexion import uploads_col, utcnow
+from utils.ai import search_cache, governor
 
 
 # Basic logging for diagnostics
@@ -14,16 +20,71 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-# Load env and init Gemini client
 load_dotenv()
 GEMINI_API_KEY = getenv("GEMINI_API_KEY")
 
-if not GEMINI_API_KEY:
-    raise RuntimeError(
-        "GEMINI_API_KEY is not set in your environment/.env. Please set it to use Gemini."
-    )
+GEMINI_MODEL = "gemini-2.5-flash"
+
+# Fail slow model calls so callers can fall back (see utils.scoring)
+GEMINI_TIMEOUT_SECONDS = float(getenv("GEMINI_TIMEOUT_SECONDS", "90"))
+
+# google.genai alone is most of the app's import time, so the Gemini client and
+# the search package are loaded on first use (get_client / _ddgs): workers and
+# requests that never reach the model do not pay for them.
+client = None
+DDGS = None
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide Gemini client, creating it on first use."""
+    global client
+    if client is None:
+        with _clients_lock:
+            if client is None:
+                if not GEMINI_API_KEY:
+                    raise RuntimeError(
+                        "GEMINI_API_KEY is not set in your environment/.env. "
+                        "Please set it to use Gemini."
+                    )
+                from google import genai
+                from google.genai import types
+
+                client = genai.Client(
+                    api_key=GEMINI_API_KEY,
+                    http_options=types.HttpOptions(
+                        timeout=int(GEMINI_TIMEOUT_SECONDS * 1000)
+                    ),
+                )
+    return client
+
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+def _ddgs(**kwargs):
+    """A new DDGS session (the package is imported on first use)."""
+    global DDGS
+    if DDGS is None:
+        with _clients_lock:
+            if DDGS is None:
+                from ddgs import DDGS as ddgs_class
+
+                DDGS = ddgs_class
+    return DDGS(**kwargs)
+
+# Shared pool for concurrent searches (see search_many)
+SEARCH_MAX_WORKERS = int(getenv("SEARCH_MAX_WORKERS", "8"))
+search_executor = ThreadPoolExecutor(
+    max_workers=SEARCH_MAX_WORKERS, thread_name_prefix="search"
+)
+
+# Uploaded files must stay valid at least this long to be reused
+UPLOAD_EXPIRY_MARGIN = timedelta(
+    seconds=int(getenv("UPLOAD_EXPIRY_MARGIN_SECONDS", "600"))
+)
+
+# content sha256 -> (File, expiration as naive UTC) validated by this process
+_uploads: Dict[str, tuple] = {}
+_uploads_lock = threading.Lock()
+_uploads_indexes_ready = False
 
 
 class Tool(Enum):
@@ -54,50 +115,290 @@ class Tool(Enum):
     }
 
 
+def _format_results(results: List[Dict]) -> List[Dict[str, str]]:
+    """Map raw DDGS results to the {title, url, snippet} shape used by prompts."""
+    return [
+        {
+            "title": r.get("title", ""),
+            "url": r.get("href", ""),
+            "snippet": r.get("body", ""),
+        }
+        for r in results
+    ]
+
+
 def search_internet(query: str, max_results: int = 5) -> List[Dict[str, str]]:
-    """Implementation of internet search using DuckDuckGo."""
-    try:
-        with DDGS() as ddgs:
-            results = list(ddgs.text(query, max_results=max_results))
-            return [
-                {
-                    "title": r.get("title", ""),
-                    "url": r.get("href", ""),
-                    "snippet": r.get("body", ""),
-                }
-                for r in results
-            ]
-    except Exception as e:
-        logger.error(f"Error searching internet: {e}")
-        return []
+    """
+    Implementation of internet search using DuckDuckGo.
 
+    Raises:
+        The search error (after retries), so that it is not mistaken for a
+        search without results
+    """
+    return search_task(query, max_results)
 
-def prompt(
-    prompt_param: str,
-    files: Optional[List[str]] = None,
-    tools: Optional[str] = None,
-    system_prompt: Optional[str] = None,
-):
+
+class SearchResults(dict):
     """
-    Generate a response using Gemini with optional file uploads and tools.
+    search_many() result: name -> results of the queries that succeeded.
+
+    Failed queries are left out (an empty list means the search found
+    nothing) and listed in `errors` as name -> error message. `cached` holds
+    the names served from the search cache.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.errors: Dict[str, str] = {}
+        self.cached: Set[str] = set(self)
+
+    def stages(self) -> Dict[str, str]:
+        """Name -> "cached", "computed" or "failed" (pipeline stage report)."""
+        stages = {name: "cached" if name in self.cached else "computed" for name in self}
+        stages.update({name: "failed" for name in self.errors})
+        return stages
+
+
+def search_many(
+    queries: Dict[str, str],
+    max_results: int = 5,
+    per_query_timeout: int = 10,
+    deadline: float = 15,
+    classes: Optional[Dict[str, str]] = None,
+) -> Dict[str, List[Dict[str, str]]]:
+    """
+    Run several DuckDuckGo searches concurrently.
 
     Args:
-        prompt: The user prompt/query
-        files: List of file paths to upload to the client
-        tools: Tool configuration (str or callable)
-        system_prompt: System instructions for the model
+        queries: Mapping of name -> query text
+        max_results: Maximum number of results per query
+        per_query_timeout: HTTP timeout (seconds) applied to each query
+        deadline: Overall time budget (seconds) for the whole batch; no
+            query (or retry) runs past it, so a slow query does not hold
+            a search pool thread after the batch has given up on it
+        classes: Optional mapping of name -> query class (e.g. "weather");
+            named queries are served from / stored in the search cache
+            with that class's TTL (see utils.ai.search_cache)
 
     Returns:
-        The generated response from Gemini
+        SearchResults with the queries that succeeded. Queries that fail or
+        are still running when the deadline expires are in its `errors`.
+    """
+    classes = classes or {}
+    cached, pending = cached_searches(queries, classes)
+    results = SearchResults(cached)
+    if not pending:
+        logger.info(f"search_many: {len(queries)} queries served from cache")
+        return results
+
+    started = time.monotonic()
+    deadline_at = started + deadline
+
+    futures = {
+        name: search_executor.submit(
+            search_task, query, max_results, per_query_timeout, deadline_at
+        )
+        for name, query in pending.items()
+    }
+    with metrics.span("search.batch"):
+        wait(futures.values(), timeout=deadline)
+
+    for name, future in futures.items():
+        if not future.done():
+            # Its HTTP timeout ends at the deadline, so the thread is freed shortly
+            logger.warning(f"Search '{name}' exceeded the {deadline}s deadline")
+            results.errors[name] = f"no answer within {deadline}s"
+            continue
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            logger.error(f"Error searching internet ({name}): {e}")
+            results.errors[name] = str(e) or type(e).__name__
+            continue
+        if name in classes:
+            search_cache.put(classes[name], pending[name], results[name])
+
+    logger.info(
+        f"search_many: {len(pending)}/{len(queries)} queries in "
+        f"{time.monotonic() - started:.2f}s"
+    )
+    return results
+
+
+def cached_searches(
+    queries: Dict[str, str], classes: Dict[str, str]
+) -> Tuple[Dict[str, List[Dict[str, str]]], Dict[str, str]]:
+    """(results served from the search cache, queries still to run)."""
+    results: Dict[str, List[Dict[str, str]]] = {}
+    pending: Dict[str, str] = {}
+    for name, query in queries.items():
+        cached = search_cache.get(classes[name], query) if name in classes else None
+        if cached is not None:
+            results[name] = cached
+        else:
+            pending[name] = query
+    return results, pending
+
+
+def _no_results(error: BaseException) -> bool:
+    """
+    Whether `error` is ddgs reporting a search without hits.
+
+    ddgs raises its base DDGSException with this message when every engine
+    answered but nothing was found (matched by name, like the governor does).
     """
-    # Upload files if provided
+    return type(error).__name__ == "DDGSException" and str(error) == "No results found."
+
+
+def search_task(
+    query: str,
+    max_results: int,
+    timeout: Optional[float] = None,
+    deadline_at: Optional[float] = None,
+) -> List[Dict[str, str]]:
+    """
+    One governed search.
+
+    Args:
+        timeout: HTTP timeout (seconds) of each attempt (DDGS default if None)
+        deadline_at: time.monotonic() after which no attempt runs; each
+            attempt's timeout is cut to end there
+    """
+
+    def attempt() -> list:
+        kwargs = {}
+        if deadline_at is not None:
+            remaining = deadline_at - time.monotonic()
+            kwargs["timeout"] = max(0.1, min(timeout or remaining, remaining))
+        elif timeout is not None:
+            kwargs["timeout"] = timeout
+        # The timeout is per DDGS session, hence one session per attempt
+        try:
+            return list(_ddgs(**kwargs).text(query, max_results=max_results))
+        except Exception as e:
+            if _no_results(e):
+                # A search without hits is an answer: cached, not retried
+                return []
+            raise
+
+    with metrics.span("search.query"):
+        return _format_results(governor.search.call(attempt, deadline=deadline_at))
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def upload_file(file_path: str):
+    """
+    Upload a file to Gemini, reusing a previous upload of the same content.
+
+    Upload handles are cached by content hash in this process and in
+    uploads_col (shared by all workers). A cached handle is reused only while
+    it is ACTIVE and not within UPLOAD_EXPIRY_MARGIN of its server-side expiry;
+    otherwise the file is uploaded again.
+
+    Args:
+        file_path: Local path of the file
+
+    Returns:
+        The Gemini File reference to pass in `contents`
+    """
+    sha256, uploaded_file = reusable_upload(file_path)
+    if uploaded_file is not None:
+        return uploaded_file
+
+    with metrics.span("gemini.upload"):
+        uploaded_file = governor.gemini.call(get_client().files.upload, file=file_path)
+    remember_upload(sha256, uploaded_file)
+    logger.info(f"Uploaded file: {file_path}")
+    return uploaded_file
+
+
+def reusable_upload(file_path: str) -> tuple:
+    """(content sha256, cached File or None) for a file (see upload_file)."""
+    from google.genai import types
+
+    sha256 = _file_sha256(file_path)
+    valid_after = utcnow() + UPLOAD_EXPIRY_MARGIN
+
+    with _uploads_lock:
+        cached = _uploads.get(sha256)
+    if cached and cached[1] and cached[1] > valid_after:
+        metrics.cache_hit("gemini_upload", True)
+        return sha256, cached[0]
+
+    doc = uploads_col.find_one({"sha256": sha256})
+    if doc and doc.get("expiration_time") and doc["expiration_time"] > valid_after:
+        try:
+            # Confirm the handle still exists server side before reusing it
+            with metrics.span("gemini.files_get"):
+                uploaded_file = get_client().files.get(name=doc["name"])
+            if uploaded_file.state == types.FileState.ACTIVE:
+                expiration = _naive_utc(uploaded_file.expiration_time)
+                with _uploads_lock:
+                    _uploads[sha256] = (uploaded_file, expiration)
+                logger.info(f"Reusing uploaded file for: {file_path}")
+                metrics.cache_hit("gemini_upload", True)
+                return sha256, uploaded_file
+        except Exception as e:
+            logger.warning(f"Cached upload {doc['name']} is no longer valid: {e}")
+
+    metrics.cache_hit("gemini_upload", False)
+    return sha256, None
+
+
+def remember_upload(sha256: str, uploaded_file):
+    """Cache a new upload in this process and in uploads_col."""
+    global _uploads_indexes_ready
+    expiration = _naive_utc(uploaded_file.expiration_time)
+    with _uploads_lock:
+        _uploads[sha256] = (uploaded_file, expiration)
+
+    if not _uploads_indexes_ready:
+        uploads_col.create_index("sha256", unique=True)
+        uploads_col.create_index("expiration_time", expireAfterSeconds=0)
+        _uploads_indexes_ready = True
+
+    uploads_col.update_one(
+        {"sha256": sha256},
+        {
+            "$set": {
+                "sha256": sha256,
+                "name": uploaded_file.name,
+                "uri": uploaded_file.uri,
+                "mime_type": uploaded_file.mime_type,
+                "expiration_time": expiration,
+                "uploaded_at": utcnow(),
+            }
+        },
+        upsert=True,
+    )
+
+
+def _build_request(
+    prompt_param: str,
+    files: Optional[List[str]] = None,
+    tools: Optional[str] = None,
+    system_prompt: Optional[str] = None,
+):
+    """Contents and config for a generate_content call (see prompt)."""
+    # Upload files if provided (reusing earlier uploads of the same content)
     uploaded_files = []
     if files:
         for file_path in files:
             try:
-                uploaded_file = client.files.upload(file=file_path)
-                uploaded_files.append(uploaded_file)
-                logger.info(f"Uploaded file: {file_path}")
+                uploaded_files.append(upload_file(file_path))
             except Exception as e:
                 logger.error(f"Failed to upload {file_path}: {e}")
 
@@ -111,6 +412,13 @@ def prompt(
     # Add the text prompt
     content_parts.append(prompt_param)
 
+    return content_parts, generation_config(tools, system_prompt)
+
+
+def generation_config(tools: Optional[str] = None, system_prompt: Optional[str] = None):
+    """GenerateContentConfig for the system prompt and tools, or None."""
+    from google.genai import types
+
     # Prepare generation config
     config_params = {}
 
@@ -129,13 +437,41 @@ def prompt(
             config_params["tools"] = tools
 
     # Create config object
-    config = types.GenerateContentConfig(**config_params) if config_params else None
+    return types.GenerateContentConfig(**config_params) if config_params else None
+
+
+def prompt(
+    prompt_param: str,
+    files: Optional[List[str]] = None,
+    tools: Optional[str] = None,
+    system_prompt: Optional[str] = None,
+):
+    """
+    Generate a response using Gemini with optional file uploads and tools.
+
+    Args:
+        prompt: The user prompt/query
+        files: List of file paths to upload to the client
+        tools: Tool configuration (str or callable)
+        system_prompt: System instructions for the model
+
+    Returns:
+        The generated response from Gemini
+    """
+    from google.genai import types
+
+    content_parts, config = _build_request(prompt_param, files, tools, system_prompt)
+    client = get_client()
 
     # Generate response
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash", contents=content_parts, config=config
-        )
+        with metrics.span("gemini.generate"):
+            response = governor.gemini.call(
+                client.models.generate_content,
+                model=GEMINI_MODEL,
+                contents=content_parts,
+                config=config,
+            )
         
         # Check if response contains function calls
         function_calls = []
@@ -158,23 +494,30 @@ def prompt(
                 if function_call.name == "search_internet":
                     query = function_call.args.get("query", "")
                     max_results = function_call.args.get("max_results", 5)
-                    function_result = search_internet(query, max_results)
+                    try:
+                        function_response = {"result": search_internet(query, max_results)}
+                    except Exception as e:
+                        # Tell the model the search failed, not that it found nothing
+                        logger.error(f"Error searching internet: {e}")
+                        function_response = {"error": f"Search failed: {e}"}
                     
                     # Create function response
                     function_response_part = types.Part(
                         function_response=types.FunctionResponse(
                             name=function_call.name,
-                            response={"result": function_result}
+                            response=function_response
                         )
                     )
                     content_parts.append(function_response_part)
             
             # Get final response from model with function results
-            final_response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=content_parts,
-                config=config
-            )
+            with metrics.span("gemini.generate_after_tools"):
+                final_response = governor.gemini.call(
+                    client.models.generate_content,
+                    model=GEMINI_MODEL,
+                    contents=content_parts,
+                    config=config
+                )
             
             # Debug logging
             logger.info(f"Final response text: {final_response.text}")
@@ -199,3 +542,45 @@ def prompt(
     except Exception as e:
         logger.error(f"Error generating content: {e}")
         raise
+
+
+def prompt_stream(
+    prompt_param: str,
+    files: Optional[List[str]] = None,
+    system_prompt: Optional[str] = None,
+) -> Iterator[str]:
+    """
+    Generate a response with Gemini, yielding text chunks as they arrive.
+
+    Same as prompt() without tools: function calls need the complete response
+    before the answer can be generated, which defeats streaming.
+
+    Args:
+        prompt_param: The user prompt/query
+        files: List of file paths to upload to the client
+        system_prompt: System instructions for the model
+
+    Yields:
+        Text chunks of the generated response
+    """
+    content_parts, config = _build_request(prompt_param, files, None, system_prompt)
+    client = get_client()
+    started = time.perf_counter()
+    first = True
+    try:
+        # Not retried: chunks may already have been sent to the client
+        with governor.gemini.guard():
+            for chunk in client.models.generate_content_stream(
+                model=GEMINI_MODEL, contents=content_parts, config=config
+            ):
+                if first:
+                    metrics.observe(
+                        "gemini.stream_first_chunk", time.perf_counter() - started
+                    )
+                    first = False
+                if chunk.text:
+                    yield chunk.text
+        metrics.observe("gemini.stream", time.perf_counter() - started)
+    except Exception as e:
+        logger.error(f"Error streaming content: {e}")
+        raise
@@ -0,0 +1,113 @@
+"""
+Persistent cache for internet search results.
+
+Entries are keyed by query class and normalized query text and expire after a
+per-class TTL (weather changes within hours, market demand within days).
+Location queries should be built from bucket_coordinates() so that nearby
+fields share the same query, and therefore the same cache entry:
+
+    lat, lng = bucket_coordinates(18.73571, -70.16272)   # -> (18.7, -70.2)
+
+Results live in search_cache_col (shared by all workers, cleaned up by a TTL
+index) with an in-process LRU in front of it.
+
+Configuration:
+    SEARCH_GRID_DEG            Grid cell size in degrees (default 0.1, ~11 km)
+    SEARCH_TTL_<CLASS>         TTL in seconds for a query class, e.g.
+                               SEARCH_TTL_WEATHER=10800
+"""
+
+from datetime import timedelta
+from os import getenv
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import re
+
+from utils import metrics
+from utils.cache import LRUCache
+from utils.conexion import search_cache_col, utcnow
+
+SEARCH_GRID_DEG = float(getenv("SEARCH_GRID_DEG", "0.1"))
+
+_DEFAULT_TTL_SECONDS = {
+    "weather": 3 * 60 * 60,
+    "soil_temperature": 12 * 60 * 60,
+    "market_demand": 3 * 24 * 60 * 60,
+}
+SEARCH_DEFAULT_TTL_SECONDS = int(getenv("SEARCH_DEFAULT_TTL_SECONDS", str(60 * 60)))
+
+_memory = LRUCache(maxsize=512, ttl=5 * 60, name="search_memory")
+_indexes_ready = False
+
+
+def ttl_for(query_class: str) -> int:
+    """TTL in seconds for a query class."""
+    default = _DEFAULT_TTL_SECONDS.get(query_class, SEARCH_DEFAULT_TTL_SECONDS)
+    return int(getenv(f"SEARCH_TTL_{query_class.upper()}", str(default)))
+
+
+def bucket_coordinates(
+    lat: float, lng: float, cell_deg: float = SEARCH_GRID_DEG
+) -> Tuple[float, float]:
+    """Snap coordinates to the nearest point of a `cell_deg` grid."""
+    decimals = max(0, len(f"{cell_deg:.10f}".rstrip("0").split(".")[1]))
+    return (
+        round(round(float(lat) / cell_deg) * cell_deg, decimals),
+        round(round(float(lng) / cell_deg) * cell_deg, decimals),
+    )
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def _key(query_class: str, query: str) -> str:
+    return hashlib.sha1(
+        f"{query_class}|{normalize_query(query)}".encode()
+    ).hexdigest()
+
+
+def get(query_class: str, query: str) -> Optional[List[Dict[str, str]]]:
+    """Cached results for a query, or None on a miss/expired entry."""
+    key = _key(query_class, query)
+    results = _memory.get(key)
+    if results is not None:
+        return results
+
+    with metrics.span("mongo.find_search"):
+        doc = search_cache_col.find_one(
+            {"_id": key, "expires_at": {"$gt": utcnow()}}
+        )
+    metrics.cache_hit("search", doc is not None)
+    if not doc:
+        return None
+
+    remaining = (doc["expires_at"] - utcnow()).total_seconds()
+    _memory.set(key, doc["results"], ttl=min(_memory.ttl, remaining))
+    return doc["results"]
+
+
+def put(query_class: str, query: str, results: List[Dict[str, str]]):
+    """Store results for a query (an empty list: the search found nothing)."""
+    global _indexes_ready
+    if not _indexes_ready:
+        search_cache_col.create_index("expires_at", expireAfterSeconds=0)
+        _indexes_ready = True
+
+    key = _key(query_class, query)
+    ttl = ttl_for(query_class)
+    now = utcnow()
+    search_cache_col.update_one(
+        {"_id": key},
+        {
+            "$set": {
+                "query_class": query_class,
+                "query": normalize_query(query),
+                "results": results,
+                "cached_at": now,
+                "expires_at": now + timedelta(seconds=ttl),
+            }
+        },
+        upsert=True,
+    )
+    _memory.set(key, results, ttl=min(_memory.ttl, ttl))
@@ -9,16 +9,407 @@ Example:
     from utils.ai.tools import save_page_screenshot
     path = save_page_screenshot("https://www.nasa.gov", "out/nasa.png", full_page=True)
     print(path)
+
+Screenshots are taken by a per-process pool of warm headless Chromium
+instances (see BrowserPool). The pool is started lazily on the first capture
+and can be tuned with these environment variables:
+
+    BROWSER_POOL_SIZE            Concurrent captures / browsers (default 2)
+    BROWSER_MAX_CAPTURES         Captures before a browser is recycled (default 50)
+    BROWSER_MAX_PAGES_PER_CONTEXT  Captures before a context is recycled (default 10)
+    CAPTURE_DEADLINE_SECONDS     Longest wait for one capture, queue time
+                                 included (default: half of WORKER_TIMEOUT_SECONDS)
+
+WORKER_TIMEOUT_SECONDS is the gunicorn worker timeout (gunicorn.conf.py); a
+capture gives up well before it, so a sync worker is not killed mid-capture
+with a pooled page and a lease still held.
 """
 
 from __future__ import annotations
 
+import atexit
+import hashlib
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from os import getenv
 from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+BROWSER_POOL_SIZE = int(getenv("BROWSER_POOL_SIZE", "2"))
+BROWSER_MAX_CAPTURES = int(getenv("BROWSER_MAX_CAPTURES", "50"))
+BROWSER_MAX_PAGES_PER_CONTEXT = int(getenv("BROWSER_MAX_PAGES_PER_CONTEXT", "10"))
+WORKER_TIMEOUT_SECONDS = int(getenv("WORKER_TIMEOUT_SECONDS", "120"))
+CAPTURE_DEADLINE_SECONDS = float(
+    getenv("CAPTURE_DEADLINE_SECONDS", str(WORKER_TIMEOUT_SECONDS / 2))
+)
+
+# Request types that carry map tiles/layers and delay rendering
+_RENDER_RESOURCE_TYPES = {"image", "fetch", "xhr", "script", "stylesheet", "font"}
+
+
+class _BrowserSlot:
+    """
+    Browser, context and page owned by a single pool thread.
+
+    Playwright's sync API is bound to the thread that started it, so every
+    slot is created, used and closed on its own worker thread.
+    """
+
+    def __init__(self, max_captures: int, max_pages_per_context: int):
+        self.max_captures = max_captures
+        self.max_pages_per_context = max_pages_per_context
+        self.playwright = None
+        self.browser = None
+        self.context = None
+        self.context_options: Optional[Dict[str, Any]] = None
+        self.page = None
+        self.captures = 0
+        self.context_captures = 0
+
+    def acquire_page(self, context_options: Dict[str, Any]):
+        """Return a ready page, (re)launching the browser/context if needed."""
+        if self.playwright is None:
+            # Imported here so that only processes that capture pay for it
+            from playwright.sync_api import sync_playwright
+
+            self.playwright = sync_playwright().start()
+
+        if self.browser is not None and (
+            not self.browser.is_connected() or self.captures >= self.max_captures
+        ):
+            logger.info("Recycling browser after %s captures", self.captures)
+            self.close_browser()
+
+        if self.browser is None:
+            self.browser = self.playwright.chromium.launch(headless=True)
+            self.captures = 0
+
+        if self.context is not None and (
+            self.context_options != context_options
+            or self.context_captures >= self.max_pages_per_context
+        ):
+            self.close_context()
+
+        if self.context is None:
+            self.context = self.browser.new_context(**context_options)
+            self.context_options = context_options
+            self.context_captures = 0
+
+        if self.page is None or self.page.is_closed():
+            self.page = self.context.new_page()
+
+        return self.page
+
+    def release(self):
+        """Mark a capture as done and reset the page for the next one."""
+        self.captures += 1
+        self.context_captures += 1
+        try:
+            # Force a full navigation (and a fresh map) on the next capture
+            self.page.goto("about:blank")
+        except Exception:
+            self.close_context()
+
+    def discard(self):
+        """Drop state after a failed capture; recycle the browser if it crashed."""
+        if self.browser is not None and not self.browser.is_connected():
+            self.close_browser()
+        else:
+            self.close_context()
+
+    def close_context(self):
+        if self.context is not None:
+            try:
+                self.context.close()
+            except Exception:
+                pass
+        self.context = None
+        self.context_options = None
+        self.page = None
+
+    def close_browser(self):
+        self.close_context()
+        if self.browser is not None:
+            try:
+                self.browser.close()
+            except Exception:
+                pass
+        self.browser = None
+
+    def close(self):
+        self.close_browser()
+        if self.playwright is not None:
+            try:
+                self.playwright.stop()
+            except Exception:
+                pass
+        self.playwright = None
+
+
+class BrowserPool:
+    """
+    Long-lived pool of headless Chromium browsers.
+
+    Each of the `size` worker threads owns one browser and runs one capture
+    at a time, so `size` also bounds the number of concurrent captures.
+    Workers are started lazily on the first submitted task.
+    """
+
+    def __init__(
+        self,
+        size: int = BROWSER_POOL_SIZE,
+        max_captures: int = BROWSER_MAX_CAPTURES,
+        max_pages_per_context: int = BROWSER_MAX_PAGES_PER_CONTEXT,
+    ):
+        self.size = max(1, size)
+        self.max_captures = max_captures
+        self.max_pages_per_context = max_pages_per_context
+        self._tasks: "queue.Queue" = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _start(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Browser pool is shut down")
+            if self._threads:
+                return
+            for i in range(self.size):
+                thread = threading.Thread(
+                    target=self._worker, name=f"browser-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self):
+        slot = _BrowserSlot(self.max_captures, self.max_pages_per_context)
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                slot.close()
+                return
+
+            fn, context_options, future, deadline = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                # The caller has given up already; do not tie up the browser
+                future.set_exception(
+                    CaptureTimeout("Map capture timed out waiting for a free browser")
+                )
+                continue
+
+            try:
+                page = slot.acquire_page(context_options)
+                result = fn(page)
+            except BaseException as e:
+                # Also closes the page of a capture stopped at its deadline
+                slot.discard()
+                future.set_exception(e)
+            else:
+                slot.release()
+                future.set_result(result)
+
+    def submit(
+        self,
+        fn: Callable[[Any], Any],
+        context_options: Dict[str, Any],
+        deadline: Optional[float] = None,
+    ) -> Future:
+        """
+        Queue `fn(page)` to run on a pooled page created with `context_options`.
+
+        A task still queued at `deadline` (time.monotonic()) fails with
+        CaptureTimeout without running.
+        """
+        self._start()
+        future: Future = Future()
+        self._tasks.put((fn, context_options, future, deadline))
+        return future
+
+    def shutdown(self, timeout: float = 10):
+        """Close every browser and stop the worker threads."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            threads = list(self._threads)
+        for _ in threads:
+            self._tasks.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+
+_pool: Optional[BrowserPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool() -> BrowserPool:
+    """Return the process-wide browser pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = BrowserPool()
+                atexit.register(_pool.shutdown)
+    return _pool
+
+
+class _NetworkTracker:
+    """Counts in-flight render-related requests on a page and when they last changed."""
+
+    def __init__(self, page):
+        self.page = page
+        self.pending = set()
+        self.last_activity = time.monotonic()
+        page.on("request", self._on_request)
+        page.on("requestfinished", self._on_done)
+        page.on("requestfailed", self._on_done)
+
+    def _on_request(self, request):
+        if request.resource_type in _RENDER_RESOURCE_TYPES:
+            self.pending.add(request)
+            self.last_activity = time.monotonic()
 
-from playwright.sync_api import sync_playwright
+    def _on_done(self, request):
+        if request in self.pending:
+            self.pending.discard(request)
+            self.last_activity = time.monotonic()
 
+    def quiet_for(self) -> float:
+        """Milliseconds since the last tile request started or finished (0 if busy)."""
+        if self.pending:
+            return 0
+        return (time.monotonic() - self.last_activity) * 1000
 
-def save_page_screenshot(
+    def detach(self):
+        self.page.remove_listener("request", self._on_request)
+        self.page.remove_listener("requestfinished", self._on_done)
+        self.page.remove_listener("requestfailed", self._on_done)
+
+
+def _frame_clip(page, selector: str) -> Optional[Dict[str, float]]:
+    """Bounding box of the largest visible element matching `selector`, if any."""
+    best = None
+    for element in page.query_selector_all(selector):
+        box = element.bounding_box()
+        if not box or box.get("width", 0) <= 4 or box.get("height", 0) <= 4:
+            continue
+        if best is None or box["width"] * box["height"] > best["width"] * best["height"]:
+            best = box
+    return best
+
+
+def _wait_for_render_stable(
+    page,
+    tracker: _NetworkTracker,
+    *,
+    selector: str,
+    ceiling_ms: int,
+    quiet_ms: int,
+    stable_frames: int,
+    poll_ms: int,
+) -> bool:
+    """
+    Wait until tile requests are quiet and the map pixels stop changing.
+
+    Successive frames of the map canvas (or the viewport if there is no sized
+    canvas) are hashed; the page counts as rendered once `stable_frames`
+    consecutive frames are identical while the network has been quiet for
+    `quiet_ms`. Gives up after `ceiling_ms`.
+
+    Returns:
+        True if the page became stable, False if the ceiling was hit.
+    """
+    deadline = time.monotonic() + ceiling_ms / 1000
+    last_hash = None
+    same_frames = 0
+
+    while time.monotonic() < deadline:
+        page.wait_for_timeout(poll_ms)
+
+        if tracker.quiet_for() < quiet_ms:
+            same_frames = 0
+            last_hash = None
+            continue
+
+        clip = _frame_clip(page, selector or "canvas")
+        frame = page.screenshot(clip=clip) if clip else page.screenshot()
+        frame_hash = hashlib.md5(frame).hexdigest()
+
+        if frame_hash == last_hash:
+            same_frames += 1
+            if same_frames >= stable_frames:
+                return True
+        else:
+            same_frames = 0
+        last_hash = frame_hash
+
+    return False
+
+
+# Per-capture navigation/wait budget (see submit_page_screenshot)
+SCREENSHOT_TIMEOUT_MS = 120000
+
+PLAYWRIGHT_HINT = (
+    "Playwright failed. Make sure browsers are installed with: "
+    "`playwright install chromium`. Original error: %s"
+)
+
+
+class CaptureTimeout(RuntimeError):
+    """A capture that did not finish (queue wait included) within its deadline."""
+
+
+def capture_deadline(timeout_ms: int = SCREENSHOT_TIMEOUT_MS) -> float:
+    """
+    Seconds a caller waits for a capture: queue time is included, so twice the
+    budget, but never more than CAPTURE_DEADLINE_SECONDS.
+    """
+    return min(2 * timeout_ms / 1000, CAPTURE_DEADLINE_SECONDS)
+
+
+def capture_error(error: BaseException) -> RuntimeError:
+    """The error to report for a failed capture (timeouts are not install problems)."""
+    if isinstance(error, CaptureTimeout):
+        return error
+    # concurrent.futures/asyncio timeouts are TimeoutError, Playwright's share the name
+    if isinstance(error, TimeoutError) or type(error).__name__ == "TimeoutError":
+        return CaptureTimeout(f"Map capture timed out: {error}")
+    return RuntimeError(PLAYWRIGHT_HINT % (error,))
+
+
+def save_page_screenshot(url: str, out_path: str = "screenshot.png", **options) -> str:
+    """
+    Take a screenshot of a URL and wait for it (see submit_page_screenshot
+    for the options).
+
+    Returns:
+        Absolute path where the screenshot was saved.
+
+    Raises:
+        CaptureTimeout if the capture did not finish in time, RuntimeError on
+        other browser/runtime issues (e.g., missing Chromium install).
+    """
+    timeout_ms = options.get("timeout_ms", SCREENSHOT_TIMEOUT_MS)
+    try:
+        with metrics.span("browser.capture"):
+            future = submit_page_screenshot(url, out_path, **options)
+            return future.result(timeout=capture_deadline(timeout_ms))
+    except Exception as e:
+        raise capture_error(e) from e
+
+
+def submit_page_screenshot(
     url: str,
     out_path: str = "screenshot.png",
     *,
@@ -27,12 +418,23 @@ def save_page_screenshot(
     height: int = 800,
     wait_until: str = "load",
     device_scale_factor: float = 1,
-    timeout_ms: int = 120000,
+    timeout_ms: int = SCREENSHOT_TIMEOUT_MS,
     ready_selector: str = "canvas",
     post_wait_ms: int = 6000,
-) -> str:
+    readiness: str = "stable",
+    quiet_ms: int = 800,
+    stable_frames: int = 2,
+    poll_ms: int = 250,
+    clip_selector: Optional[str] = None,
+) -> Future:
     """
-    Take a screenshot of a URL using headless Chromium (Playwright) and save it to disk.
+    Queue a screenshot of a URL using headless Chromium (Playwright), saved to disk.
+
+    The capture runs on a warm page from the process-wide BrowserPool; wait
+    for the returned future (or use save_page_screenshot). It stops at
+    capture_deadline(timeout_ms) after submission, queue time included, and
+    its page is then closed, so a capture the caller gave up on does not keep
+    holding a browser.
 
     Args:
         url: Target page URL.
@@ -44,73 +446,117 @@ def save_page_screenshot(
         timeout_ms: Navigation and waits timeout in milliseconds.
         ready_selector: CSS selector to wait until visible (default 'canvas').
         post_wait_ms: Extra settling time after network idle to allow dynamic tiles to render.
+            With readiness="stable" this is only the maximum wait.
+        readiness: "stable" captures as soon as tile requests are quiet and the map
+            pixels stop changing; "fixed" always waits for networkidle plus post_wait_ms.
+        quiet_ms: ("stable") Time without tile requests before frames are compared.
+        stable_frames: ("stable") Consecutive identical frames required.
+        poll_ms: ("stable") Interval between frame comparisons.
+        clip_selector: Capture only the largest visible element matching this
+            selector (e.g. the map canvas) instead of the page; falls back to the
+            page if there is none.
 
     Returns:
-        Absolute path where the screenshot was saved.
-
-    Raises:
-        RuntimeError on browser/runtime issues (e.g., missing Chromium install).
+        Future of the absolute path where the screenshot was saved.
     """
     out = Path(out_path)
     out.parent.mkdir(parents=True, exist_ok=True)
 
-    try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            try:
-                context = browser.new_context(
-                    viewport={"width": width, "height": height},
-                    device_scale_factor=device_scale_factor,
-                )
-                page = context.new_page()
-                # 1) Navigate
-                page.goto(url, wait_until=wait_until, timeout=timeout_ms)
+    def remaining_ms(limit_ms: int = timeout_ms) -> int:
+        """`limit_ms`, cut to what is left before the deadline."""
+        left = int((deadline - time.monotonic()) * 1000)
+        if left <= 0:
+            raise CaptureTimeout(
+                f"Map capture exceeded its {capture_deadline(timeout_ms):.0f}s deadline"
+            )
+        return min(limit_ms, left)
+
+    def capture(page) -> str:
+        started = time.monotonic()
+        metrics.observe("browser.queue", started - submitted)
+        tracker = _NetworkTracker(page) if readiness == "stable" else None
+        try:
+            # 1) Navigate
+            page.goto(url, wait_until=wait_until, timeout=remaining_ms())
+            navigated = time.monotonic()
+            metrics.observe("browser.navigate", navigated - started)
 
-                # 2) Ensure DOM base is present
-                page.wait_for_selector("body", state="visible", timeout=timeout_ms)
+            # 2) Ensure DOM base is present
+            page.wait_for_selector("body", state="visible", timeout=remaining_ms())
 
-                # 3) Wait for a visible map/canvas container if provided
-                if ready_selector:
-                    page.wait_for_selector(
-                        ready_selector, state="visible", timeout=timeout_ms
-                    )
+            # 3) Wait for a visible map/canvas container if provided
+            if ready_selector:
+                page.wait_for_selector(
+                    ready_selector, state="visible", timeout=remaining_ms()
+                )
 
+            if tracker is not None:
+                # 4) Capture as soon as tiles stop loading and the canvas stops changing
+                settling = time.monotonic()
+                stable = _wait_for_render_stable(
+                    page,
+                    tracker,
+                    selector=ready_selector,
+                    ceiling_ms=remaining_ms(post_wait_ms),
+                    quiet_ms=quiet_ms,
+                    stable_frames=stable_frames,
+                    poll_ms=poll_ms,
+                )
+                logger.info(
+                    "Map %s after %.0f ms",
+                    "stable" if stable else "not stable (ceiling hit)",
+                    (time.monotonic() - settling) * 1000,
+                )
+            else:
                 # 4) Let network settle and give extra time for tiles/layers to paint
                 try:
-                    page.wait_for_load_state("networkidle", timeout=timeout_ms)
+                    page.wait_for_load_state("networkidle", timeout=remaining_ms())
                 except Exception:
                     # Some apps never reach networkidle due to polling; continue best effort
                     pass
 
                 if post_wait_ms > 0:
-                    page.wait_for_timeout(post_wait_ms)
+                    page.wait_for_timeout(remaining_ms(post_wait_ms))
 
                 # 5) Sanity check: ensure at least one canvas has non-zero bbox
                 try:
-                    canvases = page.query_selector_all("canvas")
-                    any_ok = False
-                    for c in canvases:
-                        box = c.bounding_box()
-                        if box and box.get("width", 0) > 4 and box.get("height", 0) > 4:
-                            any_ok = True
-                            break
                     # If no canvas sized, wait a bit more
-                    if not any_ok:
-                        page.wait_for_timeout(4000)
+                    if _frame_clip(page, "canvas") is None:
+                        page.wait_for_timeout(remaining_ms(4000))
                 except Exception:
                     # Ignore if site has no canvas or access fails
                     pass
 
-                page.screenshot(path=str(out), full_page=full_page)
-                return str(out.resolve())
-            finally:
-                browser.close()
-    except Exception as e:
-        msg = (
-            "Playwright failed. Make sure browsers are installed with: "
-            "`playwright install chromium`. Original error: %s" % (e,)
-        )
-        raise RuntimeError(msg) from e
+            ready = time.monotonic()
+            metrics.observe("browser.wait_ready", ready - navigated)
+
+            remaining_ms()
+            clip = _frame_clip(page, clip_selector) if clip_selector else None
+            if clip:
+                page.screenshot(path=str(out), clip=clip, timeout=remaining_ms())
+            else:
+                page.screenshot(path=str(out), full_page=full_page, timeout=remaining_ms())
+            metrics.observe("browser.screenshot", time.monotonic() - ready)
+            return str(out.resolve())
+        finally:
+            if tracker is not None:
+                tracker.detach()
+
+    context_options = {
+        "viewport": {"width": width, "height": height},
+        "device_scale_factor": device_scale_factor,
+    }
+
+    submitted = time.monotonic()
+    deadline = submitted + capture_deadline(timeout_ms)
+    return get_browser_pool().submit(capture, context_options, deadline)
 
 
-__all__ = ["save_page_screenshot"]
+__all__ = [
+    "save_page_screenshot",
+    "submit_page_screenshot",
+    "capture_error",
+    "CaptureTimeout",
+    "get_browser_pool",
+    "BrowserPool",
+]
@@ -0,0 +1,229 @@
+"""
+Bulk recalculation of many fields in one pipeline run.
+
+Work shared between fields is done once: identical inputs produce one
+analysis, each map location is captured once, and all searches are
+deduplicated by query text (nearby fields and fields with the same crop share
+queries, see pipeline.build_search_queries). The model calls then run with
+bounded concurrency and results are written back with bulk writes.
+
+CLI (e.g. a nightly cron job):
+
+    python -m utils.batch                  # every field whose inputs changed
+    python -m utils.batch --force          # every field
+    python -m utils.batch --owner <id>     # one owner's fields
+    python -m utils.batch --concurrency 8
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os import getenv
+from typing import Dict, List, Optional
+import argparse
+import time
+
+from pymongo import UpdateOne
+
+from utils import tools, pipeline
+from utils.conexion import main_variables_col, field_data_col, calculated_data_col
+from utils.ai.main import search_many, SEARCH_MAX_WORKERS
+
+BATCH_CONCURRENCY = int(getenv("BATCH_CONCURRENCY", "4"))
+BATCH_WRITE_SIZE = int(getenv("BATCH_WRITE_SIZE", "200"))
+
+
+def _load_fields(owner: Optional[str], field_ids: Optional[List[str]]) -> List[tuple]:
+    """(main_data, field_data) pairs for the selected fields."""
+    # Ownerless documents predate fields (see utils.fields.adopt_legacy)
+    query: dict = {"owner": owner if owner else {"$exists": True}}
+    if field_ids:
+        query["field_id"] = {"$in": [str(field_id) for field_id in field_ids]}
+
+    measurements = {
+        (doc.get("owner"), doc.get("field_id")): doc
+        for doc in field_data_col.find(query, {"_id": 0})
+    }
+    return [
+        (main, measurements.get((main.get("owner"), main.get("field_id")), {}))
+        for main in main_variables_col.find(query, {"_id": 0})
+    ]
+
+
+def _write(operations: List[UpdateOne]):
+    for i in range(0, len(operations), BATCH_WRITE_SIZE):
+        calculated_data_col.bulk_write(
+            operations[i : i + BATCH_WRITE_SIZE], ordered=False
+        )
+
+
+def recalculate(
+    owner: Optional[str] = None,
+    field_ids: Optional[List[str]] = None,
+    only_changed: bool = True,
+    concurrency: int = BATCH_CONCURRENCY,
+    progress: pipeline.Progress = None,
+) -> dict:
+    """
+    Recalculate many fields at once.
+
+    Args:
+        owner: Only this owner's fields (all owners if None)
+        field_ids: Only these field ids (all of the owner's fields if None)
+        only_changed: Skip fields whose current inputs are already calculated
+        concurrency: Maximum number of concurrent model calls
+        progress: Optional progress(stage, percent) callback
+
+    Returns:
+        tools.msg() dict with counts of fields, analyses, maps, searches and
+        errors, and of the fields not analyzed: `incomplete` (main data
+        missing), `duplicates` (same inputs as another field) and `unchanged`
+        (already calculated)
+    """
+    started = time.monotonic()
+    pipeline.report_progress(progress, "loading", 2)
+    if isinstance(field_ids, str):
+        field_ids = [field_ids]
+
+    # Deduplicate identical inputs: one analysis per cache key
+    pending: Dict[str, tuple] = {}
+    fields = _load_fields(owner, field_ids)
+    incomplete = duplicates = unchanged = 0
+    for main_data, field_data in fields:
+        if not main_data.get("plant_type") or main_data.get("latitude") is None:
+            incomplete += 1
+            continue
+        cache_key, cache_key_data = pipeline.build_cache_key(main_data, field_data)
+        if cache_key in pending:
+            duplicates += 1
+            continue
+        pending[cache_key] = (main_data, field_data, cache_key_data)
+
+    if only_changed and pending:
+        done = calculated_data_col.find(
+            {"cache_key": {"$in": list(pending)}, "calculated_at": {"$exists": True}},
+            {"cache_key": 1},
+        )
+        for doc in done:
+            if pending.pop(doc["cache_key"], None) is not None:
+                unchanged += 1
+
+    # Maps: one capture per location (the browser pool bounds concurrency)
+    pipeline.report_progress(progress, "map", 10)
+    locations = {(m["latitude"], m["longitude"]) for m, _, _ in pending.values()}
+    maps: Dict[tuple, str] = {}
+    errors = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {
+            executor.submit(pipeline.get_map, lat, lng): (lat, lng)
+            for lat, lng in locations
+        }
+        for future in as_completed(futures):
+            try:
+                maps[futures[future]] = future.result()
+            except Exception as e:
+                errors += 1
+                tools.write_log(f"Batch map capture failed {futures[future]}: {e}", 1)
+
+    # Searches: deduplicated by query text, run in chunks of the search pool size
+    pipeline.report_progress(progress, "search", 30)
+    field_queries: Dict[str, Dict[str, str]] = {}
+    unique_queries: Dict[str, str] = {}
+    for cache_key, (main_data, _, _) in pending.items():
+        queries = pipeline.build_search_queries(
+            main_data["latitude"], main_data["longitude"], main_data["plant_type"]
+        )
+        field_queries[cache_key] = queries
+        for name, query in queries.items():
+            unique_queries.setdefault(query, pipeline.SEARCH_CLASSES[name])
+
+    search_results: Dict[str, list] = {}
+    query_list = list(unique_queries)
+    for i in range(0, len(query_list), SEARCH_MAX_WORKERS):
+        chunk = {q: q for q in query_list[i : i + SEARCH_MAX_WORKERS]}
+        found = search_many(chunk, classes={q: unique_queries[q] for q in chunk})
+        search_results.update(found)
+        for query, error in found.errors.items():
+            tools.write_log(f"Batch search failed ({query}): {error}", 1)
+
+    # Analyses: bounded concurrency, results written back in bulk
+    pipeline.report_progress(progress, "analysis", 50)
+    operations: List[UpdateOne] = []
+    analyzed = 0
+
+    def run(cache_key: str) -> tuple:
+        main_data, field_data, cache_key_data = pending[cache_key]
+        mapa = maps[(main_data["latitude"], main_data["longitude"])]
+        busquedas = {
+            name: search_results[query]
+            for name, query in field_queries[cache_key].items()
+            if query in search_results
+        }
+        response_data = pipeline.analyze(main_data, field_data, mapa, busquedas)
+        complete = len(busquedas) == len(field_queries[cache_key])
+        return cache_key, complete, pipeline.build_cache_document(
+            cache_key, cache_key_data, response_data
+        )
+
+    ready = [
+        key
+        for key, (m, _, _) in pending.items()
+        if (m["latitude"], m["longitude"]) in maps
+    ]
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [executor.submit(run, key) for key in ready]
+        for i, future in enumerate(as_completed(futures), 1):
+            try:
+                cache_key, complete, document = future.result()
+            except Exception as e:
+                errors += 1
+                tools.write_log(f"Batch analysis failed: {e}", 1)
+                continue
+            if document.get("estimacion_local") or not complete:
+                # Model or a search unavailable: leave the field for the next run
+                errors += 1
+                continue
+            operations.append(
+                UpdateOne({"cache_key": cache_key}, {"$set": document}, upsert=True)
+            )
+            analyzed += 1
+            if len(operations) >= BATCH_WRITE_SIZE:
+                _write(operations)
+                operations = []
+            pipeline.report_progress(progress, "analysis", 50 + int(45 * i / len(futures)))
+
+    _write(operations)
+
+    return tools.msg(
+        0,
+        "Batch recalculation finished",
+        fields=len(fields),
+        analyses=analyzed,
+        incomplete=incomplete,
+        duplicates=duplicates,
+        unchanged=unchanged,
+        maps=len(maps),
+        searches=len(unique_queries),
+        errors=errors,
+        seconds=round(time.monotonic() - started, 2),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recalculate many fields at once.")
+    parser.add_argument("--owner", help="Only this owner's fields")
+    parser.add_argument("--field", action="append", dest="fields", help="Field id (repeatable)")
+    parser.add_argument("--force", action="store_true", help="Recalculate unchanged fields too")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    args = parser.parse_args()
+
+    result = recalculate(
+        owner=args.owner,
+        field_ids=args.fields,
+        only_changed=not args.force,
+        concurrency=args.concurrency,
+        progress=lambda stage, percent: print(f"[{percent:3d}%] {stage}"),
+    )
+    print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Two-tier cache: a bounded in-process LRU with TTL in front of MongoDB.
+
+Used by the routes for the input documents of each field (main variables and
+field data, keyed by owner and field id) and the calculated results stored in
+calculated_data_col, so hot page loads are served without database round trips.
+
+Invalidation:
+    /SaveMainVariables and /SaveFieldData call invalidate_inputs(), which
+    drops this worker's copies of the field and sets an `inputs_v` cookie with
+    the write time. Entries loaded before that time are ignored for that client
+    on every worker, so a user always reads their own writes; other clients see
+    the change after CACHE_INPUT_TTL_SECONDS at most.
+
+    The field each owner selected is cached the same way (get_selected_field);
+    select_field() stores the new selection in this worker and moves `inputs_v`
+    on, so no worker serves the old one to that client.
+
+Calculated results are keyed by the MD5 of their inputs, so they never go
+stale; only the advice may be added later (see update_calculation).
+"""
+
+from collections import OrderedDict
+from copy import deepcopy
+from os import getenv
+from typing import Any, Callable, Dict, Optional
+import threading
+import time
+
+from flask import after_this_request, has_request_context, request, Response
+
+from utils import metrics
+from utils.conexion import main_variables_col, field_data_col, calculated_data_col
+
+CACHE_INPUT_TTL_SECONDS = float(getenv("CACHE_INPUT_TTL_SECONDS", "60"))
+CACHE_RESULT_TTL_SECONDS = float(getenv("CACHE_RESULT_TTL_SECONDS", "600"))
+CACHE_MAX_ENTRIES = int(getenv("CACHE_MAX_ENTRIES", "1024"))
+
+INPUTS_VERSION_COOKIE = "inputs_v"
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with a per-entry TTL and hit/miss/eviction counters.
+
+    Named caches also report lookups and evictions to utils.metrics.
+    """
+
+    def __init__(
+        self, maxsize: int = CACHE_MAX_ENTRIES, ttl: float = 600, name: Optional[str] = None
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None, newer_than: float = 0):
+        """
+        Return a copy of the cached value, or `default`.
+
+        Args:
+            key: Cache key
+            default: Returned on a miss
+            newer_than: Treat entries stored before this wall-clock time as misses
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return self._miss(default)
+
+            value, expires_at, stored_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return self._miss(default)
+            if stored_at < newer_than:
+                self.misses += 1
+                return self._miss(default)
+
+            self._data.move_to_end(key)
+            self.hits += 1
+        if self.name:
+            metrics.cache_hit(self.name, True)
+        return deepcopy(value)
+
+    def _miss(self, default):
+        if self.name:
+            metrics.cache_hit(self.name, False)
+        return default
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (
+                deepcopy(value),
+                time.monotonic() + (self.ttl if ttl is None else ttl),
+                time.time(),
+            )
+            self._data.move_to_end(key)
+            evicted = 0
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        if evicted and self.name:
+            metrics.cache_evicted(self.name, evicted)
+
+    def update(self, key, fields: dict) -> bool:
+        """Merge `fields` into a cached dict, keeping its expiry; False if not cached."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False
+            value, expires_at, _ = entry
+            value = {**value, **deepcopy(fields)}
+            self._data[key] = (value, expires_at, time.time())
+            return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+inputs_cache = LRUCache(ttl=CACHE_INPUT_TTL_SECONDS, name="inputs")
+results_cache = LRUCache(ttl=CACHE_RESULT_TTL_SECONDS, name="results")
+
+
+def _inputs_version() -> float:
+    """Time of this client's last input write (from the inputs_v cookie)."""
+    if not has_request_context():
+        return 0
+    try:
+        return float(request.cookies.get(INPUTS_VERSION_COOKIE, 0))
+    except ValueError:
+        return 0
+
+
+def _get_input(key: str, load: Callable[[], Optional[dict]]) -> Optional[dict]:
+    value = inputs_cache.get(key, _MISSING, newer_than=_inputs_version())
+    if value is not _MISSING:
+        return value
+
+    # Missing documents are cached too; the write that creates them invalidates
+    with metrics.span("mongo.find_inputs"):
+        value = load()
+    inputs_cache.set(key, value)
+    return value
+
+
+def _input_key(kind: str, key: dict) -> tuple:
+    return (kind, key["owner"], key["field_id"])
+
+
+def get_main_variables(key: dict) -> Optional[dict]:
+    """
+    The main variables document of a field (without _id/owner), or None.
+
+    Args:
+        key: {"owner": ..., "field_id": ...} (see utils.fields.field_key)
+    """
+    return _get_input(_input_key("main", key), lambda: _load_main_variables(key))
+
+
+def _load_main_variables(key: dict) -> Optional[dict]:
+    doc = main_variables_col.find_one(key, {"_id": 0, "owner": 0})
+    if doc is None:
+        # Imported here: utils.fields imports this module
+        from utils import fields
+
+        if fields.adopt_legacy(key):
+            inputs_cache.invalidate(_input_key("field", key))
+            doc = main_variables_col.find_one(key, {"_id": 0, "owner": 0})
+    return doc
+
+
+def get_field_data(key: dict) -> Optional[dict]:
+    """The field data document of a field (without _id/owner), or None."""
+    return _get_input(
+        _input_key("field", key),
+        lambda: field_data_col.find_one(key, {"_id": 0, "owner": 0}),
+    )
+
+
+def get_selected_field(owner: str, load: Callable[[], Optional[str]]) -> Optional[str]:
+    """The field id `owner` selected, or None; `load` reads it on a miss."""
+    return _get_input(("selected", owner), load)
+
+
+def select_field(owner: str, field_id: str):
+    """Cache a new selection after it was stored (see module docstring)."""
+    _bump_inputs_version()
+    inputs_cache.set(("selected", owner), field_id)
+
+
+def invalidate_inputs(key: dict):
+    """Drop cached input documents of a field after a write (see module docstring)."""
+    inputs_cache.invalidate(_input_key("main", key))
+    inputs_cache.invalidate(_input_key("field", key))
+    _bump_inputs_version()
+
+
+def _bump_inputs_version():
+    """Make this client ignore input entries cached before now, on every worker."""
+    if has_request_context():
+        version = str(time.time())
+
+        @after_this_request
+        def set_version(response: Response):
+            response.set_cookie(
+                INPUTS_VERSION_COOKIE,
+                version,
+                max_age=60 * 60 * 24,
+                httponly=True,
+                samesite="Lax",
+            )
+            return response
+
+
+def get_calculation(cache_key: str, refresh: bool = False) -> Optional[dict]:
+    """
+    The calculated_data_col document for a cache key, or None.
+
+    Args:
+        cache_key: MD5 of the calculation inputs
+        refresh: Skip the in-process tier (e.g. to see advice added by another worker)
+    """
+    if not refresh:
+        value = results_cache.get(cache_key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+    with metrics.span("mongo.find_calculation"):
+        value = calculated_data_col.find_one({"cache_key": cache_key}, {"_id": 0})
+    if value is not None:
+        results_cache.set(cache_key, value)
+    return value
+
+
+def put_calculation(cache_key: str, document: dict):
+    """Store a complete calculation document in MongoDB and in this process."""
+    with metrics.span("mongo.write_calculation"):
+        calculated_data_col.update_one(
+            {"cache_key": cache_key}, {"$set": document}, upsert=True
+        )
+    results_cache.set(cache_key, {"cache_key": cache_key, **document})
+
+
+def update_calculation(cache_key: str, fields: dict):
+    """Write fields of a calculation to MongoDB and refresh the in-process copy."""
+    with metrics.span("mongo.write_calculation"):
+        calculated_data_col.update_one(
+            {"cache_key": cache_key}, {"$set": fields}, upsert=True
+        )
+    results_cache.update(cache_key, fields)
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """Counters for every cache tier in this process."""
+    return {"inputs": inputs_cache.stats(), "results": results_cache.stats()}
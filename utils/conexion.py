@@ -1,28 +1,89 @@
-from flask import request, Response, after_this_request
+from flask import g, request, Response, after_this_request
 from pymongo import MongoClient
 from os import getenv
 from dotenv import load_dotenv
 from uuid import uuid4
 from itsdangerous import Signer, BadSignature
-from datetime import datetime
+from datetime import datetime, timezone
+import logging
+import threading
+import time
+from utils import metrics
 
 load_dotenv()
 
 SECRET_KEY = getenv("SECRET_KEY")
-signer = Signer(SECRET_KEY)
+# Previous secrets (comma separated) still accepted for existing cookies: the
+# session id owns the user's fields, so rotating SECRET_KEY must not drop it
+SECRET_KEY_FALLBACKS = [k for k in getenv("SECRET_KEY_FALLBACKS", "").split(",") if k]
+# Signs with the last key and verifies with all of them
+signer = Signer([*SECRET_KEY_FALLBACKS, SECRET_KEY])
 
-client = MongoClient(getenv("MONGO_URI"))
-db = client[getenv("MONGO_DB")]
+logger = logging.getLogger(__name__)
 
-users_col = db["users"]
-session_col = db["session_col"]
-log_col = db["log_col"]
-boss_col = db["boss"]
-worker_col = db["worker"]
-client_col = db["client"]
-main_variables_col = db["main-variables"]
-field_data_col = db["field-data"]
-calculated_data_col = db["data"]
+# The client is created on first use: importing the app (every worker and
+# cold start) opens no connection, and a gunicorn master that preloads the
+# app never forks a live MongoClient into its workers.
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """Return the process-wide MongoClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(getenv("MONGO_URI"))
+    return _client
+
+
+def get_db():
+    return get_client()[getenv("MONGO_DB")]
+
+
+class LazyCollection:
+    """Collection of the app database, resolved (and connected) on first use."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._collection = None
+
+    def _resolve(self):
+        if self._collection is None:
+            self._collection = get_db()[self.name]
+        return self._collection
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __repr__(self):
+        return f"LazyCollection({self.name!r})"
+
+
+users_col = LazyCollection("users")
+session_col = LazyCollection("session_col")
+log_col = LazyCollection("log_col")
+boss_col = LazyCollection("boss")
+worker_col = LazyCollection("worker")
+client_col = LazyCollection("client")
+main_variables_col = LazyCollection("main-variables")
+field_data_col = LazyCollection("field-data")
+calculated_data_col = LazyCollection("data")
+jobs_col = LazyCollection("jobs")
+leases_col = LazyCollection("leases")
+uploads_col = LazyCollection("gemini_files")
+search_cache_col = LazyCollection("search_cache")
+maps_col = LazyCollection("maps")
+rate_limits_col = LazyCollection("rate_limits")
+
+
+def utcnow() -> datetime:
+    """
+    Naive UTC now, for dates compared by MongoDB's TTL monitor (which reads
+    naive BSON dates as UTC, whatever the host's time zone).
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 def GenerateUuid(sequences=1) -> str:
@@ -32,34 +93,55 @@ def GenerateUuid(sequences=1) -> str:
     return result
 
 
+SESSION_TOUCH_INTERVAL = int(getenv("SESSION_TOUCH_INTERVAL_SECONDS", "300"))
+
+# When this process last saw each session's __last_acceded fresh (time.monotonic())
+_touched: dict = {}
+_TOUCHED_MAX = 10000
+
+
 class SessionMeta(type):
+    def current(cls, sessionidsession=None) -> "Session":
+        """The request-scoped Session (one instance per session id and request)."""
+        sessions = g.setdefault("_sessions", {})
+        key = sessionidsession or "__cookie__"
+        if key not in sessions:
+            sessions[key] = cls(sessionidsession)
+        return sessions[key]
+
     def __getitem__(cls, key, sessionidsession=None):
-        instance = cls(sessionidsession)
-        instance._update_last_acceded()
-        return instance[key]
+        return cls.current(sessionidsession)[key]
 
     get = __getitem__
 
     def __setitem__(cls, key, value, sessionidsession=None):
-        instance = cls(sessionidsession)
-        instance._update_last_acceded()
-        instance[key] = value
+        cls.current(sessionidsession)[key] = value
 
     def __contains__(cls, key):
-        temp_session = cls()
-        result = session_col.find_one({"__idsession": temp_session.idsession})
-        return key in result.get("__data", {}) if result else False
+        return key in cls.current()._data
 
     def to_dict(cls, sessionidsession=None):
-        instance = cls(sessionidsession)
-        doc = session_col.find_one({"__idsession": instance.idsession})
-        return doc.get("__data", {}) if doc else {}
+        return dict(cls.current(sessionidsession)._data)
 
 
 class Session(metaclass=SessionMeta):
+    """
+    Cookie-identified session stored in session_col.
+
+    The document is loaded at most once per request; reads are served from
+    memory and writes are collected and flushed with a single update_one after
+    the request. `__last_acceded` is refreshed at most once every
+    SESSION_TOUCH_INTERVAL_SECONDS, and a request that neither read nor wrote
+    the session (e.g. one that only needed its id) does not load the document
+    while this process knows it is fresh. Use `Session["key"]` / `Session["key"] = v`
+    (request-scoped via Session.current()).
+    """
+
     def __init__(self, sessionidsession=None):
         cookie_signed = request.cookies.get("idsession")
         self.idsession = None
+        self._doc = None
+        self._dirty = {}
 
         if sessionidsession:
             self.idsession = sessionidsession
@@ -67,18 +149,21 @@ class Session(metaclass=SessionMeta):
             try:
                 self.idsession = signer.unsign(cookie_signed).decode()
             except BadSignature:
+                logger.warning(
+                    "idsession cookie with a bad signature; starting a new session "
+                    "(list old secrets in SECRET_KEY_FALLBACKS)"
+                )
                 self.idsession = str(uuid4())
 
         if not self.idsession:
             self.idsession = str(uuid4())
 
-        self._update_last_acceded()
-
         host = request.host.split(":")[0]
         is_local = host in ["127.0.0.1", "localhost"]
 
         @after_this_request
         def set_cookie(response: Response):
+            self.flush()
             signed_value = signer.sign(self.idsession).decode()
             response.set_cookie(
                 "idsession",
@@ -90,34 +175,64 @@ class Session(metaclass=SessionMeta):
             )
             return response
 
-    def _update_last_acceded(self):
+    def _load(self) -> dict:
+        if self._doc is None:
+            with metrics.span("session.load"):
+                self._doc = session_col.find_one({"__idsession": self.idsession}) or {}
+        return self._doc
+
+    @property
+    def _data(self) -> dict:
+        return self._load().setdefault("__data", {})
+
+    def flush(self):
+        """Write pending changes (and a throttled __last_acceded) in one update."""
+        touched = _touched.get(self.idsession)
+        if (
+            self._doc is None
+            and not self._dirty
+            and touched is not None
+            and time.monotonic() - touched < SESSION_TOUCH_INTERVAL
+        ):
+            return
+
+        update = {f"__data.{key}": value for key, value in self._dirty.items()}
+
         current_time = datetime.now()
-        session_col.update_one(
-            {"__idsession": self.idsession},
-            {"$set": {"__last_acceded": current_time}},
-            upsert=True,
-        )
+        last_acceded = self._load().get("__last_acceded")
+        age = (current_time - last_acceded).total_seconds() if last_acceded else None
+        if age is None or age >= SESSION_TOUCH_INTERVAL:
+            update["__last_acceded"] = current_time
+            age = 0
+        if len(_touched) >= _TOUCHED_MAX:
+            _touched.clear()
+        _touched[self.idsession] = time.monotonic() - age
+
+        if update:
+            with metrics.span("session.flush"):
+                session_col.update_one(
+                    {"__idsession": self.idsession}, {"$set": update}, upsert=True
+                )
+            self._doc["__last_acceded"] = update.get("__last_acceded", last_acceded)
+        self._dirty = {}
 
     def __setitem__(self, key, value):
         if value is None:
             return
 
-        self._update_last_acceded()
-
-        session_col.update_one(
-            {"__idsession": self.idsession},
-            {"$set": {f"__data.{key}": value}},
-            upsert=True,
-        )
+        self._data[key] = value
+        self._dirty[key] = value
 
     def __getitem__(self, key):
-        self._update_last_acceded()
-
-        doc = session_col.find_one({"__idsession": self.idsession})
-        return doc.get("__data", {}).get(key) if doc else None
+        return self._data.get(key)
 
     @classmethod
     def clear(cls):
+        """
+        Drop the stored session data. The session id and its cookie are kept:
+        the id owns the user's fields (see utils.fields), which a new id
+        would orphan.
+        """
         cookie_signed = request.cookies.get("idsession")
         if not cookie_signed:
             return
@@ -125,22 +240,15 @@ class Session(metaclass=SessionMeta):
         try:
             idsession_to_clear = signer.unsign(cookie_signed).decode()
         except BadSignature:
-            idsession_to_clear = None
-
-        if idsession_to_clear:
-            session_col.delete_one({"__idsession": idsession_to_clear})
+            return
 
-        host = request.host.split(":")[0]
-        is_local = host in ["127.0.0.1", "localhost"]
+        session_col.update_one(
+            {"__idsession": idsession_to_clear}, {"$set": {"__data": {}}}
+        )
+        _touched.pop(idsession_to_clear, None)
 
-        @after_this_request
-        def delete_cookie(response: Response):
-            response.set_cookie(
-                "idsession",
-                "",
-                max_age=0,
-                httponly=True,
-                secure=not is_local,
-                samesite="Lax",
-            )
-            return response
+        # Forget the loaded data so nothing stale is flushed back
+        for instance in g.get("_sessions", {}).values():
+            if instance.idsession == idsession_to_clear:
+                instance._doc = None
+                instance._dirty = {}
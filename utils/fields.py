@@ -0,0 +1,150 @@
+"""
+Multi-field, multi-tenant access to main_variables_col and field_data_col.
+
+Every field is identified by its owner (the session id from the `idsession`
+cookie, see utils.conexion.Session) and a field id chosen by the user:
+
+    {"owner": "<idsession>", "field_id": "north-plot", "width": 50.0, ...}
+
+Both collections have a unique (owner, field_id) index, and the listing uses
+an (owner, updated_at) index, so lookups stay flat as the number of fields
+grows. The field a request works on comes from the `field_id` query/JSON
+parameter, then the one selected in the session, then DEFAULT_FIELD_ID. The
+selection is kept in the inputs cache (utils.cache), so a hot request does not
+read the session document for it.
+
+Before fields had owners, each collection held a single document without
+`owner`. The first owner that opens its default field without having one
+adopts those documents (adopt_legacy), so the configured field is kept.
+"""
+
+from typing import Optional
+import threading
+
+from flask import request
+from pymongo import ASCENDING, DESCENDING
+
+from utils import cache
+from utils.conexion import Session, main_variables_col, field_data_col, calculated_data_col
+
+DEFAULT_FIELD_ID = "default"
+MAX_PAGE_SIZE = 100
+
+# Never expose the owner (session id) to clients
+PUBLIC_PROJECTION = {"_id": 0, "owner": 0}
+
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+# Set once no ownerless document is left, so misses stop looking for one
+_legacy_adopted = False
+
+
+def ensure_indexes():
+    """Create the lookup/listing indexes once per process."""
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    with _indexes_lock:
+        if _indexes_ready:
+            return
+        for col in (main_variables_col, field_data_col):
+            col.create_index(
+                [("owner", ASCENDING), ("field_id", ASCENDING)], unique=True
+            )
+        main_variables_col.create_index(
+            [("owner", ASCENDING), ("updated_at", DESCENDING)]
+        )
+        calculated_data_col.create_index("cache_key")
+        # Candidate lookup of utils.tolerance.nearest
+        calculated_data_col.create_index(
+            [
+                ("input_params.plant_type", ASCENDING),
+                ("input_params.latitude", ASCENDING),
+                ("input_params.longitude", ASCENDING),
+            ]
+        )
+        _indexes_ready = True
+
+
+def adopt_legacy(key: dict) -> bool:
+    """
+    Give the ownerless (pre multi-field) documents to `key`'s owner as its
+    default field. Atomic: only one owner gets them.
+
+    Returns:
+        True if a main variables document was adopted
+    """
+    global _legacy_adopted
+    if _legacy_adopted or key["field_id"] != DEFAULT_FIELD_ID:
+        return False
+    legacy = {"owner": {"$exists": False}}
+    adopt = {"$set": {"owner": key["owner"], "field_id": DEFAULT_FIELD_ID}}
+    adopted = main_variables_col.update_one(legacy, adopt).modified_count > 0
+    if adopted:
+        field_data_col.update_one(legacy, adopt)
+    else:
+        _legacy_adopted = True
+    return adopted
+
+
+def current_owner() -> str:
+    return Session.current().idsession
+
+
+def current_field_id() -> str:
+    """Field selected by this request, the session, or the default one."""
+    data = request.get_json(silent=True) if request.is_json else None
+    field_id = request.args.get("field_id") or (data or {}).get("field_id")
+    if field_id:
+        return str(field_id)
+    selected = cache.get_selected_field(current_owner(), lambda: Session["field_id"])
+    return selected or DEFAULT_FIELD_ID
+
+
+def select_field(field_id: str):
+    """Remember the field the user is working on."""
+    Session["field_id"] = field_id
+    cache.select_field(current_owner(), field_id)
+
+
+def field_key(owner: Optional[str] = None, field_id: Optional[str] = None) -> dict:
+    """Mongo filter for one field (defaults to the current owner and field)."""
+    ensure_indexes()
+    return {
+        "owner": owner or current_owner(),
+        "field_id": field_id or current_field_id(),
+    }
+
+
+def list_fields(owner: str, page: int = 1, page_size: int = 20) -> dict:
+    """
+    One page of the owner's fields, most recently updated first.
+
+    Returns:
+        {"fields": [...], "page": n, "page_size": n, "total": n}
+    """
+    ensure_indexes()
+    page = max(1, page)
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    projection = {
+        "_id": 0,
+        "field_id": 1,
+        "plant_type": 1,
+        "width": 1,
+        "length": 1,
+        "latitude": 1,
+        "longitude": 1,
+        "updated_at": 1,
+    }
+    cursor = (
+        main_variables_col.find({"owner": owner}, projection)
+        .sort("updated_at", DESCENDING)
+        .skip((page - 1) * page_size)
+        .limit(page_size)
+    )
+    return {
+        "fields": list(cursor),
+        "page": page,
+        "page_size": page_size,
+        "total": main_variables_col.count_documents({"owner": owner}),
+    }
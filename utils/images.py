@@ -0,0 +1,95 @@
+"""
+Post-processing of map screenshots.
+
+A capture is turned into two compressed files next to it:
+
+    m_<lat>_<lng>.webp         model input and full-size UI image (MAP_MAX_SIZE)
+    m_<lat>_<lng>_thumb.webp   small preview for the UI (MAP_THUMB_SIZE)
+
+WebP is used when Pillow supports it, otherwise JPEG (MAP_IMAGE_FORMAT selects
+it explicitly). The lossless capture is deleted unless MAP_KEEP_ORIGINAL is set.
+"""
+
+from os import getenv
+from pathlib import Path
+from typing import Dict
+import os
+
+from PIL import Image, features
+
+MAP_IMAGE_FORMAT = getenv("MAP_IMAGE_FORMAT", "webp").lower()  # "webp" or "jpeg"
+MAP_IMAGE_QUALITY = int(getenv("MAP_IMAGE_QUALITY", "80"))
+MAP_MAX_SIZE = int(getenv("MAP_MAX_SIZE", "1024"))
+MAP_THUMB_SIZE = int(getenv("MAP_THUMB_SIZE", "320"))
+MAP_KEEP_ORIGINAL = getenv("MAP_KEEP_ORIGINAL", "false").lower() in ("1", "true", "yes")
+
+THUMB_SUFFIX = "_thumb"
+
+
+def _format() -> str:
+    if MAP_IMAGE_FORMAT == "webp" and features.check("webp"):
+        return "webp"
+    return "jpeg"
+
+
+def _extension() -> str:
+    return ".webp" if _format() == "webp" else ".jpg"
+
+
+def compact_path(base: str) -> str:
+    """Path of the compressed image for a base path without extension."""
+    return base + _extension()
+
+
+def thumbnail_path(path: str) -> str:
+    """Path of the thumbnail that belongs to a compressed image."""
+    root, ext = os.path.splitext(path)
+    return root + THUMB_SUFFIX + ext
+
+
+def _save(image: Image.Image, path: str, max_size: int):
+    image = image.copy()
+    # thumbnail() keeps the aspect ratio and never upscales
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    tmp = path + ".tmp"
+    if _format() == "webp":
+        image.save(tmp, "WEBP", quality=MAP_IMAGE_QUALITY, method=4)
+    else:
+        image.save(tmp, "JPEG", quality=MAP_IMAGE_QUALITY, optimize=True, progressive=True)
+    # Readers only ever see complete files
+    os.replace(tmp, path)
+
+
+def compact(
+    source: str,
+    base: str,
+    max_size: int = MAP_MAX_SIZE,
+    thumb_size: int = MAP_THUMB_SIZE,
+    keep_original: bool = MAP_KEEP_ORIGINAL,
+) -> Dict[str, str]:
+    """
+    Write the compressed image and thumbnail for a lossless capture.
+
+    Args:
+        source: Path of the captured PNG
+        base: Output path without extension (e.g. static/imgs/data/m_1.5_2.5)
+        max_size: Longest side of the compressed image in pixels
+        thumb_size: Longest side of the thumbnail in pixels
+        keep_original: Keep the PNG instead of deleting it
+
+    Returns:
+        {"image": path, "thumbnail": path}
+    """
+    image_path = compact_path(base)
+    thumb_path = thumbnail_path(image_path)
+    Path(image_path).parent.mkdir(parents=True, exist_ok=True)
+
+    with Image.open(source) as image:
+        image = image.convert("RGB")
+        _save(image, image_path, max_size)
+        _save(image, thumb_path, thumb_size)
+
+    if not keep_original and os.path.abspath(source) != os.path.abspath(image_path):
+        os.remove(source)
+
+    return {"image": image_path, "thumbnail": thumb_path}
@@ -0,0 +1,192 @@
+"""
+Background jobs for the slow AI endpoints.
+
+A job runs a pipeline function (see utils.pipeline) on a process-local thread
+pool while its state lives in jobs_col, so any gunicorn worker can answer
+status queries for it:
+
+    {
+        "job_id": "...",
+        "owner": "<idsession>",
+        "kind": "calculate",
+        "status": "queued" | "running" | "done" | "error",
+        "stage": "search",
+        "progress": 40,
+        "result": {...tools.msg() dict...},
+        "created_at": ..., "updated_at": ..., "heartbeat_at": ...
+    }
+
+The process running a job refreshes its heartbeat_at every
+JOB_HEARTBEAT_SECONDS. A queued or running job whose heartbeat is older than
+JOB_STALE_SECONDS belonged to a worker that died (restart, timeout, OOM); it
+is marked as failed when it is next read, so clients stop waiting for it.
+
+A job is only visible to the session that submitted it (see get_job); the
+owner is never returned to clients. Finished jobs are removed by a TTL index
+after JOB_TTL_SECONDS.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from os import getenv
+from typing import Callable, Optional
+import threading
+import time
+
+
+from utils import tools, fields
+from utils.conexion import jobs_col, GenerateUuid, utcnow
+
+JOB_MAX_WORKERS = int(getenv("JOB_MAX_WORKERS", "4"))
+JOB_TTL_SECONDS = int(getenv("JOB_TTL_SECONDS", str(60 * 60 * 24)))
+JOB_HEARTBEAT_SECONDS = float(getenv("JOB_HEARTBEAT_SECONDS", "10"))
+JOB_STALE_SECONDS = float(getenv("JOB_STALE_SECONDS", str(JOB_HEARTBEAT_SECONDS * 6)))
+
+WORKER_LOST = "The server handling this job stopped. Please try again."
+
+_executor = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix="job")
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+# Jobs queued or running in this process (kept alive by _heartbeat)
+_active: set = set()
+_active_lock = threading.Lock()
+_heartbeat_thread: Optional[threading.Thread] = None
+
+
+def _ensure_indexes():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    with _indexes_lock:
+        if not _indexes_ready:
+            jobs_col.create_index("job_id", unique=True)
+            jobs_col.create_index("created_at", expireAfterSeconds=JOB_TTL_SECONDS)
+            _indexes_ready = True
+
+
+def _update(job_id: str, **fields):
+    fields["updated_at"] = utcnow()
+    jobs_col.update_one({"job_id": job_id}, {"$set": fields})
+
+
+def _heartbeat():
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        with _active_lock:
+            job_ids = list(_active)
+        if not job_ids:
+            continue
+        try:
+            jobs_col.update_many(
+                {"job_id": {"$in": job_ids}}, {"$set": {"heartbeat_at": utcnow()}}
+            )
+        except Exception as e:
+            print(f"\033[91mJob heartbeat failed: {e}\033[0m")
+
+
+def _track(job_id: str):
+    global _heartbeat_thread
+    with _active_lock:
+        _active.add(job_id)
+        # Started lazily so the thread belongs to the (forked) worker process
+        if _heartbeat_thread is None or not _heartbeat_thread.is_alive():
+            _heartbeat_thread = threading.Thread(
+                target=_heartbeat, name="job-heartbeat", daemon=True
+            )
+            _heartbeat_thread.start()
+
+
+def _untrack(job_id: str):
+    with _active_lock:
+        _active.discard(job_id)
+
+
+def _run(job_id: str, fn: Callable, args: tuple):
+    try:
+        _execute(job_id, fn, args)
+    finally:
+        _untrack(job_id)
+
+
+def _execute(job_id: str, fn: Callable, args: tuple):
+    _update(job_id, status="running", stage="started", progress=0)
+
+    def progress(stage: str, percent: int):
+        _update(job_id, stage=stage, progress=percent)
+
+    try:
+        result = fn(*args, progress=progress)
+        _update(job_id, status="done", stage="done", progress=100, result=result)
+    except Exception as e:
+        _update(job_id, status="error", stage="error", result=tools.msg_err(e))
+
+
+def submit_job(kind: str, fn: Callable, *args) -> str:
+    """
+    Queue `fn(*args, progress=...)` as a background job owned by the current session.
+
+    Args:
+        kind: Job type label (e.g. "calculate", "advice")
+        fn: Pipeline function returning a tools.msg() dict
+        *args: Positional arguments for fn
+
+    Returns:
+        The new job id
+    """
+    _ensure_indexes()
+    job_id = GenerateUuid()
+    now = utcnow()
+    jobs_col.insert_one(
+        {
+            "job_id": job_id,
+            "owner": fields.current_owner(),
+            "kind": kind,
+            "status": "queued",
+            "stage": "queued",
+            "progress": 0,
+            "result": None,
+            "created_at": now,
+            "updated_at": now,
+            "heartbeat_at": now,
+        }
+    )
+    _track(job_id)
+    _executor.submit(_run, job_id, fn, args)
+    return job_id
+
+
+def get_job(job_id: str, owner: str) -> Optional[dict]:
+    """Return the job document of `owner` (without _id/owner) or None if unknown/expired."""
+    job = jobs_col.find_one({"job_id": job_id, "owner": owner}, fields.PUBLIC_PROJECTION)
+    if job and job["status"] in ("queued", "running"):
+        heartbeat = job.get("heartbeat_at") or job["updated_at"]
+        if (utcnow() - heartbeat).total_seconds() > JOB_STALE_SECONDS:
+            return _fail_stale(job_id, owner)
+    return job
+
+
+def _fail_stale(job_id: str, owner: str) -> Optional[dict]:
+    """Mark a job whose worker died as failed (unless it moved on meanwhile)."""
+    now = utcnow()
+    cutoff = now - timedelta(seconds=JOB_STALE_SECONDS)
+    jobs_col.update_one(
+        {
+            "job_id": job_id,
+            "owner": owner,
+            "status": {"$in": ["queued", "running"]},
+            "$or": [
+                {"heartbeat_at": {"$lt": cutoff}},
+                # Jobs queued before heartbeats were recorded
+                {"heartbeat_at": {"$exists": False}, "updated_at": {"$lt": cutoff}},
+            ],
+        },
+        {
+            "$set": {
+                "status": "error",
+                "stage": "error",
+                "result": tools.msg(1, WORKER_LOST),
+                "updated_at": now,
+            }
+        },
+    )
+    return jobs_col.find_one({"job_id": job_id, "owner": owner}, fields.PUBLIC_PROJECTION)
@@ -0,0 +1,111 @@
+"""
+Registry of captured map images, so nearby locations reuse one capture.
+
+Every capture is stored in maps_col with its center as a GeoJSON point
+(2dsphere index), the map zoom, the capture time and the image paths:
+
+    {"location": {"type": "Point", "coordinates": [lng, lat]}, "zoom": 7.4,
+     "path": "static/imgs/data/m_18.73_-70.16.webp",
+     "thumbnail": "static/imgs/data/m_18.73_-70.16_thumb.webp",
+     "captured_at": datetime}
+
+At the zoom used by the pipeline a capture covers hundreds of kilometres, so a
+pin moved by a few metres should not trigger a new browser capture.
+
+Configuration:
+    MAP_REUSE_RADIUS_METERS    Maximum distance to a reusable capture (default 2000)
+    MAP_MAX_AGE_DAYS           Maximum age of a reusable capture (default 30)
+"""
+
+from datetime import datetime, timedelta
+from os import getenv
+from typing import Optional
+import os
+import threading
+
+from pymongo import ASCENDING, GEOSPHERE
+
+from utils.conexion import maps_col
+
+MAP_REUSE_RADIUS_METERS = float(getenv("MAP_REUSE_RADIUS_METERS", "2000"))
+MAP_MAX_AGE_DAYS = float(getenv("MAP_MAX_AGE_DAYS", "30"))
+
+# Candidates checked per lookup: a capture may be missing from this host's disk
+_CANDIDATES = 5
+
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+
+
+def ensure_indexes():
+    """Create the geospatial and path indexes once per process."""
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    with _indexes_lock:
+        if _indexes_ready:
+            return
+        maps_col.create_index([("location", GEOSPHERE), ("zoom", ASCENDING)])
+        maps_col.create_index("path", unique=True)
+        _indexes_ready = True
+
+
+def _point(lat: float, lng: float) -> dict:
+    return {"type": "Point", "coordinates": [float(lng), float(lat)]}
+
+
+def find_capture(
+    lat: float,
+    lng: float,
+    zoom: float,
+    radius_m: float = MAP_REUSE_RADIUS_METERS,
+    max_age_days: float = MAP_MAX_AGE_DAYS,
+) -> Optional[dict]:
+    """
+    The nearest registered capture usable for a location, or None.
+
+    Args:
+        lat, lng: Location of the field
+        zoom: Map zoom the capture must have been taken at
+        radius_m: Maximum distance to the capture center in meters
+        max_age_days: Ignore captures older than this
+
+    Returns:
+        The registry document (without _id) whose image exists on this host
+    """
+    ensure_indexes()
+    cursor = maps_col.find(
+        {
+            "location": {
+                "$nearSphere": {
+                    "$geometry": _point(lat, lng),
+                    "$maxDistance": radius_m,
+                }
+            },
+            "zoom": zoom,
+            "captured_at": {"$gte": datetime.now() - timedelta(days=max_age_days)},
+        },
+        {"_id": 0},
+    ).limit(_CANDIDATES)
+
+    for doc in cursor:
+        if os.path.exists(doc["path"]):
+            return doc
+    return None
+
+
+def register(lat: float, lng: float, zoom: float, path: str, thumbnail: Optional[str] = None):
+    """Record a new capture (replacing an older one with the same path)."""
+    ensure_indexes()
+    maps_col.update_one(
+        {"path": path},
+        {
+            "$set": {
+                "location": _point(lat, lng),
+                "zoom": zoom,
+                "thumbnail": thumbnail,
+                "captured_at": datetime.now(),
+            }
+        },
+        upsert=True,
+    )
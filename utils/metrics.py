@@ -0,0 +1,210 @@
+"""
+Timing spans and Prometheus metrics.
+
+    with metrics.span("gemini.upload"):
+        ...
+
+    @metrics.timed("pipeline.calculate")
+    def calculate(...): ...
+
+Every span is observed in the `stage_seconds{stage=...}` histogram and counted
+in `stage_in_flight{stage=...}` while it runs. Spans nest (the path is kept
+per thread/context), and spans slower than METRICS_SLOW_SPAN_SECONDS are
+logged with their path, e.g.
+
+    slow span: pipeline.calculate > pipeline.analysis > gemini.generate 14.20s
+
+Cache lookups are counted with cache_hit(), HTTP requests by init_app() (and
+asgi.py for its async routes), provider calls by utils.ai.governor, log
+records written/dropped/failed by utils.tools.LogSink.
+
+Several gunicorn workers: when PROMETHEUS_MULTIPROC_DIR is set (see
+gunicorn.conf.py) every worker writes its samples there and /metrics
+(routes/Metrics.py) aggregates all of them.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from os import getenv
+from typing import Callable, Optional
+import logging
+import time
+
+from dotenv import load_dotenv
+from flask import Flask, g, request
+
+# PROMETHEUS_MULTIPROC_DIR may come from .env; prometheus_client reads it on import
+load_dotenv()
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess  # noqa: E402
+
+METRICS_SLOW_SPAN_SECONDS = float(getenv("METRICS_SLOW_SPAN_SECONDS", "10"))
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+STAGE_SECONDS = Histogram(
+    "stage_seconds", "Duration of pipeline stages and external calls", ["stage"], buckets=_BUCKETS
+)
+STAGE_IN_FLIGHT = Gauge(
+    "stage_in_flight", "Stages currently running", ["stage"], multiprocess_mode="livesum"
+)
+STAGE_ERRORS = Counter("stage_errors_total", "Stages that raised", ["stage"])
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups", ["cache", "result"])
+CACHE_EVICTIONS = Counter("cache_evictions_total", "Entries evicted for space", ["cache"])
+HTTP_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Duration of HTTP requests (until the response starts)",
+    ["endpoint", "method", "status"],
+    buckets=_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests being handled", multiprocess_mode="livesum"
+)
+DEPENDENCY_CALLS = Counter(
+    "dependency_calls_total", "Calls to external providers by outcome", ["provider", "result"]
+)
+DEPENDENCY_THROTTLED = Counter(
+    "dependency_throttled_total",
+    "Calls delayed or refused by the rate limiter",
+    ["provider", "outcome"],
+)
+PROMPT_TOKENS = Histogram(
+    "prompt_tokens",
+    "Text tokens of each model prompt (see utils.ai.context)",
+    ["prompt"],
+    buckets=(100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000, 16000),
+)
+BREAKER_TRIPS = Counter(
+    "circuit_breaker_trips_total", "Times a circuit breaker opened", ["provider"]
+)
+LOG_RECORDS = Counter(
+    "log_records_total", "Log records by outcome (see utils.tools.LogSink)", ["result"]
+)
+
+logger = logging.getLogger(__name__)
+
+_path: ContextVar[tuple] = ContextVar("span_path", default=())
+
+
+def observe(stage: str, seconds: float):
+    """Record a duration measured elsewhere (e.g. a queue wait)."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block as `stage` (see module docstring)."""
+    path = _path.get() + (stage,)
+    token = _path.set(path)
+    in_flight = STAGE_IN_FLIGHT.labels(stage)
+    in_flight.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        in_flight.dec()
+        _path.reset(token)
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        if elapsed >= METRICS_SLOW_SPAN_SECONDS:
+            logger.warning("slow span: %s %.2fs", " > ".join(path), elapsed)
+
+
+def timed(stage: str) -> Callable:
+    """Decorator form of span()."""
+
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def cache_hit(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def cache_evicted(cache: str, count: int = 1):
+    CACHE_EVICTIONS.labels(cache).inc(count)
+
+
+def dependency_call(provider: str, result: str):
+    DEPENDENCY_CALLS.labels(provider, result).inc()
+
+
+def throttled(provider: str, outcome: str, seconds: float = 0):
+    DEPENDENCY_THROTTLED.labels(provider, outcome).inc()
+    if seconds:
+        observe(f"throttle.{provider}", seconds)
+
+
+def breaker_tripped(provider: str):
+    BREAKER_TRIPS.labels(provider).inc()
+
+
+def prompt_tokens(prompt: str, tokens: int):
+    PROMPT_TOKENS.labels(prompt).observe(tokens)
+
+
+def log_records(result: str, count: int = 1):
+    LOG_RECORDS.labels(result).inc(count)
+
+
+def observe_request(endpoint: str, method: str, status: int, seconds: float):
+    HTTP_SECONDS.labels(endpoint, method, str(status)).observe(seconds)
+
+
+def init_app(app: Flask):
+    """Time every request of the app."""
+
+    @app.before_request
+    def start_timer():
+        g._metrics_started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @app.teardown_request
+    def stop_timer(exception=None):
+        started = g.pop("_metrics_started", None)
+        if started is None:
+            return
+        HTTP_IN_FLIGHT.dec()
+        status = getattr(g, "_metrics_status", 500 if exception else 200)
+        observe_request(
+            request.endpoint or "unknown",
+            request.method,
+            status,
+            time.perf_counter() - started,
+        )
+
+    @app.after_request
+    def record_status(response):
+        g._metrics_status = response.status_code
+        return response
+
+
+def render(registry: Optional[CollectorRegistry] = None) -> tuple:
+    """(body, content type) of the Prometheus exposition for all workers."""
+    if registry is None:
+        if getenv("PROMETHEUS_MULTIPROC_DIR"):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,732 @@
+"""
+Calculation and advice pipelines behind /Calculate and /GetAdvice.
+
+Both functions take the already-loaded main variables and field data, so they
+can run inside a request or on a background job (see utils.jobs). They return
+the same tools.msg() dicts the routes send to the client.
+"""
+
+from typing import Callable, Dict, Iterator, Optional, Tuple
+from datetime import datetime
+import hashlib
+import json
+import math
+import os
+import re
+
+from utils import tools, singleflight, cache, images, maps, tolerance, scoring, metrics
+from utils.ai.tools import save_page_screenshot
+from utils.ai.main import prompt, prompt_stream, search_many
+from utils.ai import context
+from utils.ai.search_cache import bucket_coordinates
+
+
+# progress(stage, percent) callback used by background jobs
+Progress = Optional[Callable[[str, int], None]]
+
+# Search name -> query class (selects the search cache TTL)
+SEARCH_CLASSES = {
+    "temperatura": "soil_temperature",
+    "demanda": "market_demand",
+    "clima": "weather",
+}
+
+# CropSmart page and zoom level of the map captures
+CROPSMART_URL = os.getenv("CROPSMART_URL", "https://cat.csiss.gmu.edu/CropSmart")
+MAP_ZOOM = 7.4
+
+MAP_NOT_FOUND = (
+    "Map screenshot not found. Please calculate data first by loading the main page."
+)
+
+
+def report_progress(progress: Progress, stage: str, percent: int):
+    if progress:
+        progress(stage, percent)
+
+
+def build_cache_key(main_data: dict, field_data: dict) -> Tuple[str, dict]:
+    """
+    Create a cache key based on all input parameters.
+
+    Inputs are snapped to their tolerance bands before hashing (see
+    utils.tolerance), so sensor jitter maps to the same key. The returned
+    parameters are the actual inputs, stored as input_params.
+    """
+    cache_key_data = {
+        "width": main_data.get("width"),
+        "length": main_data.get("length"),
+        "plant_type": main_data.get("plant_type"),
+        "latitude": main_data.get("latitude"),
+        "longitude": main_data.get("longitude"),
+        "water_ph": field_data.get("water_ph"),
+        "water_conductivity": field_data.get("water_conductivity"),
+        "soil_salinity": field_data.get("soil_salinity"),
+        "soil_moisture": field_data.get("soil_moisture"),
+    }
+    cache_key = hashlib.md5(
+        json.dumps(tolerance.quantize(cache_key_data), sort_keys=True).encode()
+    ).hexdigest()
+    return cache_key, cache_key_data
+
+
+def build_search_queries(lat: float, lng: float, tipo_planta: str) -> Dict[str, str]:
+    """
+    Internet searches used by the analysis.
+
+    Location queries use grid-bucketed coordinates so that nearby fields share
+    cached results; the demand query depends only on the crop.
+    """
+    b_lat, b_lng = bucket_coordinates(lat, lng)
+    return {
+        "temperatura": f"Soil temperature in the following location: Latitude: {b_lat}, Longitude: {b_lng}",
+        "demanda": f"Market demand for the following crop: {tipo_planta}",
+        "clima": f"Weather forecast in the following location: Latitude: {b_lat}, Longitude: {b_lng}",
+    }
+
+
+@metrics.timed("pipeline.calculate")
+def calculate(main_data: dict, field_data: dict, progress: Progress = None) -> dict:
+    """
+    Compute (or fetch from cache) the field metrics shown on /Principal.
+
+    Args:
+        main_data: Document from main_variables_col
+        field_data: Document from field_data_col (may be empty)
+        progress: Optional progress(stage, percent) callback
+
+    Returns:
+        tools.msg() dict with url_mapa, temperatura_suelo, demanda_producto,
+        probabilidad_lluvia and efectividad_cultivo
+    """
+    report_progress(progress, "cache", 5)
+    cache_key, cache_key_data = build_cache_key(main_data, field_data)
+
+    # Check if we have cached data for these parameters
+    cached_response = cached_calculation(cache_key, cache_key_data)
+    metrics.cache_hit("calculation", cached_response is not None)
+    if cached_response:
+        print(f"Cache HIT for key: {cached_response['cache_match']['cache_key']}")
+        return cached_response
+
+    print(f"Cache MISS for key: {cache_key}. Calculating...")
+
+    # Concurrent misses for the same inputs share one computation
+    return singleflight.do(
+        f"calculate:{cache_key}",
+        lambda: _compute_calculation(
+            main_data, field_data, cache_key, cache_key_data, progress
+        ),
+        lambda: cached_calculation(cache_key, cache_key_data, refresh=True),
+    )
+
+
+def find_calculation(cache_key: str, params: dict, refresh: bool = False) -> Optional[dict]:
+    """
+    Stored document for the inputs: the exact cache key, else the nearest
+    complete calculation if CACHE_NEAREST_MATCH is enabled.
+    """
+    cached_result = cache.get_calculation(cache_key, refresh=refresh)
+    if cached_result and "calculated_at" in cached_result:
+        return cached_result
+    if tolerance.CACHE_NEAREST_MATCH:
+        match = tolerance.nearest(params)
+        if match:
+            return match[0]
+    # May be an advice-only document
+    return cached_result
+
+
+def cache_match(cached_result: dict, params: dict) -> dict:
+    """Which cached entry answered and how far (in tolerance bands) it was."""
+    distance = tolerance.distance(params, cached_result.get("input_params") or {})
+    return {
+        "cache_key": cached_result.get("cache_key"),
+        "distance": None if math.isinf(distance) else distance,
+    }
+
+
+def cached_calculation(
+    cache_key: str, params: dict, refresh: bool = False
+) -> Optional[dict]:
+    """Response for a stored calculation, or None if there is none yet."""
+    cached_result = find_calculation(cache_key, params, refresh=refresh)
+    if not cached_result or "calculated_at" not in cached_result:
+        return None
+    return tools.msg(
+        0,
+        "Data retrieved from cache",
+        url_mapa=cached_result.get("url_mapa"),
+        url_miniatura=cached_result.get("url_miniatura"),
+        temperatura_suelo=cached_result.get("temperatura_suelo"),
+        demanda_producto=cached_result.get("demanda_producto"),
+        probabilidad_lluvia=cached_result.get("probabilidad_lluvia"),
+        efectividad_cultivo=cached_result.get("efectividad_cultivo"),
+        from_cache=True,
+        cache_match=cache_match(cached_result, params),
+    )
+
+
+def map_base(lat: float, lng: float) -> str:
+    return f"static/imgs/data/m_{lat}_{lng}"
+
+
+@metrics.timed("pipeline.map_lookup")
+def find_map(lat: float, lng: float) -> Optional[str]:
+    """Path of an existing map image usable for a location, or None."""
+    base = map_base(lat, lng)
+    path = images.compact_path(base)
+    if os.path.exists(path):
+        return path
+
+    # Captures from before maps were compacted: compact them once, in place
+    if os.path.exists(base + ".png"):
+        return singleflight.do(
+            f"map-compact:{lat},{lng}",
+            lambda: _compact_legacy_map(lat, lng),
+            lambda: path if os.path.exists(path) else None,
+        )
+
+    # A recent capture of a nearby location shows the same area
+    capture = maps.find_capture(lat, lng, MAP_ZOOM)
+    return capture["path"] if capture else None
+
+
+@metrics.timed("pipeline.map")
+def get_map(lat: float, lng: float) -> str:
+    """Path of the CropSmart map image for a location, capturing it if needed."""
+    path = find_map(lat, lng)
+    if path:
+        return path
+
+    # Concurrent requests for one location share the capture (and its files)
+    return singleflight.do(
+        f"map:{lat},{lng}", lambda: _capture_map(lat, lng), lambda: find_map(lat, lng)
+    )
+
+
+def _compact_legacy_map(lat: float, lng: float) -> Optional[str]:
+    base = map_base(lat, lng)
+    try:
+        result = images.compact(base + ".png", base)
+    except OSError as e:
+        # Unreadable, or compacted (and deleted) by another worker first
+        tools.write_log(f"Legacy map compaction failed ({base}.png): {e}", 1)
+        path = images.compact_path(base)
+        return path if os.path.exists(path) else None
+    maps.register(lat, lng, MAP_ZOOM, result["image"], result["thumbnail"])
+    return result["image"]
+
+
+def _capture_map(lat: float, lng: float) -> str:
+    # Capture only the map canvas, then shrink it for the model and the UI
+    url = f"{CROPSMART_URL}#map={MAP_ZOOM}/{lng}/{lat}"
+    base = map_base(lat, lng)
+    capture = save_page_screenshot(url, base + ".png", clip_selector="canvas")
+    result = images.compact(capture, base)
+    maps.register(lat, lng, MAP_ZOOM, result["image"], result["thumbnail"])
+    return result["image"]
+
+
+def prefetch(main_data: dict, cancelled: Callable[[], bool] = lambda: False) -> Dict[str, str]:
+    """
+    Run the stages that do not depend on the field data (searches and map)
+    so that a later calculate() finds them cached (see utils.prefetch).
+
+    Args:
+        main_data: Main variables of the field
+        cancelled: Checked before each stage; True skips the rest
+
+    Returns:
+        Stage name -> "cached", "computed", "failed" or "cancelled"
+    """
+    lat: float = main_data["latitude"]
+    lng: float = main_data["longitude"]
+    queries = build_search_queries(lat, lng, main_data["plant_type"])
+
+    # Searches first: they are quick, and a concurrent calculate() joins the
+    # map capture (single-flight) but not a running search
+    if cancelled():
+        return {**{name: "cancelled" for name in queries}, "map": "cancelled"}
+    stages = search_many(queries, classes=SEARCH_CLASSES).stages()
+
+    if find_map(lat, lng):
+        stages["map"] = "cached"
+    elif cancelled():
+        stages["map"] = "cancelled"
+    else:
+        get_map(lat, lng)
+        stages["map"] = "computed"
+    return stages
+
+
+def _compute_calculation(
+    main_data: dict,
+    field_data: dict,
+    cache_key: str,
+    cache_key_data: dict,
+    progress: Progress,
+) -> dict:
+    """
+    Run the map/search/model stages, reusing cached stages, and store the result.
+
+    Each stage is cached on its own inputs: the map on the location, the
+    location searches on the bucketed location, the demand search on the crop
+    (see utils.ai.search_cache), so a field data edit reruns only the analysis.
+    """
+    lat: float = main_data["latitude"]
+    lng: float = main_data["longitude"]
+    stages: Dict[str, str] = {}
+
+    report_progress(progress, "map", 10)
+    mapa = find_map(lat, lng)
+    metrics.cache_hit("map", mapa is not None)
+    stages["map"] = "cached" if mapa else "computed"
+    if not mapa:
+        mapa = get_map(lat, lng)
+
+    # Only searches without a cached result go to the network, all in parallel
+    report_progress(progress, "search", 40)
+    queries = build_search_queries(lat, lng, main_data["plant_type"])
+    with metrics.span("pipeline.search"):
+        busquedas = search_many(queries, classes=SEARCH_CLASSES)
+    stages.update(busquedas.stages())
+
+    report_progress(progress, "analysis", 60)
+    response_data = analyze(main_data, field_data, mapa, busquedas)
+    stages["analysis"] = "computed"
+
+    incomplete = incomplete_response(response_data, stages, busquedas.errors)
+    if incomplete:
+        return incomplete
+
+    # Save to cache collection
+    report_progress(progress, "saving", 95)
+    document = build_cache_document(cache_key, cache_key_data, response_data)
+    cache.put_calculation(cache_key, document)
+    print(f"Saved calculation to cache with key: {cache_key} (stages: {stages})")
+
+    return tools.msg(0, "Data calculated successfully", **response_data, stages=stages)
+
+
+def incomplete_response(
+    response_data: dict, stages: Dict[str, str], search_errors: Dict[str, str]
+) -> Optional[dict]:
+    """
+    Response for a result that must not be cached, or None.
+
+    A local fallback or an analysis made without some of the searches is not
+    cached, so the next request asks the model (and the search) again.
+    """
+    if response_data.get("estimacion_local"):
+        return tools.msg(
+            0, "Model unavailable, local estimate", **response_data, stages=stages
+        )
+    if search_errors:
+        return tools.msg(
+            0,
+            "Data calculated without some searches",
+            **response_data,
+            stages=stages,
+            search_errors=search_errors,
+        )
+    return None
+
+
+def build_cache_document(cache_key: str, cache_key_data: dict, response_data: dict) -> dict:
+    """Document stored in calculated_data_col for a finished calculation."""
+    return {
+        "cache_key": cache_key,
+        "input_params": cache_key_data,
+        "calculated_at": datetime.now(),
+        **response_data,
+    }
+
+
+@metrics.timed("pipeline.analysis")
+def analyze(main_data: dict, field_data: dict, mapa: str, busquedas: dict) -> dict:
+    """
+    Ask the model for the field metrics given the map and search results.
+
+    Args:
+        main_data: Main variables of the field
+        field_data: Field measurements (may be empty)
+        mapa: Path of the map screenshot
+        busquedas: search_many() results keyed like build_search_queries();
+            a missing name is a failed search
+
+    Returns:
+        url_mapa, temperatura_suelo, demanda_producto, probabilidad_lluvia
+        and efectividad_cultivo
+    """
+    prompt_param, system_prompt = analysis_prompt(main_data, field_data, busquedas)
+    try:
+        ai_response = prompt(
+            prompt_param=prompt_param, files=[mapa], system_prompt=system_prompt
+        )
+    except Exception as e:
+        # Model slow or unavailable: answer with the local estimate, not cached
+        tools.write_log(f"Analysis model call failed, using local estimate: {e}", 1)
+        return local_analysis(main_data, field_data, mapa)
+
+    return analysis_result(ai_response, main_data, field_data, mapa)
+
+
+def analysis_prompt(main_data: dict, field_data: dict, busquedas: dict) -> Tuple[str, str]:
+    """(prompt, system prompt) for the analysis model call."""
+    # Extract main variables
+    ancho: float = float(main_data["width"])
+    alto: float = float(main_data["length"])
+    tipo_planta: str = main_data["plant_type"]
+    lat: float = main_data["latitude"]
+    lng: float = main_data["longitude"]
+
+    queries = build_search_queries(lat, lng, tipo_planta)
+    busquedas_text = context.search_context(
+        [
+            ("Soil temperature", busquedas.get("temperatura"), queries["temperatura"]),
+            ("Market demand", busquedas.get("demanda"), queries["demanda"]),
+            ("Weather forecast", busquedas.get("clima"), queries["clima"]),
+        ]
+    )
+
+    # Prepare field data section
+    field_data_text = ""
+    if field_data:
+        field_data_text = f"""
+**Field measurements:**
+- Water pH: {field_data.get("water_ph", "Not measured")}
+- Water Conductivity: {field_data.get("water_conductivity", "Not measured")}
+- Soil Salinity: {field_data.get("soil_salinity", "Not measured")}
+- Soil Moisture: {field_data.get("soil_moisture", "Not measured")}
+"""
+
+    prompt_param = f"""
+Analyze the following data from an agricultural field and the attached satellite map:
+- Width: {ancho} meters
+- Length: {alto} meters
+- Total area: {ancho * alto} m²
+- Plant type: {tipo_planta}
+- Location: Latitude {lat}, Longitude {lng}
+{field_data_text}
+**Information from internet searches:**
+
+{busquedas_text}
+
+Based on this information, generate a JSON with the requested data.
+        """
+    system_prompt = """
+You are an agriculture expert. Analyze the provided information and respond ONLY with a valid JSON:
+
+{
+    "temperatura_suelo": "<numeric value in °F (Fahrenheit)>",
+    "demanda_producto": "<ONLY one word: High, Medium, or Low>",
+    "probabilidad_lluvia": "<numeric percentage value without % symbol, e.g., 20, 45, 80>",
+    "efectividad_cultivo": "<numeric percentage (0-100) representing crop effectiveness based on all conditions>"
+}
+
+RULES:
+- Only return the JSON, nothing else
+- temperatura_suelo must be in Fahrenheit (°F)
+- demanda_producto must be EXACTLY one of these words: High, Medium, Low (no additional text)
+- probabilidad_lluvia must be a number only (e.g., 20, not "20%")
+- efectividad_cultivo should consider soil conditions, plant type, location, field measurements, and climate
+- If info is missing, make a reasonable estimate based on available context
+        """
+    return context.finish("analysis", prompt_param, system_prompt)
+
+
+def analysis_result(ai_response: str, main_data: dict, field_data: dict, mapa: str) -> dict:
+    """analyze() result from the model's answer."""
+    # Parse Gemini's JSON response
+    try:
+        # Extract JSON from response (may come with markdown ```json```)
+        json_match = re.search(r"\{.*\}", ai_response, re.DOTALL)
+        if json_match:
+            datos_calculados = json.loads(json_match.group())
+        else:
+            datos_calculados = {
+                "temperatura_suelo": "Not available",
+                "demanda_producto": "Medium",
+                "probabilidad_lluvia": "Not available",
+                "efectividad_cultivo": "Not available",
+            }
+    except json.JSONDecodeError:
+        datos_calculados = {
+            "temperatura_suelo": "Processing error",
+            "demanda_producto": "Medium",
+            "probabilidad_lluvia": "Processing error",
+            "efectividad_cultivo": "Processing error",
+        }
+
+    # Prepare response data
+    response_data = {
+        "url_mapa": mapa,
+        "url_miniatura": images.thumbnail_path(mapa),
+        "temperatura_suelo": datos_calculados.get("temperatura_suelo", "Not available"),
+        "demanda_producto": datos_calculados.get("demanda_producto", "Medium"),
+        "probabilidad_lluvia": datos_calculados.get(
+            "probabilidad_lluvia", "Not available"
+        ),
+        "efectividad_cultivo": datos_calculados.get(
+            "efectividad_cultivo", "Not available"
+        ),
+    }
+
+    # Unparseable answer: fill the effectiveness in from the local estimate
+    try:
+        float(str(response_data["efectividad_cultivo"]).rstrip("% "))
+    except (TypeError, ValueError):
+        response_data["efectividad_cultivo"] = scoring.estimate(main_data, field_data)[
+            "efectividad_cultivo"
+        ]
+
+    return response_data
+
+
+def local_analysis(main_data: dict, field_data: dict, mapa: str) -> dict:
+    """analyze() result from the local scoring engine only (see utils.scoring)."""
+    estimate = scoring.estimate(main_data, field_data)
+    return {
+        "url_mapa": mapa,
+        "url_miniatura": images.thumbnail_path(mapa),
+        "temperatura_suelo": "Not available",
+        "demanda_producto": "Medium",
+        "probabilidad_lluvia": "Not available",
+        "efectividad_cultivo": estimate["efectividad_cultivo"],
+        "estimacion_local": True,
+    }
+
+
+@metrics.timed("pipeline.advice")
+def get_advice(main_data: dict, field_data: dict, progress: Progress = None) -> dict:
+    """
+    Generate (or fetch from cache) advice on improving crop effectiveness.
+
+    Args:
+        main_data: Document from main_variables_col
+        field_data: Document from field_data_col (may be empty)
+        progress: Optional progress(stage, percent) callback
+
+    Returns:
+        tools.msg() dict with the advice text
+    """
+    path = find_map(main_data["latitude"], main_data["longitude"])
+    if not path:
+        return tools.msg(1, MAP_NOT_FOUND)
+
+    # Get the cached calculation results if available
+    report_progress(progress, "cache", 5)
+    cache_key, params = build_cache_key(main_data, field_data)
+    cached_result = find_calculation(cache_key, params)
+    if cached_result:
+        # Advice belongs to the matched calculation
+        cache_key = cached_result.get("cache_key", cache_key)
+
+    # Check if advice already exists in cache
+    metrics.cache_hit("advice", bool(cached_result and cached_result.get("advice")))
+    if cached_result and cached_result.get("advice"):
+        print(f"Advice Cache HIT for key: {cache_key}")
+        return tools.msg(
+            0,
+            "Advice retrieved from cache",
+            advice=cached_result["advice"],
+            cache_match=cache_match(cached_result, params),
+        )
+
+    print(f"Advice Cache MISS for key: {cache_key}. Generating advice...")
+
+    # Concurrent misses for the same inputs share one generation
+    return singleflight.do(
+        f"advice:{cache_key}",
+        lambda: _compute_advice(
+            main_data, field_data, path, cache_key, cached_result, progress
+        ),
+        lambda: cached_advice(cache_key),
+    )
+
+
+def stream_advice(main_data: dict, field_data: dict) -> Iterator[Tuple[str, dict]]:
+    """
+    Advice as a stream of (event, data) pairs for /GetAdviceStream.
+
+    Yields ("chunk", {"text": ...}) as the model writes, then one
+    ("done", tools.msg(...)) with the complete advice (or the error). Cached
+    advice is sent as a single chunk. The advice is stored once the stream
+    finishes, so an interrupted stream leaves nothing half-written.
+    Concurrent viewers share one generation: the others get the stored
+    advice once it is complete.
+    """
+    path = find_map(main_data["latitude"], main_data["longitude"])
+    if not path:
+        yield "done", tools.msg(1, MAP_NOT_FOUND)
+        return
+
+    cache_key, params = build_cache_key(main_data, field_data)
+    cached_result = find_calculation(cache_key, params)
+    if cached_result:
+        cache_key = cached_result.get("cache_key", cache_key)
+    if cached_result and cached_result.get("advice"):
+        print(f"Advice Cache HIT for key: {cache_key}")
+        yield "chunk", {"text": cached_result["advice"]}
+        yield "done", tools.msg(
+            0,
+            "Advice retrieved from cache",
+            advice=cached_result["advice"],
+            cache_match=cache_match(cached_result, params),
+        )
+        return
+
+    print(f"Advice Cache MISS for key: {cache_key}. Streaming advice...")
+
+    def produce() -> Iterator[Tuple[str, dict]]:
+        prompt_param, system_prompt = advice_prompt(main_data, field_data, cached_result)
+        chunks = []
+        try:
+            for text in prompt_stream(
+                prompt_param, files=[path], system_prompt=system_prompt
+            ):
+                chunks.append(text)
+                yield "chunk", {"text": text}
+        except Exception as e:
+            yield "done", tools.msg_err(e)
+            return
+
+        advice = save_advice(cache_key, "".join(chunks))
+        yield "done", tools.msg(0, "Advice generated successfully", advice=advice)
+
+    yield from singleflight.stream(
+        f"advice:{cache_key}", produce, lambda: cached_advice_events(cache_key)
+    )
+
+
+def _field_data_text(field_data: dict) -> str:
+    field_measurements = []
+    if field_data.get("water_ph"):
+        field_measurements.append(f"Water pH: {field_data['water_ph']}")
+    if field_data.get("water_conductivity"):
+        field_measurements.append(
+            f"Water Conductivity: {field_data['water_conductivity']}"
+        )
+    if field_data.get("soil_salinity"):
+        field_measurements.append(f"Soil Salinity: {field_data['soil_salinity']}")
+    if field_data.get("soil_moisture"):
+        field_measurements.append(f"Soil Moisture: {field_data['soil_moisture']}%")
+
+    return (
+        "\n".join(field_measurements)
+        if field_measurements
+        else "No field measurements available"
+    )
+
+
+def cached_advice(cache_key: str) -> Optional[dict]:
+    """Response for stored advice, or None if there is none yet."""
+    # Bypass the in-process tier: the advice may come from another worker
+    cached_result = cache.get_calculation(cache_key, refresh=True)
+    if not cached_result or not cached_result.get("advice"):
+        return None
+    return tools.msg(0, "Advice retrieved from cache", advice=cached_result["advice"])
+
+
+def cached_advice_events(cache_key: str) -> Optional[list]:
+    """stream_advice() events for stored advice, or None if there is none yet."""
+    response = cached_advice(cache_key)
+    if response is None:
+        return None
+    return [("chunk", {"text": response["advice"]}), ("done", response)]
+
+
+def advice_prompt(
+    main_data: dict, field_data: dict, cached_result: Optional[dict]
+) -> Tuple[str, str]:
+    """(prompt, system prompt) for the advice model call."""
+    ancho: float = float(main_data["width"])
+    alto: float = float(main_data["length"])
+    tipo_planta: str = main_data["plant_type"]
+    lat: float = main_data["latitude"]
+    lng: float = main_data["longitude"]
+    field_data_text = _field_data_text(field_data)
+
+    if cached_result:
+        temperatura_suelo = cached_result.get("temperatura_suelo", "Not available")
+        demanda_producto = cached_result.get("demanda_producto", "Unknown")
+        probabilidad_lluvia = cached_result.get("probabilidad_lluvia", "Not available")
+        efectividad_cultivo = cached_result.get("efectividad_cultivo", "Not available")
+    else:
+        # If no cached data, provide generic values
+        temperatura_suelo = "Not calculated"
+        demanda_producto = "Unknown"
+        probabilidad_lluvia = "Not calculated"
+        efectividad_cultivo = "Not calculated"
+
+    prompt_param = f"""
+You are an expert agricultural consultant. Based on the following farm data, provide a detailed yet concise recommendation on how to improve crop effectiveness.
+
+**Farm Information:**
+- Dimensions: {ancho}m x {alto}m (Total: {ancho * alto}m²)
+- Plant Type: {tipo_planta}
+- Location: Latitude {lat}, Longitude {lng}
+
+**Field Measurements:**
+{field_data_text}
+
+**Calculated Metrics:**
+- Soil Temperature: {temperatura_suelo}°F
+- Product Market Demand: {demanda_producto}
+- Rain Probability: {probabilidad_lluvia}%
+- Current Crop Effectiveness: {efectividad_cultivo}%
+
+Provide practical advice on how to improve the crop effectiveness percentage. Explain why the current effectiveness is at this level and what specific actions can be taken to improve it.
+
+MAXIMUM 150 WORDS. Be specific and actionable.
+        """
+    system_prompt = """
+You are an agricultural expert providing actionable advice to farmers.
+
+RULES:
+- Maximum 150 words
+- Be specific and practical
+- Focus on concrete actions
+- Explain why effectiveness is at current level
+- Suggest 2-3 specific improvements
+- Use clear, simple language
+- No bullet points, write in paragraph form
+- Be encouraging but realistic
+        """
+    return context.finish("advice", prompt_param, system_prompt)
+
+
+def save_advice(cache_key: str, ai_response: str) -> str:
+    """Store the advice next to the calculation and return the cleaned text."""
+    # Clean up the response (remove any markdown or extra formatting)
+    advice = ai_response.strip()
+    cache.update_calculation(
+        cache_key, {"advice": advice, "advice_generated_at": datetime.now()}
+    )
+    print(f"Saved advice to cache with key: {cache_key}")
+    return advice
+
+
+def _compute_advice(
+    main_data: dict,
+    field_data: dict,
+    path: str,
+    cache_key: str,
+    cached_result: Optional[dict],
+    progress: Progress,
+) -> dict:
+    """Generate advice with the model and store it next to the calculation."""
+    prompt_param, system_prompt = advice_prompt(main_data, field_data, cached_result)
+
+    # Generate AI advice
+    report_progress(progress, "analysis", 20)
+    ai_response = prompt(
+        prompt_param=prompt_param, files=[path], system_prompt=system_prompt
+    )
+
+    # Save advice to cache
+    report_progress(progress, "saving", 90)
+    advice = save_advice(cache_key, ai_response)
+
+    return tools.msg(0, "Advice generated successfully", advice=advice)
@@ -0,0 +1,214 @@
+"""
+Async versions of the /Calculate and /GetAdvice pipelines, served by asgi.py.
+
+Same results, caches and single-flight keys as utils.pipeline, so both paths
+share their work. The model calls, searches and map captures are awaited
+(utils.ai.aio) and hold no thread, so one worker keeps many analyses in
+flight; the map capture and the searches also run concurrently. Cache, lease
+and map-registry lookups are short MongoDB calls made through the
+utils.pipeline helpers in worker threads.
+"""
+
+from typing import AsyncIterator, Dict, Optional, Tuple
+import asyncio
+
+from utils import tools, singleflight, cache, images, maps, metrics, pipeline
+from utils.ai import aio, main
+from utils.pipeline import SEARCH_CLASSES, MAP_NOT_FOUND
+
+
+async def calculate(main_data: dict, field_data: dict) -> dict:
+    """pipeline.calculate() (see there for the arguments and result)."""
+    with metrics.span("pipeline.calculate"):
+        cache_key, cache_key_data = pipeline.build_cache_key(main_data, field_data)
+
+        cached_response = await asyncio.to_thread(
+            pipeline.cached_calculation, cache_key, cache_key_data
+        )
+        metrics.cache_hit("calculation", cached_response is not None)
+        if cached_response:
+            print(f"Cache HIT for key: {cached_response['cache_match']['cache_key']}")
+            return cached_response
+
+        print(f"Cache MISS for key: {cache_key}. Calculating...")
+
+        return await singleflight.do_async(
+            f"calculate:{cache_key}",
+            lambda: _compute_calculation(main_data, field_data, cache_key, cache_key_data),
+            lambda: pipeline.cached_calculation(cache_key, cache_key_data, refresh=True),
+        )
+
+
+async def get_map(lat: float, lng: float) -> str:
+    """pipeline.get_map() awaiting the capture."""
+    with metrics.span("pipeline.map"):
+        path = await asyncio.to_thread(pipeline.find_map, lat, lng)
+        if path:
+            return path
+
+        return await singleflight.do_async(
+            f"map:{lat},{lng}",
+            lambda: _capture_map(lat, lng),
+            lambda: pipeline.find_map(lat, lng),
+        )
+
+
+async def _capture_map(lat: float, lng: float) -> str:
+    url = f"{pipeline.CROPSMART_URL}#map={pipeline.MAP_ZOOM}/{lng}/{lat}"
+    base = pipeline.map_base(lat, lng)
+    capture = await aio.save_page_screenshot(url, base + ".png", clip_selector="canvas")
+    result = await asyncio.to_thread(images.compact, capture, base)
+    await asyncio.to_thread(
+        maps.register, lat, lng, pipeline.MAP_ZOOM, result["image"], result["thumbnail"]
+    )
+    return result["image"]
+
+
+async def _search(queries: Dict[str, str]) -> main.SearchResults:
+    with metrics.span("pipeline.search"):
+        return await aio.search_many(queries, classes=SEARCH_CLASSES)
+
+
+async def _compute_calculation(
+    main_data: dict, field_data: dict, cache_key: str, cache_key_data: dict
+) -> dict:
+    """pipeline._compute_calculation() with the map and the searches in parallel."""
+    lat: float = main_data["latitude"]
+    lng: float = main_data["longitude"]
+    queries = pipeline.build_search_queries(lat, lng, main_data["plant_type"])
+
+    mapa = await asyncio.to_thread(pipeline.find_map, lat, lng)
+    metrics.cache_hit("map", mapa is not None)
+    stages: Dict[str, str] = {"map": "cached" if mapa else "computed"}
+
+    if mapa:
+        busquedas = await _search(queries)
+    else:
+        mapa, busquedas = await asyncio.gather(get_map(lat, lng), _search(queries))
+    stages.update(busquedas.stages())
+
+    response_data = await analyze(main_data, field_data, mapa, busquedas)
+    stages["analysis"] = "computed"
+
+    incomplete = pipeline.incomplete_response(response_data, stages, busquedas.errors)
+    if incomplete:
+        return incomplete
+
+    document = pipeline.build_cache_document(cache_key, cache_key_data, response_data)
+    await asyncio.to_thread(cache.put_calculation, cache_key, document)
+    print(f"Saved calculation to cache with key: {cache_key} (stages: {stages})")
+
+    return tools.msg(0, "Data calculated successfully", **response_data, stages=stages)
+
+
+async def analyze(main_data: dict, field_data: dict, mapa: str, busquedas: dict) -> dict:
+    """pipeline.analyze() awaiting the model."""
+    with metrics.span("pipeline.analysis"):
+        prompt_param, system_prompt = pipeline.analysis_prompt(
+            main_data, field_data, busquedas
+        )
+        try:
+            ai_response = await aio.prompt(
+                prompt_param, files=[mapa], system_prompt=system_prompt
+            )
+        except Exception as e:
+            # Model slow or unavailable: answer with the local estimate, not cached
+            tools.write_log(f"Analysis model call failed, using local estimate: {e}", 1)
+            return pipeline.local_analysis(main_data, field_data, mapa)
+
+        return pipeline.analysis_result(ai_response, main_data, field_data, mapa)
+
+
+async def _advice_context(
+    main_data: dict, field_data: dict
+) -> Tuple[Optional[str], str, dict, Optional[dict]]:
+    """(map path, cache key, params, matched calculation) for the advice."""
+    path = await asyncio.to_thread(
+        pipeline.find_map, main_data["latitude"], main_data["longitude"]
+    )
+    cache_key, params = pipeline.build_cache_key(main_data, field_data)
+    cached_result = await asyncio.to_thread(pipeline.find_calculation, cache_key, params)
+    if cached_result:
+        # Advice belongs to the matched calculation
+        cache_key = cached_result.get("cache_key", cache_key)
+    return path, cache_key, params, cached_result
+
+
+async def get_advice(main_data: dict, field_data: dict) -> dict:
+    """pipeline.get_advice() (see there for the arguments and result)."""
+    with metrics.span("pipeline.advice"):
+        path, cache_key, params, cached_result = await _advice_context(
+            main_data, field_data
+        )
+        if not path:
+            return tools.msg(1, MAP_NOT_FOUND)
+
+        metrics.cache_hit("advice", bool(cached_result and cached_result.get("advice")))
+        if cached_result and cached_result.get("advice"):
+            print(f"Advice Cache HIT for key: {cache_key}")
+            return tools.msg(
+                0,
+                "Advice retrieved from cache",
+                advice=cached_result["advice"],
+                cache_match=pipeline.cache_match(cached_result, params),
+            )
+
+        print(f"Advice Cache MISS for key: {cache_key}. Generating advice...")
+
+        async def compute() -> dict:
+            prompt_param, system_prompt = pipeline.advice_prompt(
+                main_data, field_data, cached_result
+            )
+            ai_response = await aio.prompt(
+                prompt_param, files=[path], system_prompt=system_prompt
+            )
+            advice = await asyncio.to_thread(pipeline.save_advice, cache_key, ai_response)
+            return tools.msg(0, "Advice generated successfully", advice=advice)
+
+        return await singleflight.do_async(
+            f"advice:{cache_key}", compute, lambda: pipeline.cached_advice(cache_key)
+        )
+
+
+async def stream_advice(main_data: dict, field_data: dict) -> AsyncIterator[Tuple[str, dict]]:
+    """pipeline.stream_advice(): (event, data) pairs for /GetAdviceStream."""
+    path, cache_key, params, cached_result = await _advice_context(main_data, field_data)
+    if not path:
+        yield "done", tools.msg(1, MAP_NOT_FOUND)
+        return
+
+    if cached_result and cached_result.get("advice"):
+        print(f"Advice Cache HIT for key: {cache_key}")
+        yield "chunk", {"text": cached_result["advice"]}
+        yield "done", tools.msg(
+            0,
+            "Advice retrieved from cache",
+            advice=cached_result["advice"],
+            cache_match=pipeline.cache_match(cached_result, params),
+        )
+        return
+
+    print(f"Advice Cache MISS for key: {cache_key}. Streaming advice...")
+
+    async def produce() -> AsyncIterator[Tuple[str, dict]]:
+        prompt_param, system_prompt = pipeline.advice_prompt(
+            main_data, field_data, cached_result
+        )
+        chunks = []
+        try:
+            async for text in aio.prompt_stream(
+                prompt_param, files=[path], system_prompt=system_prompt
+            ):
+                chunks.append(text)
+                yield "chunk", {"text": text}
+        except Exception as e:
+            yield "done", tools.msg_err(e)
+            return
+
+        advice = await asyncio.to_thread(pipeline.save_advice, cache_key, "".join(chunks))
+        yield "done", tools.msg(0, "Advice generated successfully", advice=advice)
+
+    async for event in singleflight.stream_async(
+        f"advice:{cache_key}", produce, lambda: pipeline.cached_advice_events(cache_key)
+    ):
+        yield event
@@ -0,0 +1,114 @@
+"""
+Speculative warm-up of a field's calculation when its inputs are saved.
+
+/SaveMainVariables calls schedule(), which queues pipeline.prefetch() for the
+field: the map capture and the location and crop-demand searches do not
+depend on the field data, so they can run while the user navigates to
+/Principal, whose /Calculate then finds them cached. For the same reason
+/SaveFieldData schedules nothing.
+
+Warm-ups are best effort:
+    - at most PREFETCH_MAX_WORKERS run at once and PREFETCH_MAX_PENDING wait;
+      beyond that new ones are skipped
+    - every schedule() of a field bumps its generation: a queued warm-up of
+      an older generation is cancelled, a running one skips its remaining
+      stages (the stage in progress finishes, its result is cached anyway)
+    - failures are logged and otherwise ignored
+
+Configuration:
+    PREFETCH_ON_SAVE        Enable the warm-up (default true; disable where
+                            background threads do not outlive the request,
+                            e.g. serverless)
+    PREFETCH_MAX_WORKERS    Concurrent warm-ups per process (default 2)
+    PREFETCH_MAX_PENDING    Queued warm-ups per process (default 16)
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import getenv
+from typing import Dict, Optional, Tuple
+import itertools
+import threading
+
+from utils import tools, cache, metrics, pipeline
+
+PREFETCH_ON_SAVE = getenv("PREFETCH_ON_SAVE", "true").lower() in ("1", "true", "yes")
+PREFETCH_MAX_WORKERS = int(getenv("PREFETCH_MAX_WORKERS", "2"))
+PREFETCH_MAX_PENDING = int(getenv("PREFETCH_MAX_PENDING", "16"))
+
+_executor = ThreadPoolExecutor(
+    max_workers=PREFETCH_MAX_WORKERS, thread_name_prefix="prefetch"
+)
+# Running plus queued warm-ups
+_slots = threading.BoundedSemaphore(PREFETCH_MAX_WORKERS + PREFETCH_MAX_PENDING)
+_generations = itertools.count(1)
+_lock = threading.Lock()
+# (owner, field_id) -> (generation, future) of the latest warm-up
+_current: Dict[Tuple[str, str], Tuple[int, Future]] = {}
+
+
+def _field_id(key: dict) -> Tuple[str, str]:
+    return key["owner"], key["field_id"]
+
+
+def _is_current(field: Tuple[str, str], generation: int) -> bool:
+    with _lock:
+        current = _current.get(field)
+    return current is not None and current[0] == generation
+
+
+def _warm_up(field: Tuple[str, str], generation: int, key: dict, main_data: Optional[dict]):
+    def cancelled() -> bool:
+        return not _is_current(field, generation)
+
+    if cancelled():
+        return
+    try:
+        main_data = main_data or cache.get_main_variables(key)
+        if not main_data:
+            return
+        with metrics.span("prefetch"):
+            stages = pipeline.prefetch(main_data, cancelled)
+        print(f"Prefetched field {field[1]} (stages: {stages})")
+    except Exception as e:
+        tools.write_log(f"Prefetch of field {field[1]} failed: {e}", 2)
+
+
+def _finished(field: Tuple[str, str], generation: int):
+    _slots.release()
+    with _lock:
+        current = _current.get(field)
+        if current is not None and current[0] == generation:
+            del _current[field]
+
+
+def schedule(key: dict, main_data: Optional[dict] = None) -> bool:
+    """
+    Queue a warm-up of a field, superseding the previous one.
+
+    Args:
+        key: {"owner": ..., "field_id": ...} (see utils.fields.field_key)
+        main_data: The saved main variables; loaded by the warm-up if omitted
+
+    Returns:
+        False if prefetching is disabled or the queue is full
+    """
+    if not PREFETCH_ON_SAVE:
+        return False
+
+    field = _field_id(key)
+    generation = next(_generations)
+    with _lock:
+        previous = _current.pop(field, None)
+    if previous is not None:
+        # Queued: never runs; running: sees the new generation and stops
+        previous[1].cancel()
+
+    if not _slots.acquire(blocking=False):
+        print(f"Prefetch queue full, skipping field {field[1]}")
+        return False
+
+    with _lock:
+        future = _executor.submit(_warm_up, field, generation, key, main_data)
+        _current[field] = (generation, future)
+    future.add_done_callback(lambda _: _finished(field, generation))
+    return True
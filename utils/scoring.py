@@ -0,0 +1,165 @@
+"""
+Local, deterministic crop-effectiveness estimate (no model call).
+
+Each measurement is turned into a relative yield between 0 and 1 for the crop,
+and the estimate is their product in percent:
+
+    pH, soil moisture     1 inside the optimal range, falling linearly to 0 at
+                          the tolerable limits
+    soil salinity (ECe)   Maas-Hoffman: 1 - slope * (ECe - threshold)
+    water conductivity    same response, with ECe ~= 1.5 * ECw (FAO 29)
+
+Assumed units: conductivity and salinity in dS/m, soil moisture in volumetric
+percent. Missing measurements count as UNMEASURED_FACTOR; `confidence` is the
+share of measurements that were available. Works on NumPy arrays, so thousands of
+fields are scored in one call (see score_arrays / score_fields).
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Crop tolerances (FAO 29 / Maas-Hoffman salinity data, common agronomic ranges)
+CROP_PROFILES: Dict[str, dict] = {
+    "tomate": {
+        "ph": (5.5, 6.0, 6.8, 7.5),  # tolerable min, optimal min, optimal max, tolerable max
+        "moisture": (10, 20, 35, 45),
+        "ece_threshold": 2.5,
+        "ece_slope": 0.099,  # yield fraction lost per dS/m above the threshold
+    },
+    "maiz": {
+        "ph": (5.0, 5.8, 7.0, 8.0),
+        "moisture": (8, 18, 35, 45),
+        "ece_threshold": 1.7,
+        "ece_slope": 0.12,
+    },
+    "lechuga": {
+        "ph": (5.5, 6.0, 7.0, 7.5),
+        "moisture": (12, 22, 38, 48),
+        "ece_threshold": 1.3,
+        "ece_slope": 0.13,
+    },
+}
+
+# Used for crops without a profile
+DEFAULT_PROFILE = {
+    "ph": (5.0, 6.0, 7.0, 8.0),
+    "moisture": (10, 20, 35, 45),
+    "ece_threshold": 2.0,
+    "ece_slope": 0.1,
+}
+
+ECW_TO_ECE = 1.5
+
+# Relative yield assumed for a measurement that was not taken (a typical
+# field rather than the best case)
+UNMEASURED_FACTOR = 0.9
+
+MEASUREMENTS = ("water_ph", "water_conductivity", "soil_salinity", "soil_moisture")
+
+
+def _trapezoid(values: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    """1 inside [opt_min, opt_max], linear to 0 at [tol_min, tol_max]."""
+    tol_min, opt_min, opt_max, tol_max = bounds.T
+    rising = (values - tol_min) / np.maximum(opt_min - tol_min, 1e-9)
+    falling = (tol_max - values) / np.maximum(tol_max - opt_max, 1e-9)
+    return np.clip(np.minimum(rising, falling), 0, 1)
+
+
+def _salinity(ece: np.ndarray, threshold: np.ndarray, slope: np.ndarray) -> np.ndarray:
+    return np.clip(1 - slope * np.maximum(ece - threshold, 0), 0, 1)
+
+
+def _profiles(plant_types: np.ndarray) -> Dict[str, np.ndarray]:
+    """Per-field profile parameters as arrays (one lookup per distinct crop)."""
+    crops, index = np.unique(plant_types.astype(str), return_inverse=True)
+    profiles = [CROP_PROFILES.get(crop.lower(), DEFAULT_PROFILE) for crop in crops]
+    table = {
+        "ph": np.array([p["ph"] for p in profiles], dtype=float),
+        "moisture": np.array([p["moisture"] for p in profiles], dtype=float),
+        "ece_threshold": np.array([p["ece_threshold"] for p in profiles], dtype=float),
+        "ece_slope": np.array([p["ece_slope"] for p in profiles], dtype=float),
+    }
+    return {name: values[index] for name, values in table.items()}
+
+
+def score_arrays(
+    plant_type,
+    water_ph,
+    water_conductivity,
+    soil_salinity,
+    soil_moisture,
+) -> Dict[str, np.ndarray]:
+    """
+    Effectiveness estimates for many fields at once.
+
+    Args:
+        plant_type: Crop of each field
+        water_ph, water_conductivity, soil_salinity, soil_moisture:
+            Measurements of each field (NaN where missing)
+
+    Returns:
+        {"effectiveness": percent 0-100, "confidence": 0-1, and one relative
+        yield array per measurement}
+    """
+    plant_type = np.atleast_1d(np.asarray(plant_type, dtype=object))
+    measured = {
+        name: np.atleast_1d(np.asarray(values, dtype=float))
+        for name, values in zip(
+            MEASUREMENTS, (water_ph, water_conductivity, soil_salinity, soil_moisture)
+        )
+    }
+    profile = _profiles(plant_type)
+
+    factors = {
+        "water_ph": _trapezoid(measured["water_ph"], profile["ph"]),
+        "water_conductivity": _salinity(
+            measured["water_conductivity"] * ECW_TO_ECE,
+            profile["ece_threshold"],
+            profile["ece_slope"],
+        ),
+        "soil_salinity": _salinity(
+            measured["soil_salinity"], profile["ece_threshold"], profile["ece_slope"]
+        ),
+        "soil_moisture": _trapezoid(measured["soil_moisture"], profile["moisture"]),
+    }
+
+    available = np.stack([~np.isnan(measured[name]) for name in MEASUREMENTS])
+    stacked = np.stack([factors[name] for name in MEASUREMENTS])
+    stacked = np.where(available, stacked, UNMEASURED_FACTOR)
+
+    return {
+        "effectiveness": np.round(stacked.prod(axis=0) * 100, 1),
+        "confidence": available.mean(axis=0),
+        **factors,
+    }
+
+
+def _value(doc: dict, name: str) -> float:
+    value = doc.get(name)
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def score_fields(fields: List[dict]) -> Dict[str, np.ndarray]:
+    """score_arrays() for a list of documents with plant_type and measurements."""
+    return score_arrays(
+        [f.get("plant_type") for f in fields],
+        *([_value(f, name) for f in fields] for name in MEASUREMENTS),
+    )
+
+
+def estimate(main_data: dict, field_data: Optional[dict] = None) -> dict:
+    """
+    Estimate for one field.
+
+    Returns:
+        {"efectividad_cultivo": "72", "confidence": 0.75}
+    """
+    result = score_fields([{**(field_data or {}), "plant_type": main_data.get("plant_type")}])
+    return {
+        "efectividad_cultivo": str(int(round(result["effectiveness"][0]))),
+        "confidence": round(float(result["confidence"][0]), 2),
+    }
@@ -0,0 +1,363 @@
+"""
+Single-flight coordination for expensive cache misses.
+
+Only one computation runs per key at a time: inside a process, concurrent
+callers wait for the first one and share its result; across gunicorn workers,
+the computing process holds a lease document in leases_col and the others
+poll the result store until it appears (or the lease is released/expires).
+
+    {"_id": "calculate:<cache_key>", "owner": "...", "expires_at": ...}
+
+Usage:
+    result = singleflight.do(key, compute, lookup)
+    result = await singleflight.do_async(key, compute_async, lookup)
+    for item in singleflight.stream(key, produce, lookup): ...
+    async for item in singleflight.stream_async(key, produce_async, lookup): ...
+
+`lookup()` returns the stored result or None; `compute()` produces (and
+stores) it. In do_async, `compute` is a coroutine function and the waits do
+not block the event loop. For streamed results (e.g. model output), the
+leader yields the items of `produce()` as they come and `lookup()` returns
+the stored result as a list of items, which the other callers yield.
+"""
+
+from datetime import datetime, timedelta
+from os import getenv
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional
+import asyncio
+import threading
+import time
+
+from pymongo.errors import DuplicateKeyError
+
+from utils.conexion import leases_col, GenerateUuid, utcnow
+
+SINGLEFLIGHT_LEASE_SECONDS = int(getenv("SINGLEFLIGHT_LEASE_SECONDS", "60"))
+SINGLEFLIGHT_WAIT_SECONDS = float(getenv("SINGLEFLIGHT_WAIT_SECONDS", "180"))
+SINGLEFLIGHT_POLL_INTERVAL = float(getenv("SINGLEFLIGHT_POLL_INTERVAL", "0.5"))
+
+# Identifies this process as a lease owner
+_OWNER = GenerateUuid()
+
+_indexes_ready = False
+_lock = threading.Lock()
+_calls: Dict[str, "_Call"] = {}
+# In-flight do_async() computations of this process (event loop thread only)
+_async_calls: Dict[str, asyncio.Future] = {}
+
+
+class _Call:
+    """An in-flight computation that other threads of this process can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _Lease:
+    """Cross-worker lease on a key, renewed in the background while held."""
+
+    def __init__(self, key: str, ttl: int = SINGLEFLIGHT_LEASE_SECONDS):
+        self.key = key
+        self.ttl = ttl
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _expiry(self) -> datetime:
+        return utcnow() + timedelta(seconds=self.ttl)
+
+    def acquire(self) -> bool:
+        """Take the lease if it is free or expired; False if another owner holds it."""
+        try:
+            leases_col.update_one(
+                {"_id": self.key, "expires_at": {"$lt": utcnow()}},
+                {"$set": {"owner": _OWNER, "expires_at": self._expiry()}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # The lease document exists and has not expired
+            return False
+
+        self._thread = threading.Thread(target=self._renew, daemon=True)
+        self._thread.start()
+        return True
+
+    def _renew(self):
+        while not self._stop.wait(self.ttl / 3):
+            leases_col.update_one(
+                {"_id": self.key, "owner": _OWNER},
+                {"$set": {"expires_at": self._expiry()}},
+            )
+
+    def release(self):
+        self._stop.set()
+        leases_col.delete_one({"_id": self.key, "owner": _OWNER})
+
+
+def _ensure_indexes():
+    global _indexes_ready
+    if not _indexes_ready:
+        leases_col.create_index("expires_at", expireAfterSeconds=0)
+        _indexes_ready = True
+
+
+def _lead(
+    key: str,
+    compute: Callable[[], Any],
+    lookup: Callable[[], Any],
+    wait_seconds: float,
+) -> Any:
+    """Run `compute` under the cross-worker lease, or wait for another worker's result."""
+    _ensure_indexes()
+    deadline = time.monotonic() + wait_seconds
+
+    while True:
+        lease = _Lease(key)
+        if lease.acquire():
+            try:
+                # Another worker may have finished between our miss and the lease
+                result = lookup()
+                if result is not None:
+                    return result
+                return compute()
+            finally:
+                lease.release()
+
+        if time.monotonic() >= deadline:
+            # Give up waiting rather than failing the request
+            return compute()
+
+        time.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+        result = lookup()
+        if result is not None:
+            return result
+
+
+def do(
+    key: str,
+    compute: Callable[[], Any],
+    lookup: Callable[[], Any],
+    wait_seconds: float = SINGLEFLIGHT_WAIT_SECONDS,
+) -> Any:
+    """
+    Run `compute` at most once per key across threads and workers.
+
+    Args:
+        key: Deduplication key (e.g. "calculate:<cache_key>")
+        compute: Produces and stores the result
+        lookup: Returns the stored result, or None if it is not there yet
+        wait_seconds: How long to wait for another worker before computing anyway
+
+    Returns:
+        The computed result, or the one produced by the concurrent leader.
+    """
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _Call()
+            _calls[key] = call
+
+    if not leader:
+        if not call.done.wait(wait_seconds):
+            return compute()
+        if call.error is not None:
+            raise call.error
+        if call.result is None:
+            # Led by stream(), which stores its result instead of returning it
+            result = lookup()
+            return result if result is not None else compute()
+        return call.result
+
+    try:
+        call.result = _lead(key, compute, lookup, wait_seconds)
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            _calls.pop(key, None)
+        call.done.set()
+
+
+async def _lead_async(
+    key: str,
+    compute: Callable[[], Awaitable[Any]],
+    lookup: Callable[[], Any],
+    wait_seconds: float,
+) -> Any:
+    """_lead() for do_async: Mongo calls run in threads, polling uses asyncio.sleep."""
+    await asyncio.to_thread(_ensure_indexes)
+    deadline = time.monotonic() + wait_seconds
+
+    while True:
+        lease = _Lease(key)
+        if await asyncio.to_thread(lease.acquire):
+            try:
+                result = await asyncio.to_thread(lookup)
+                if result is not None:
+                    return result
+                return await compute()
+            finally:
+                await asyncio.to_thread(lease.release)
+
+        if time.monotonic() >= deadline:
+            return await compute()
+
+        await asyncio.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+        result = await asyncio.to_thread(lookup)
+        if result is not None:
+            return result
+
+
+async def do_async(
+    key: str,
+    compute: Callable[[], Awaitable[Any]],
+    lookup: Callable[[], Any],
+    wait_seconds: float = SINGLEFLIGHT_WAIT_SECONDS,
+) -> Any:
+    """do() for coroutines: concurrent tasks of this process share one computation."""
+    call = _async_calls.get(key)
+    if call is not None:
+        # asyncio.wait neither raises nor cancels `call` when it gives up
+        done, _ = await asyncio.wait({call}, timeout=wait_seconds)
+        if not done or call.cancelled():
+            return await compute()
+        result = call.result()
+        if result is None:
+            # Led by stream_async(), which stores its result instead
+            result = await asyncio.to_thread(lookup)
+            if result is None:
+                return await compute()
+        return result
+
+    call = asyncio.get_running_loop().create_future()
+    # The error is re-raised to the leader; do not warn if no task waited
+    call.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _async_calls[key] = call
+    try:
+        result = await _lead_async(key, compute, lookup, wait_seconds)
+        call.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        # The leader's request went away; waiters compute on their own
+        call.cancel()
+        raise
+    except BaseException as e:
+        call.set_exception(e)
+        raise
+    finally:
+        _async_calls.pop(key, None)
+
+
+def stream(
+    key: str,
+    produce: Callable[[], Iterator[Any]],
+    lookup: Callable[[], Optional[list]],
+    wait_seconds: float = SINGLEFLIGHT_WAIT_SECONDS,
+) -> Iterator[Any]:
+    """
+    do() for streamed results: only the leader runs `produce()` (which stores
+    the result once complete) and yields its items as they come; concurrent
+    callers of this process and other workers wait and yield the items
+    `lookup()` returns. A caller that waits too long, or finds nothing stored
+    (e.g. the leader failed), produces on its own.
+    """
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _Call()
+            _calls[key] = call
+
+    if not leader:
+        call.done.wait(wait_seconds)
+        result = lookup()
+        yield from (result if result is not None else produce())
+        return
+
+    try:
+        _ensure_indexes()
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            lease = _Lease(key)
+            if lease.acquire():
+                try:
+                    result = lookup()
+                    yield from (result if result is not None else produce())
+                finally:
+                    lease.release()
+                return
+
+            if time.monotonic() >= deadline:
+                yield from produce()
+                return
+
+            time.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+            result = lookup()
+            if result is not None:
+                yield from result
+                return
+    finally:
+        with _lock:
+            _calls.pop(key, None)
+        call.done.set()
+
+
+async def stream_async(
+    key: str,
+    produce: Callable[[], AsyncIterator[Any]],
+    lookup: Callable[[], Optional[list]],
+    wait_seconds: float = SINGLEFLIGHT_WAIT_SECONDS,
+) -> AsyncIterator[Any]:
+    """stream() for async generators; the waits do not block the event loop."""
+    call = _async_calls.get(key)
+    if call is not None:
+        await asyncio.wait({call}, timeout=wait_seconds)
+        result = await asyncio.to_thread(lookup)
+        if result is not None:
+            for item in result:
+                yield item
+        else:
+            async for item in produce():
+                yield item
+        return
+
+    call = asyncio.get_running_loop().create_future()
+    _async_calls[key] = call
+    try:
+        await asyncio.to_thread(_ensure_indexes)
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            lease = _Lease(key)
+            if await asyncio.to_thread(lease.acquire):
+                try:
+                    result = await asyncio.to_thread(lookup)
+                    if result is not None:
+                        for item in result:
+                            yield item
+                    else:
+                        async for item in produce():
+                            yield item
+                finally:
+                    await asyncio.to_thread(lease.release)
+                return
+
+            if time.monotonic() >= deadline:
+                async for item in produce():
+                    yield item
+                return
+
+            await asyncio.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+            result = await asyncio.to_thread(lookup)
+            if result is not None:
+                for item in result:
+                    yield item
+                return
+    finally:
+        _async_calls.pop(key, None)
+        if not call.done():
+            # Waiters read the stored result with lookup()
+            call.set_result(None)
@@ -0,0 +1,122 @@
+"""
+Tolerance bands for calculation inputs.
+
+Sensor readings jitter: pH 6.50 and 6.51 should not cost a new analysis. Each
+numeric input has a band width, and inputs are snapped to their band before
+the cache key is hashed (see pipeline.build_cache_key):
+
+    quantize({"water_ph": 6.51, "width": 50.01, ...})
+    # -> {"water_ph": 6.5, "width": 50.0, ...}
+
+Values near a band edge can still fall on different sides of it, so an
+optional nearest-match lookup (CACHE_NEAREST_MATCH) also accepts a stored
+calculation whose input_params are within CACHE_NEAREST_MAX_DISTANCE bands of
+the current inputs on every field.
+
+Configuration:
+    CACHE_TOLERANCE_<FIELD>        Band width of an input, e.g.
+                                   CACHE_TOLERANCE_WATER_PH=0.2 (0 = exact)
+    CACHE_NEAREST_MATCH            Enable the nearest-match lookup (default false)
+    CACHE_NEAREST_MAX_DISTANCE     Maximum distance in bands (default 1)
+"""
+
+from os import getenv
+from typing import Dict, Optional, Tuple
+import math
+
+from utils.conexion import calculated_data_col
+
+_DEFAULT_TOLERANCES = {
+    "width": 1.0,  # m
+    "length": 1.0,  # m
+    "latitude": 0.001,  # ~110 m
+    "longitude": 0.001,
+    "water_ph": 0.1,
+    "water_conductivity": 0.1,
+    "soil_salinity": 0.1,
+    "soil_moisture": 1.0,  # %
+}
+
+TOLERANCES: Dict[str, float] = {
+    name: float(getenv(f"CACHE_TOLERANCE_{name.upper()}", str(default)))
+    for name, default in _DEFAULT_TOLERANCES.items()
+}
+
+CACHE_NEAREST_MATCH = getenv("CACHE_NEAREST_MATCH", "false").lower() in ("1", "true", "yes")
+CACHE_NEAREST_MAX_DISTANCE = float(getenv("CACHE_NEAREST_MAX_DISTANCE", "1"))
+
+# Candidates compared per nearest-match lookup
+_CANDIDATES = 50
+
+
+def _decimals(step: float) -> int:
+    return max(0, len(f"{step:.10f}".rstrip("0").split(".")[1]))
+
+
+def _number(value) -> Optional[float]:
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def quantize(params: dict) -> dict:
+    """Copy of `params` with every numeric input snapped to its band."""
+    quantized = dict(params)
+    for name, step in TOLERANCES.items():
+        value = _number(params.get(name))
+        if value is None or step <= 0:
+            continue
+        quantized[name] = round(round(value / step) * step, _decimals(step))
+    return quantized
+
+
+def distance(params: dict, other: dict) -> float:
+    """
+    Largest difference between two sets of inputs, in bands.
+
+    Inputs without a band (e.g. plant_type) must be equal; otherwise, or if
+    only one side has a value, the distance is infinite.
+    """
+    result = 0.0
+    for name in set(params) | set(other):
+        a, b = params.get(name), other.get(name)
+        step = TOLERANCES.get(name, 0)
+        x, y = _number(a), _number(b)
+        if step > 0 and x is not None and y is not None:
+            result = max(result, abs(x - y) / step)
+        elif a != b:
+            return math.inf
+    return round(result, 3)
+
+
+def nearest(
+    params: dict, max_distance: float = CACHE_NEAREST_MAX_DISTANCE
+) -> Optional[Tuple[dict, float]]:
+    """
+    The stored calculation closest to `params`, if within `max_distance` bands.
+
+    Returns:
+        (calculated_data_col document without _id, distance) or None
+    """
+    query = {"calculated_at": {"$exists": True}}
+    for name, value in params.items():
+        step = TOLERANCES.get(name, 0)
+        number = _number(value)
+        if step > 0 and number is not None:
+            margin = max_distance * step
+            query[f"input_params.{name}"] = {
+                "$gte": number - margin,
+                "$lte": number + margin,
+            }
+        else:
+            query[f"input_params.{name}"] = value
+
+    best = None
+    for doc in calculated_data_col.find(query, {"_id": 0}).limit(_CANDIDATES):
+        d = distance(params, doc.get("input_params") or {})
+        if d <= max_distance and (best is None or d < best[1]):
+            best = (doc, d)
+    return best
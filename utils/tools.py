@@ -1,8 +1,138 @@
-from typing import Union, Any
+from typing import Union, Any, Dict, List, Optional
 from datetime import datetime
+from os import getenv
 from bson import ObjectId
 from utils.conexion import log_col, GenerateUuid
+from utils import metrics
+import atexit
+import json
+import queue
 import sys
+import threading
+import time
+
+LOG_QUEUE_SIZE = int(getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(getenv("LOG_BATCH_SIZE", "100"))
+LOG_FLUSH_INTERVAL = float(getenv("LOG_FLUSH_INTERVAL", "2"))
+LOG_OVERFLOW = getenv("LOG_OVERFLOW", "drop")  # "drop" or "block"
+
+
+class LogSink:
+    """
+    Non-blocking writer for log documents.
+
+    Documents are queued (bounded by `maxsize`) and a background thread
+    inserts them with insert_many once `batch_size` are pending or every
+    `flush_interval` seconds. When the queue is full, `overflow="drop"`
+    discards the record and `overflow="block"` waits for room. Pending
+    records are flushed at interpreter exit (gunicorn worker shutdown).
+    Outcomes are counted in log_records_total{result=...} (utils.metrics).
+    """
+
+    def __init__(
+        self,
+        collection,
+        maxsize: int = LOG_QUEUE_SIZE,
+        batch_size: int = LOG_BATCH_SIZE,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+        overflow: str = LOG_OVERFLOW,
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _start(self):
+        # Started lazily so the thread belongs to the (forked) worker process
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="log-sink", daemon=True
+                )
+                self._thread.start()
+
+    def put(self, doc: dict) -> bool:
+        """Queue a log document; False if it was dropped because the queue is full."""
+        self._start()
+        try:
+            if self.overflow == "block":
+                self._queue.put(doc)
+            else:
+                self._queue.put_nowait(doc)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            metrics.log_records("dropped")
+            return False
+
+    def _write(self, batch: List[dict]):
+        if not batch:
+            return
+        try:
+            self.collection.insert_many(batch, ordered=False)
+            self.written += len(batch)
+            metrics.log_records("written", len(batch))
+        except Exception as e:
+            self.failed += len(batch)
+            metrics.log_records("failed", len(batch))
+            print(f"\033[91mFailed to write {len(batch)} log records: {e}\033[0m")
+
+    def _run(self):
+        batch: List[dict] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, threading.Event):
+                # flush() marker: write everything queued before it
+                self._write(batch)
+                batch = []
+                item.set()
+                continue
+
+            if item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def flush(self, timeout: float = 5) -> bool:
+        """Block until everything queued so far is written (or timeout)."""
+        if self._thread is None or not self._thread.is_alive():
+            # Nothing started in this process (e.g. a forked worker that never logged)
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    close = flush
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+log_sink = LogSink(log_col)
 
 
 def write_log(msg: Union[str, Exception] = "", status: Union[int, str] = 0):
@@ -39,8 +169,8 @@ def write_log(msg: Union[str, Exception] = "", status: Union[int, str] = 0):
         "message": f"[{timestamp.strftime('%Y-%m-%d %H:%M:%S')}] {message}\n",
     }
 
-    # Insert into database
-    log_col.insert_one(log_doc)
+    # Queue for a batched, non-blocking insert (see LogSink)
+    log_sink.put(log_doc)
 
     # Keep console output for debugging
     formatted_message = f"[{timestamp.strftime('%Y-%m-%d %H:%M:%S')}] {message}\n"
@@ -69,6 +199,11 @@ def msg_err(exception: Exception):
     return msg(1, exception, log=True)
 
 
+def sse(event: str, data: dict) -> str:
+    """One Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
 def parse_ids(data: Union[dict, list]):
     if isinstance(data, dict):
         return {k: str(v) if isinstance(v, ObjectId) else v for k, v in data.items()}